@@ -1,13 +1,37 @@
 import streamlit as st
-from langchain.llms import LlamaCpp
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
+import streamlit.components.v1 as components
+import hashlib
+import html
 import os
 from typing import Optional
 import random
 import time
+import uuid
 from datetime import datetime
 
+from conversation_store import ConversationStore
+from generation_jobs import DONE, STOPPED, JobManager
+from history_db import ConversationDB
+from model_loader import PHASES
+from model_router import LARGE, ModelRegistry, ModelTier, route_turn
+from persona import (
+    DEFAULT_SETTINGS, MOOD_OPTIONS, QUICK_ACTIONS, RESPONSE_LENGTHS, build_persona, response_token_budget,
+    settings_fingerprint
+)
+from response_cache import ResponseCache
+from scheduler import InferenceScheduler, QueueFull, priority_for
+from session_manager import ChatSession, SessionManager
+from static_assets import build_stylesheet, stylesheet_loader_html
+from telemetry import Telemetry, TurnMetrics
+
+# LangChain and llama.cpp take seconds to import; they are imported by the
+# model loader thread and by the functions that use them, so the page can
+# render first
+DEFERRED_IMPORTS = (
+    "langchain.llms", "conversation", "session_engine", "persona_snapshots", "prefetch", "worker_pool",
+    "speculative", "hardware_profile", "long_term_memory"
+)
+
 # Page configuration
 st.set_page_config(
     page_title="IyadBot - Your Smart AI Bestie",
@@ -16,477 +40,519 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Enhanced CSS with modern design
-st.markdown("""
-<style>
-    /* Import Google Fonts */
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-    
-    /* Global Styles */
-    .main .block-container {
-        padding-top: 1rem;
-        max-width: 1200px;
-    }
-    
-    * {
-        font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-    }
-    
-    /* Hide Streamlit branding */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-    
-    /* Main header with glassmorphism */
-    .main-header {
-        background: linear-gradient(135deg, rgba(102, 126, 234, 0.1) 0%, rgba(118, 75, 162, 0.1) 100%);
-        backdrop-filter: blur(20px);
-        border: 1px solid rgba(255, 255, 255, 0.18);
-        border-radius: 20px;
-        padding: 2rem;
-        text-align: center;
-        margin-bottom: 2rem;
-        box-shadow: 0 8px 32px rgba(0, 0, 0, 0.1);
-    }
-    
-    .main-header h1 {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        font-size: 2.5rem;
-        font-weight: 700;
-        margin: 0;
-        letter-spacing: -0.02em;
-    }
-    
-    .main-header p {
-        color: #64748b;
-        font-size: 1.1rem;
-        margin: 0.5rem 0 0 0;
-        font-weight: 400;
-    }
-    
-    /* Chat container with modern design */
-    .chat-container {
-        background: white;
-        border-radius: 20px;
-        box-shadow: 0 4px 20px rgba(0, 0, 0, 0.08);
-        border: 1px solid #e2e8f0;
-        overflow: hidden;
-        margin-bottom: 1rem;
-    }
-    
-    .chat-header {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 1rem 1.5rem;
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-    }
-    
-    .chat-status {
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-        font-size: 0.9rem;
-        opacity: 0.9;
-    }
-    
-    .status-dot {
-        width: 8px;
-        height: 8px;
-        background: #10b981;
-        border-radius: 50%;
-        animation: pulse 2s infinite;
-    }
-    
-    @keyframes pulse {
-        0%, 100% { opacity: 1; }
-        50% { opacity: 0.5; }
-    }
-    
-    /* Chat messages with improved design */
-    .chat-messages {
-        max-height: 500px;
-        overflow-y: auto;
-        padding: 1rem;
-        background: #fafafa;
-    }
-    
-    .chat-messages::-webkit-scrollbar {
-        width: 6px;
-    }
-    
-    .chat-messages::-webkit-scrollbar-track {
-        background: #f1f1f1;
-        border-radius: 10px;
-    }
-    
-    .chat-messages::-webkit-scrollbar-thumb {
-        background: #c1c1c1;
-        border-radius: 10px;
-    }
-    
-    .message {
-        margin-bottom: 1rem;
-        animation: slideIn 0.3s ease-out;
-    }
-    
-    @keyframes slideIn {
-        from { opacity: 0; transform: translateY(10px); }
-        to { opacity: 1; transform: translateY(0); }
-    }
-    
-    .message-user {
-        display: flex;
-        justify-content: flex-end;
-    }
-    
-    .message-bot {
-        display: flex;
-        justify-content: flex-start;
-    }
-    
-    .message-bubble {
-        max-width: 80%;
-        padding: 1rem 1.25rem;
-        border-radius: 18px;
-        font-size: 0.95rem;
-        line-height: 1.5;
-        word-wrap: break-word;
-    }
-    
-    .message-bubble-user {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border-bottom-right-radius: 4px;
-    }
-    
-    .message-bubble-bot {
-        background: white;
-        color: #1e293b;
-        border: 1px solid #e2e8f0;
-        border-bottom-left-radius: 4px;
-        box-shadow: 0 2px 8px rgba(0, 0, 0, 0.05);
-    }
-    
-    .message-avatar {
-        width: 32px;
-        height: 32px;
-        border-radius: 50%;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-size: 1rem;
-        margin: 0 0.75rem;
-        flex-shrink: 0;
-    }
-    
-    .avatar-user {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-    }
-    
-    .avatar-bot {
-        background: #f1f5f9;
-        color: #64748b;
-    }
-    
-    /* Input area with modern design */
-    .input-container {
-        background: white;
-        border-radius: 20px;
-        box-shadow: 0 4px 20px rgba(0, 0, 0, 0.08);
-        border: 1px solid #e2e8f0;
-        padding: 1.5rem;
-        margin-bottom: 1rem;
-    }
-    
-    /* Typing indicator */
-    .typing-indicator {
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-        padding: 1rem;
-        color: #64748b;
-        font-style: italic;
-    }
-    
-    .typing-dots {
-        display: flex;
-        gap: 4px;
-    }
-    
-    .typing-dot {
-        width: 6px;
-        height: 6px;
-        border-radius: 50%;
-        background: #94a3b8;
-        animation: typing 1.4s infinite;
-    }
-    
-    .typing-dot:nth-child(2) { animation-delay: 0.2s; }
-    .typing-dot:nth-child(3) { animation-delay: 0.4s; }
-    
-    @keyframes typing {
-        0%, 60%, 100% { transform: translateY(0); }
-        30% { transform: translateY(-10px); }
-    }
-    
-    /* Sidebar styles */
-    .sidebar-content {
-        background: white;
-        border-radius: 15px;
-        padding: 1.5rem;
-        margin-bottom: 1rem;
-        box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
-        border: 1px solid #e2e8f0;
-    }
-    
-    .sidebar-header {
-        font-weight: 600;
-        color: #1e293b;
-        margin-bottom: 1rem;
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-    }
-    
-    /* Quick actions */
-    .quick-actions {
-        display: flex;
-        gap: 0.5rem;
-        flex-wrap: wrap;
-        margin-bottom: 1rem;
-    }
-    
-    .quick-action-btn {
-        background: #f8fafc;
-        border: 1px solid #e2e8f0;
-        color: #475569;
-        padding: 0.5rem 1rem;
-        border-radius: 12px;
-        font-size: 0.85rem;
-        cursor: pointer;
-        transition: all 0.2s ease;
-        text-decoration: none;
-    }
-    
-    .quick-action-btn:hover {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border-color: transparent;
-        transform: translateY(-1px);
-    }
-    
-    /* Stats cards */
-    .stats-grid {
-        display: grid;
-        grid-template-columns: 1fr 1fr;
-        gap: 0.75rem;
-        margin: 1rem 0;
-    }
-    
-    .stat-card {
-        background: #f8fafc;
-        border: 1px solid #e2e8f0;
-        border-radius: 12px;
-        padding: 1rem;
-        text-align: center;
-    }
-    
-    .stat-number {
-        font-size: 1.5rem;
-        font-weight: 600;
-        color: #667eea;
-        margin: 0;
-    }
-    
-    .stat-label {
-        font-size: 0.8rem;
-        color: #64748b;
-        margin: 0;
-    }
-    
-    /* Responsive design */
-    @media (max-width: 768px) {
-        .main-header h1 {
-            font-size: 2rem;
-        }
-        
-        .message-bubble {
-            max-width: 90%;
-            font-size: 0.9rem;
-        }
-        
-        .stats-grid {
-            grid-template-columns: 1fr;
-        }
-    }
-</style>
-""", unsafe_allow_html=True)
+MODEL_PATH = "models/mistral-7b-instruct-v0.1.Q4_K_M.gguf"
 
-def get_dynamic_personality():
-    """Generate dynamic personality based on current settings"""
-    energy_level = st.session_state.get('energy_level', 7)
-    reference_frequency = st.session_state.get('reference_frequency', 5)
-    response_length = st.session_state.get('response_length', 'Balanced')
-    use_emojis = st.session_state.get('use_emojis', True)
-    current_mood = st.session_state.get('iyad_mood', '✨ Hype Beast')
+# Cheap turns (quick actions, greetings, short replies) are answered by a
+# small model when one is installed; it loads the first time such a turn
+# comes in, and the 7B answers until it is ready
+SMALL_MODEL_PATH = os.environ.get("IYADBOT_SMALL_MODEL", "models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf")
+MODEL_TIERS = [
+    ModelTier("small", "TinyLlama 1.1B", SMALL_MODEL_PATH),
+    ModelTier(LARGE, "Mistral 7B", MODEL_PATH),
+]
 
-    energy_descriptions = {
-        1: "very calm and zen", 2: "relaxed and chill", 3: "laid-back", 
-        4: "casual", 5: "balanced", 6: "upbeat", 7: "energetic", 
-        8: "very enthusiastic", 9: "super hyped", 10: "maximum energy"
-    }
-    
-    reference_descriptions = {
-        1: "rarely", 2: "occasionally", 3: "sometimes", 4: "moderately", 
-        5: "regularly", 6: "frequently", 7: "often", 8: "very often", 
-        9: "constantly", 10: "in every response"
-    }
-    
-    length_descriptions = {
-        'Short & Sweet': 'Keep responses brief and to the point.',
-        'Balanced': 'Use moderate length responses.',
-        'Detailed': 'Provide comprehensive and detailed responses.'
-    }
+# Speculative decoding: a small GGUF with the same vocabulary drafts
+# SPECULATIVE_TOKENS tokens at a time for the main model to verify. Without a
+# (compatible) draft model the app decodes normally. In-process backend only.
+DRAFT_MODEL_PATH = os.environ.get("IYADBOT_DRAFT_MODEL", "models/draft.gguf")
+SPECULATIVE_TOKENS = 8
+
+# "inprocess" runs llama.cpp inside Streamlit, "pool" runs model replicas in
+# local worker processes pinned to their own cores
+INFERENCE_BACKEND = os.environ.get("IYADBOT_BACKEND", "inprocess")
+POOL_WORKERS = int(os.environ.get("IYADBOT_WORKERS", "2"))
+
+# llama.cpp threads and batch size are calibrated for this machine and model
+# once, saved here, and calibrated again when the CPU topology or model changes.
+# Models load with one thread per physical core until a profile is saved; it is
+# calibrated in the background once the main model is ready (not with
+# IYADBOT_AUTOTUNE=0; `python hardware_profile.py` calibrates by hand)
+HARDWARE_PROFILE_PATH = os.path.join("cache", "hardware_profile.json")
+AUTOTUNE = os.environ.get("IYADBOT_AUTOTUNE", "1") != "0"
+
+# Memory footprint of each model instance: with IYADBOT_N_CTX=auto the context
+# is the largest that fits in the available RAM (for every pool worker), the
+# KV cache is quantized where llama-cpp-python supports it (without that, the
+# context stays at the default 2048 tokens), and the weights are
+# mmap'd (shared between workers) unless IYADBOT_MMAP=0. IYADBOT_MLOCK=1 keeps
+# them from being paged out. `python memory_profile.py` prints the sizing report
+N_CTX = os.environ.get("IYADBOT_N_CTX", "auto")
+KV_CACHE_TYPE = os.environ.get("IYADBOT_KV_TYPE", "q8_0")
+USE_MMAP = os.environ.get("IYADBOT_MMAP", "1") != "0"
+USE_MLOCK = os.environ.get("IYADBOT_MLOCK", "0") == "1"
+
+# Evaluated persona prefixes are kept on disk so fresh sessions skip their prompt eval
+KV_SNAPSHOT_DIR = os.path.join("cache", "kv")
+KV_SNAPSHOT_MAX_BYTES = int(os.environ.get("IYADBOT_KV_SNAPSHOT_MAX_BYTES", 2 << 30))
+
+# Render tokens into the chat as they are generated instead of waiting for the full reply
+STREAM_RESPONSES = True
+
+# Replies are generated by background jobs; the page polls them this often, and
+# a job whose page stopped polling for GENERATION_ABANDON_SECONDS is cancelled
+GENERATION_POLL_SECONDS = 0.2
+GENERATION_ABANDON_SECONDS = 15
+
+# Recent history lines a cached free-text reply must match to be reused
+RESPONSE_CACHE_HISTORY_LINES = 4
+
+# Seconds without a message before Quick Action replies are pre-generated
+PREFETCH_IDLE_SECONDS = 20
+
+# Chat history is rendered in fixed pages of messages; only the most recent
+# pages are shown until the user asks for older ones
+CHAT_PAGE_SIZE = 10
+CHAT_VISIBLE_PAGES = 3
+
+# Conversations are saved here and reopened from the session id in the page URL;
+# a reopened session loads only its most recent pages
+HISTORY_DB_PATH = os.environ.get("IYADBOT_HISTORY_DB", os.path.join("cache", "conversations.db"))
+HISTORY_RESTORE_MESSAGES = CHAT_PAGE_SIZE * CHAT_VISIBLE_PAGES
 
-    energy_desc = energy_descriptions.get(min(energy_level, 10), "balanced")
-    reference_desc = reference_descriptions.get(min(reference_frequency, 10), "regularly")
-    length_desc = length_descriptions.get(response_length, 'Use moderate length responses.')
-    emoji_note = "Use emojis naturally to enhance your responses! ✨" if use_emojis else "Keep emoji use minimal."
-
-    return f"""You are IyadBot, Iyad's personalized AI bestie! 🤖✨
-
-ABOUT IYAD:
-- Passionate Genshin Impact fan who loves exploring Teyvat 🏔️
-- Idol music enthusiast with great taste in J-pop and K-pop 🎵
-- Proud pet parent to Noah & Milo - they're the cutest! 🐾
-- Positive vibes only - loves hyping up friends and spreading joy 🌟
-- Enjoys deep conversations about life, music, gaming, and dreams 💭
-- Always up for discussing favorite characters, songs, and gaming strategies 🎮
-
-YOUR PERSONALITY RIGHT NOW:
-- Energy Level: {energy_desc} (Current mood: {current_mood})
-- Mention Iyad's interests: {reference_desc}
-- Response Style: {length_desc}
-- Emoji Usage: {emoji_note}
-
-CONVERSATION GUIDELINES:
-- Be supportive, enthusiastic, and genuinely interested in conversations
-- Reference Iyad's interests naturally when relevant
-- Ask engaging follow-up questions to keep conversations flowing
-- Share excitement about Genshin updates, new idol releases, or pet stories
-- Be the kind of friend who always has your back and celebrates wins
-- Match the energy level and mood specified above
-- Remember past conversations and build on them naturally
-
-Remember: You're not just an AI - you're Iyad's digital bestie who truly cares! 💙"""
+# Per-turn metrics in Prometheus text format, rewritten after every turn;
+# set IYADBOT_METRICS_PORT to also serve them at http://127.0.0.1:<port>/metrics
+METRICS_PATH = os.path.join("cache", "metrics.prom")
+METRICS_PORT = os.environ.get("IYADBOT_METRICS_PORT")
+
+# Upper bound on history tokens per prompt (None = whatever fits next to the persona and reply).
+# Older turns are recalled from long-term memory when relevant instead, so the
+# prompt stays the same size however long the chat gets
+HISTORY_TOKEN_BUDGET = 768
+LONG_TERM_MEMORY_DIR = os.path.join("cache", "memory")
+
+# Chat sessions live in server memory only while in use: a session idle this
+# long is evicted (and restored from the history database when it comes back),
+# the least recently active ones go first while all of them together are over
+# SESSIONS_MAX_BYTES, and one over SESSION_MAX_BYTES keeps only its recent pages
+SESSION_IDLE_SECONDS = int(os.environ.get("IYADBOT_SESSION_IDLE_SECONDS", 1800))
+SESSIONS_MAX_BYTES = int(os.environ.get("IYADBOT_SESSIONS_MAX_BYTES", 512 << 20))
+SESSION_MAX_BYTES = 16 << 20
+
+# Chat stats refresh on their own at this interval, without rerunning the app
+STATS_REFRESH_SECONDS = 5
+
+# Styles are edited here and served as a minified, versioned file from static/
+STYLESHEET_SOURCE = os.path.join("styles", "iyadbot.css")
 
 @st.cache_resource
-def load_llm():
-    """Load and cache the LLM model"""
-    model_path = "models/mistral-7b-instruct-v0.1.Q4_K_M.gguf"
+def load_stylesheet() -> str:
+    """Build the stylesheet once per server process; returns its versioned URL"""
+    return build_stylesheet(STYLESHEET_SOURCE)
+
+def inject_styles():
+    """Load the stylesheet into the page once per session; it stays in <head> across reruns"""
+    url = load_stylesheet()
+    if st.session_state.get("styles_url") == url:
+        return
+    components.html(stylesheet_loader_html(url), height=0)
+    st.session_state.styles_url = url
+
+
+def get_personality_settings() -> dict:
+    """Current personality knobs of this session"""
+    return {key: st.session_state.get(key, default) for key, default in DEFAULT_SETTINGS.items()}
+
+def get_dynamic_personality():
+    """Generate dynamic personality based on current settings"""
+    return build_persona(get_personality_settings())
+
+def create_llm(model_path: str):
+    """Construct the LLM for the configured backend"""
+    from conversation import TURN_STOPS
+    from hardware_profile import tuned_profile
+    from memory_profile import memory_profile
     
-    if not os.path.exists(model_path):
-        return None
+    # Threads and batch size are tuned on the main model and used for every tier
+    profile = tuned_profile(MODEL_PATH, HARDWARE_PROFILE_PATH)
+    memory = memory_profile(
+        model_path, N_CTX, KV_CACHE_TYPE, USE_MMAP, USE_MLOCK, n_batch=profile.n_batch,
+        instances=POOL_WORKERS if INFERENCE_BACKEND == "pool" else 1
+    )
     
-    try:
-        llm = LlamaCpp(
+    if INFERENCE_BACKEND == "pool":
+        from worker_pool import PooledLlamaCpp, WorkerPool
+        
+        pool = WorkerPool(
+            model_path,
+            n_workers=POOL_WORKERS,
+            # Workers size their threads to their own core slice
+            llama_kwargs={"n_batch": profile.n_batch, **memory.llama_kwargs},
+        )
+        return PooledLlamaCpp(
+            pool=pool,
             model_path=model_path,
             temperature=0.7,
             max_tokens=512,
             top_p=0.9,
-            n_ctx=2048,
-            verbose=False,
-            n_threads=os.cpu_count() or 4,
-            n_batch=512,
+            n_ctx=memory.n_ctx,
+            stop=TURN_STOPS,
         )
-        return llm
-    except Exception:
-        return None
+    
+    from langchain.llms import LlamaCpp
+    from speculative import load_draft_model
+    
+    draft_model = load_draft_model(
+        DRAFT_MODEL_PATH if model_path == MODEL_PATH else None, model_path, num_pred_tokens=SPECULATIVE_TOKENS, n_ctx=memory.n_ctx,
+        n_threads=profile.n_threads
+    )
+    # Generation and prompt evaluation each get their own best thread count
+    model_kwargs = {"n_threads_batch": profile.n_threads_batch, **memory.kv_kwargs}
+    if draft_model:
+        model_kwargs["draft_model"] = draft_model
+    return LlamaCpp(
+        model_path=model_path,
+        temperature=0.7,
+        max_tokens=512,
+        top_p=0.9,
+        n_ctx=memory.n_ctx,
+        use_mmap=memory.use_mmap,
+        use_mlock=memory.use_mlock,
+        verbose=False,
+        n_threads=profile.n_threads,
+        n_batch=profile.n_batch,
+        stop=TURN_STOPS,
+        model_kwargs=model_kwargs,
+    )
+
+def get_draft_model():
+    """The speculative-decoding draft model in use, if any"""
+    return getattr(getattr(load_llm(), "client", None), "draft_model", None)
+
+def warm_up_llm(llm):
+    """Generate one token so the first real reply does not pay for cold pages and caches
+
+    Once a model is ready, a missing hardware profile is calibrated in the
+    background for the next start.
+    """
+    llm.invoke("Hi", max_tokens=1)
+    if AUTOTUNE and os.path.exists(MODEL_PATH):
+        from hardware_profile import calibrate_in_background
+        calibrate_in_background(MODEL_PATH, HARDWARE_PROFILE_PATH)
+
+@st.cache_resource
+def load_model_registry():
+    """Every model tier, each loaded in the background on first use, once per server"""
+    return ModelRegistry(MODEL_TIERS, create_llm, default=LARGE, modules=DEFERRED_IMPORTS, warmup=warm_up_llm)
+
+def load_model_loader():
+    """Loader of the main model, which starts loading with the first page view"""
+    return load_model_registry().loader(LARGE)
+
+def load_llm(tier: str = LARGE):
+    """A tier's shared LLM, or None while it is warming up or if it failed to load"""
+    return load_model_registry().llm(tier)
+
+def load_engine(tier: str = LARGE):
+    """A tier's session engine, or None until its model is loaded (None is never cached)"""
+    llm = load_llm(tier)
+    return build_engine(tier, llm) if llm else None
+
+@st.cache_resource
+def build_engine(tier: str, _llm):
+    """Wrap a tier's shared model so each session keeps its KV cache between turns"""
+    from persona_snapshots import PersonaSnapshotStore, model_id_for
+    from session_engine import SessionEngine
+    
+    engine = SessionEngine(_llm)
+    if engine.client is not None:
+        engine.prefix_store = PersonaSnapshotStore(
+            KV_SNAPSHOT_DIR, model_id_for(engine.client), max_bytes=KV_SNAPSHOT_MAX_BYTES
+        )
+    # Snapshots count towards each session's memory and go when it is evicted
+    load_session_manager().add_cache(engine)
+    return engine
+
+def load_scheduler():
+    """Queue generations from every session in front of the shared model"""
+    # Keyed on the loaded model's concurrency, so a call before the load cannot fix it at 1
+    return build_scheduler(getattr(load_llm(), "concurrency", 1))
+
+@st.cache_resource
+def build_scheduler(concurrency: int):
+    return InferenceScheduler(concurrency=concurrency, max_queue=16)
+
+@st.cache_resource
+def load_response_cache():
+    """Replies shared across sessions, keyed by prompt and persona settings"""
+    return ResponseCache(max_entries=512, ttl=6 * 3600)
+
+@st.cache_resource
+def load_generation_jobs():
+    """Background reply generation, one job per session"""
+    return JobManager(abandon_after=GENERATION_ABANDON_SECONDS)
+
+@st.cache_resource
+def load_telemetry():
+    """Per-turn inference metrics shared by every session"""
+    telemetry = Telemetry(METRICS_PATH)
+    if METRICS_PORT:
+        telemetry.serve(int(METRICS_PORT))
+    return telemetry
+
+def load_prefetcher():
+    """Background worker that pre-generates Quick Action replies, or None until the model is loaded"""
+    engine = load_engine()
+    return build_prefetcher(engine) if engine else None
+
+@st.cache_resource
+def build_prefetcher(_engine):
+    from prefetch import QuickActionPrefetcher
+    
+    return QuickActionPrefetcher(
+        _engine, load_scheduler(), load_response_cache(), idle_seconds=PREFETCH_IDLE_SECONDS
+    )
+
+@st.cache_resource
+def load_history_db():
+    """SQLite history shared by every session, written in the background"""
+    return ConversationDB(HISTORY_DB_PATH)
+
+def restore_conversation(store: ConversationStore, session_id: str) -> int:
+    """Load the recent window of a saved conversation; returns its user turn count"""
+    saved = load_history_db().load(session_id, HISTORY_RESTORE_MESSAGES)
+    if saved is None:
+        return 0
+    for message in saved.messages:
+        store.append(message.role, message.content, message.timestamp)
+    store.offset = saved.offset
+    store.summary = saved.summary
+    return saved.user_turns
+
+def restore_chat_session(session_id: str) -> ChatSession:
+    """A chat session as saved on disk; its memory and chain are rebuilt by ensure_chain"""
+    chat = ChatSession(session_id, ConversationStore())
+    chat.conversation_count = restore_conversation(chat.messages, session_id)
+    return chat
+
+@st.cache_resource
+def load_session_manager():
+    """Conversation state of every session, evicted when idle or over the memory ceiling"""
+    history_db = load_history_db()
+    return SessionManager(
+        restore=restore_chat_session,
+        # Evicted sessions are restored from the history database
+        on_evict=lambda chat: history_db.flush(),
+        is_busy=load_generation_jobs().busy,
+        idle_timeout=SESSION_IDLE_SECONDS,
+        max_bytes=SESSIONS_MAX_BYTES,
+        session_max_bytes=SESSION_MAX_BYTES,
+        shrink_step=CHAT_PAGE_SIZE
+    )
+
+def current_chat() -> ChatSession:
+    """This session's conversation state, restored from disk if it was evicted"""
+    return load_session_manager().get(st.session_state.session_id)
+
+def count_run(scope: str = "script"):
+    """Count a full script run, or a fragment rerun outside of one"""
+    if scope == "script" or not st.session_state.get("in_script_run"):
+        load_telemetry().record_run(scope)
+
+def count_action(action: str):
+    """Count a user action, to compare against the script runs it causes"""
+    load_telemetry().record_action(action)
 
 def initialize_session_state():
     """Initialize all session state variables"""
+    # The session id lives in the URL so a refresh or restart reopens the same chat
+    if "session_id" not in st.session_state:
+        count_action("open")
+        st.session_state.session_id = st.query_params.get("sid") or uuid.uuid4().hex
+        st.query_params["sid"] = st.session_state.session_id
+    
     defaults = {
-        "messages": [],
-        "memory": ConversationBufferMemory(return_messages=True),
-        "energy_level": 7,
-        "reference_frequency": 5,
-        "response_length": "Balanced",
-        "use_emojis": True,
-        "iyad_mood": "✨ Hype Beast",
-        "conversation_count": 0,
+        **DEFAULT_SETTINGS,
         "is_typing": False,
-        "last_activity": datetime.now()
+        "last_activity": datetime.now(),
+        "visible_pages": CHAT_VISIBLE_PAGES
     }
     
     for key, default_value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = default_value
 
-    # Initialize conversation chain
-    if "chain" not in st.session_state:
-        llm = load_llm()
-        st.session_state.chain = ConversationChain(
-            llm=llm,
-            memory=st.session_state.memory,
-            verbose=False
-        ) if llm else None
+    # Initialize conversation chain (once the model has finished loading)
+    ensure_chain()
+
+def long_term_index_path(session_id: str) -> str:
+    """Where a session's long-term memory index lives; session ids come from the URL, so it is named by their hash"""
+    return os.path.join(LONG_TERM_MEMORY_DIR, hashlib.sha1(session_id.encode("utf-8")).hexdigest())
+
+def ensure_chain():
+    """Build this session's memory and chain as soon as the shared model is ready"""
+    chat = current_chat()
+    llm = load_llm()
+    if chat.chain or not llm:
+        return chat.chain
+    
+    from conversation import TokenBudgetMemory, build_chain
+    from long_term_memory import VectorIndex
+    
+    chat.memory = TokenBudgetMemory(
+        store=chat.messages,
+        record_turns=False,
+        history_budget=HISTORY_TOKEN_BUDGET,
+        long_term=VectorIndex(long_term_index_path(chat.session_id))
+    )
+    chat.chain = build_chain(llm, chat.memory)
+    return chat.chain
 
 def add_message(role: str, content: str):
     """Add a message to the conversation history"""
-    st.session_state.messages.append({
-        "role": role, 
-        "content": content,
-        "timestamp": datetime.now()
-    })
+    chat = current_chat()
+    store = chat.messages
+    index = store.append(role, content)
+    # Saved by the background writer, never on the response path
+    load_history_db().append(
+        st.session_state.session_id, store.offset + index, role, content, store[index].timestamp
+    )
     if role == "user":
-        st.session_state.conversation_count += 1
+        chat.conversation_count += 1
     st.session_state.last_activity = datetime.now()
 
-def display_typing_indicator():
+TYPING_INDICATOR_HTML = """
+<div class="typing-indicator">
+    <div class="message-avatar avatar-bot">🤖</div>
+    <span>IyadBot is typing</span>
+    <div class="typing-dots">
+        <div class="typing-dot"></div>
+        <div class="typing-dot"></div>
+        <div class="typing-dot"></div>
+    </div>
+</div>
+"""
+
+def escape_message(text: str) -> str:
+    """Escape message text for use inside a chat bubble"""
+    return html.escape(text).replace("\n", "<br>")
+
+def user_message_html(content: str) -> str:
+    """Build the HTML for a user chat bubble"""
+    return f"""
+    <div class="message message-user">
+        <div class="message-bubble message-bubble-user">
+            {content}
+        </div>
+        <div class="message-avatar avatar-user">😊</div>
+    </div>
+    """
+
+def bot_message_html(content: str) -> str:
+    """Build the HTML for an IyadBot chat bubble"""
+    return f"""
+    <div class="message message-bot">
+        <div class="message-avatar avatar-bot">🤖</div>
+        <div class="message-bubble message-bubble-bot">
+            {content}
+        </div>
+    </div>
+    """
+
+def render_partial_reply(placeholder, text: str):
+    """Render a reply that is still being generated into the live assistant bubble"""
+    # First token replaces the typing indicator
+    st.session_state.is_typing = False
+    placeholder.markdown(bot_message_html(escape_message(text) + "▌"), unsafe_allow_html=True)
+
+def ordinal(n: int) -> str:
+    """1 -> 1st, 2 -> 2nd, 11 -> 11th"""
+    suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+def queue_status_html(position: int, eta: float) -> str:
+    """Build the waiting-in-line indicator shown while other sessions generate"""
+    return f"""
+    <div class="typing-indicator">
+        <div class="message-avatar avatar-bot">🤖</div>
+        <span>IyadBot is chatting with others — you're {ordinal(position)} in line (~{eta:.0f} s)</span>
+    </div>
+    """
+
+def display_typing_indicator(placeholder=None):
     """Display typing indicator"""
     if st.session_state.get('is_typing', False):
-        st.markdown("""
-        <div class="typing-indicator">
-            <div class="message-avatar avatar-bot">🤖</div>
-            <span>IyadBot is typing</span>
-            <div class="typing-dots">
-                <div class="typing-dot"></div>
-                <div class="typing-dot"></div>
-                <div class="typing-dot"></div>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+        (placeholder or st).markdown(TYPING_INDICATOR_HTML, unsafe_allow_html=True)
 
-def display_chat_messages():
-    """Display chat messages with modern design"""
-    # Chat container
-    st.markdown('<div class="chat-container">', unsafe_allow_html=True)
+def build_message_html(role: str, content: str) -> str:
+    """Escaped bubble HTML for a message"""
+    content = escape_message(content)
+    return user_message_html(content) if role == "user" else bot_message_html(content)
+
+def chat_page_html(page: int) -> str:
+    """HTML of one page of messages; full pages never change, so they are built once
+
+    Identical page elements hit Streamlit's forward-message cache, so the
+    browser only receives pages it has not seen yet.
+    """
+    chat = current_chat()
+    store = chat.messages
+    indices = range(page * CHAT_PAGE_SIZE, min((page + 1) * CHAT_PAGE_SIZE, len(store)))
+    if len(indices) < CHAT_PAGE_SIZE:
+        return "".join(store.html(i, build_message_html) for i in indices)
+    page_cache = chat.page_html
+    if page not in page_cache:
+        page_cache[page] = "".join(store.html(i, build_message_html) for i in indices)
+    return page_cache[page]
+
+def load_older_messages():
+    """Show one more page of older messages, fetching it from disk if it is not loaded"""
+    count_action("load_older")
+    chat = current_chat()
+    store = chat.messages
+    n_pages = -(-len(store) // CHAT_PAGE_SIZE)
+    if st.session_state.visible_pages >= n_pages and store.offset:
+        older = load_history_db().load_range(
+            st.session_state.session_id, max(store.offset - CHAT_PAGE_SIZE, 0), store.offset
+        )
+        store.prepend(older)
+        # Prepending shifts every index: keep the same turns in the prompt and rebuild pages
+        if chat.memory:
+            chat.memory.start += len(older)
+        chat.page_html = {}
+    st.session_state.visible_pages += 1
+
+def chat_header_html() -> str:
+    """Chat header: model status and who answered the last turn"""
+    if current_chat().chain:
+        status, status_color = "Online", "#10b981"
+    elif load_model_loader().loading:
+        status, status_color = "Warming up", "#f59e0b"
+    else:
+        status, status_color = "Offline", "#ef4444"
     
-    # Chat header
-    status = "Online" if st.session_state.chain else "Offline"
-    status_color = "#10b981" if st.session_state.chain else "#ef4444"
+    # Which model answered the last turn and how long it took
+    last_reply = "Ready to chat"
+    if st.session_state.get("last_reply"):
+        label, seconds = st.session_state.last_reply
+        last_reply = f"Last reply: {html.escape(label)} in {seconds:.1f}s"
     
-    st.markdown(f"""
+    return f"""
     <div class="chat-header">
         <div style="flex: 1;">
             <div style="font-weight: 600; font-size: 1.1rem;">🤖 IyadBot</div>
             <div class="chat-status">
                 <div class="status-dot" style="background: {status_color};"></div>
-                {status} • Ready to chat
+                {status} • {last_reply}
             </div>
         </div>
     </div>
-    """, unsafe_allow_html=True)
+    """
+
+def display_chat_messages():
+    """Display chat messages with modern design; returns the chat header's placeholder"""
+    chat = current_chat()
+    
+    # Chat container
+    st.markdown('<div class="chat-container">', unsafe_allow_html=True)
+    
+    # Chat header, redrawn in place once a reply is in
+    header = st.empty()
+    header.markdown(chat_header_html(), unsafe_allow_html=True)
     
     # Messages container
     st.markdown('<div class="chat-messages">', unsafe_allow_html=True)
     
-    if not st.session_state.messages:
+    if not chat.messages:
         # Welcome message
         welcome_messages = [
             "Hey Iyad! 👋 Ready to chat about Genshin, idols, or anything else?",
@@ -496,186 +562,492 @@ def display_chat_messages():
             "What's good, Iyad? Ready to dive into some epic conversations? ✨"
         ]
         
-        welcome_msg = random.choice(welcome_messages)
-        st.markdown(f"""
-        <div class="message message-bot">
-            <div class="message-avatar avatar-bot">🤖</div>
-            <div class="message-bubble message-bubble-bot">
-                {welcome_msg}
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+        # Pick once per session so reruns send the same element
+        if "welcome_msg" not in st.session_state:
+            st.session_state.welcome_msg = random.choice(welcome_messages)
+        st.markdown(bot_message_html(st.session_state.welcome_msg), unsafe_allow_html=True)
     else:
-        # Display conversation history
-        for msg in st.session_state.messages:
-            if msg["role"] == "user":
-                st.markdown(f"""
-                <div class="message message-user">
-                    <div class="message-bubble message-bubble-user">
-                        {msg["content"]}
-                    </div>
-                    <div class="message-avatar avatar-user">😊</div>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                <div class="message message-bot">
-                    <div class="message-avatar avatar-bot">🤖</div>
-                    <div class="message-bubble message-bubble-bot">
-                        {msg["content"]}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+        # Display the most recent pages of the conversation
+        n_pages = -(-len(chat.messages) // CHAT_PAGE_SIZE)
+        first_page = max(n_pages - st.session_state.visible_pages, 0)
+        hidden = first_page * CHAT_PAGE_SIZE + chat.messages.offset
+        if hidden:
+            st.button(
+                f"⬆️ Load older messages ({hidden} hidden)",
+                key="load_older", on_click=load_older_messages
+            )
+        for page in range(first_page, n_pages):
+            st.markdown(chat_page_html(page), unsafe_allow_html=True)
     
     # Typing indicator
     display_typing_indicator()
     
     st.markdown('</div>', unsafe_allow_html=True)  # Close messages
     st.markdown('</div>', unsafe_allow_html=True)  # Close container
+    return header
+
+def get_bot_response(user_input: str, placeholder=None, quick_action: bool = False) -> Optional[str]:
+    """Answer a message with the LLM
+
+    Cached replies and failures are returned right away. Anything else is
+    generated by a background job for this session and None is returned;
+    `follow_generation` shows the job's progress and `finish_generation`
+    collects its reply.
 
-def get_bot_response(user_input: str) -> Optional[str]:
-    """Generate bot response using the LLM"""
-    if not st.session_state.chain:
+    Replies are cached under the recent history and the turns recalled from
+    long-term memory, since both are in the prompt. Near-duplicate matching
+    only applies within a conversation's own history, never to the empty
+    history that every new session shares. A quick action with no reply
+    cached for its history still gets one prefetched without history.
+    """
+    chat = current_chat()
+    if not chat.chain and load_model_loader().loading:
+        # Sent while warming up: wait for the model instead of failing
+        if placeholder is not None:
+            placeholder.markdown(bot_message_html("Warming up my brain, one sec... 🧠✨"), unsafe_allow_html=True)
+        load_model_loader().wait()
+    if not ensure_chain():
         return "I'm having trouble connecting to my brain right now 😅 Please check if the model is loaded correctly!"
     
-    try:
-        # Show typing indicator
-        st.session_state.is_typing = True
+    from conversation import TokenStreamHandler, TurnTimer, end_of_turn, set_reply_budget, switch_llm
+    
+    # Reuse a reply already generated for this prompt, persona and recent history
+    cache = load_response_cache()
+    fingerprint = settings_fingerprint(get_personality_settings())
+    history = chat.memory.history_lines(user_input)[-RESPONSE_CACHE_HISTORY_LINES:]
+    recalled, _ = chat.memory.recall(user_input, chat.memory.recall_budget)
+    if recalled:
+        history.append(recalled)
+    cached = cache.get(
+        user_input, fingerprint, history, fuzzy=bool(history) and not quick_action, history_free=quick_action
+    )
+    if cached:
+        load_telemetry().record_cache_hit()
+        st.session_state.last_reply = ("Response cache", 0.0)
+        chat.memory.save_context({"input": user_input}, {"response": cached})
+        if placeholder is not None:
+            placeholder.markdown(bot_message_html(escape_message(cached)), unsafe_allow_html=True)
+        return cached
+    
+    # Personality goes in once as the system prefix, not into history,
+    # and the response style caps how long the reply may get
+    settings = get_personality_settings()
+    chat.memory.persona = build_persona(settings)
+    
+    # Cheap turns go to the small model once it is loaded
+    registry = load_model_registry()
+    response_length = st.session_state.get('response_length', 'Balanced')
+    tier = registry.choose(route_turn(user_input, response_length, quick_action))
+    switch_llm(chat.chain, load_llm(tier))
+    set_reply_budget(chat.chain, response_token_budget(settings))
+    
+    # The job thread has no access to st.session_state, so hand it everything it needs
+    session_id = st.session_state.session_id
+    chain = chat.chain
+    memory = chat.memory
+    engine = load_engine(tier)
+    scheduler = load_scheduler()
+    telemetry = load_telemetry()
+    draft_model = get_draft_model() if tier == LARGE else None
+    priority = priority_for(response_length)
+    
+    def generate(job):
+        # Time prompt evaluation and decoding for the telemetry
+        timer = TurnTimer()
         
-        # Create enhanced prompt with personality
-        personality_prompt = get_dynamic_personality()
+        # Wait our turn on the shared model, then generate with this
+        # session's KV cache loaded; every token goes to the job, which
+        # raises Cancelled here once the user stops it
+        with scheduler.slot(session_id, priority, on_wait=job.queued) as ticket:
+            job.admitted()
+            started = time.perf_counter()
+            with engine.session(session_id, memory.persona, settings):
+                response = end_of_turn(chain.predict(
+                    input=user_input,
+                    callbacks=[timer, TokenStreamHandler(job.report)] + engine.callbacks
+                ))
+            cache.put(user_input, fingerprint, response, time.perf_counter() - started, history)
         
-        response = st.session_state.chain.predict(
-            input=f"{personality_prompt}\n\nUser: {user_input}\nIyadBot:"
+        if draft_model:
+            telemetry.set_gauge(
+                "draft_acceptance_ratio", draft_model.acceptance_rate(),
+                "Fraction of draft tokens accepted by the main model"
+            )
+        telemetry.record(TurnMetrics(
+            prompt_tokens=memory.last_usage["used"],
+            # Non-streaming backends report no tokens; count the reply instead
+            generated_tokens=timer.generated_tokens or memory.count_tokens(response),
+            prompt_eval_seconds=timer.prompt_eval_seconds,
+            decode_seconds=timer.decode_seconds,
+            queue_wait_seconds=ticket.waited,
+            context_utilization=memory.context_usage()
+        ), model=tier)
+        return response
+    
+    st.session_state.is_typing = True
+    load_generation_jobs().start(session_id, generate, label=registry.tiers[tier].label)
+    return None
+
+def follow_generation(job, placeholder):
+    """Show a background reply in the live bubble until it finishes
+
+    Every pass renders something, which is where Streamlit interrupts the
+    script when the user clicks Stop or sends another event.
+    """
+    jobs = load_generation_jobs()
+    while not job.finished:
+        jobs.get(st.session_state.session_id)  # keeps the job from being reaped
+        if job.position:
+            placeholder.markdown(queue_status_html(job.position, job.eta), unsafe_allow_html=True)
+        elif job.text and STREAM_RESPONSES:
+            render_partial_reply(placeholder, job.text)
+        else:
+            placeholder.markdown(TYPING_INDICATOR_HTML, unsafe_allow_html=True)
+        time.sleep(GENERATION_POLL_SECONDS)
+
+def finish_generation(job) -> Optional[str]:
+    """Collect the reply of a finished job; a stopped reply keeps what was generated so far"""
+    load_generation_jobs().discard(job.session_id)
+    st.session_state.is_typing = False
+    if job.status in (DONE, STOPPED):
+        st.session_state.last_reply = (job.label, job.elapsed)
+    if job.status == DONE:
+        return job.response
+    if job.status == STOPPED:
+        return job.text.strip() or None
+    if isinstance(job.error, QueueFull):
+        return "So many people are chatting with me right now! 🥹 Give me a sec and try again 💙"
+    error_messages = [
+        f"Oops! Something went wrong: {str(job.error)} 😓",
+        "My brain had a little glitch there! Can you try again? 🤖💭",
+        "Error alert! But I'm still here for you! 💪"
+    ]
+    return random.choice(error_messages)
+
+def show_reply(response: str, placeholder):
+    """Add a reply and show it in the live bubble, so no rerun is needed to see it"""
+    add_message("assistant", response)
+    store = current_chat().messages
+    placeholder.markdown(store.html(len(store) - 1, build_message_html), unsafe_allow_html=True)
+
+def generation_running() -> bool:
+    job = load_generation_jobs().get(st.session_state.session_id)
+    return job is not None and not job.finished
+
+def stop_generation():
+    """Stop button: abort decoding and keep the partial reply"""
+    count_action("stop")
+    load_generation_jobs().stop(st.session_state.session_id)
+
+def queue_user_message(text: str, quick_action: bool = False):
+    """Record a user message and leave it for the chat area to answer"""
+    if generation_running():
+        # One reply at a time: wait for the current one or stop it first
+        return
+    add_message("user", text)
+    st.session_state.pending_input = text
+    st.session_state.pending_quick_action = quick_action
+
+def send_quick_action(action: str):
+    """Quick Action button: send its text as a message"""
+    count_action("quick_action")
+    queue_user_message(action, quick_action=True)
+
+def submit_user_input():
+    """Move the text box contents into the pending message queue"""
+    count_action("send")
+    user_input = st.session_state.get("user_input", "")
+    if generation_running():
+        # Keep the text in the box until the current reply is done
+        return
+    if user_input and user_input.strip():
+        queue_user_message(user_input)
+    # Clear input immediately for better UX
+    st.session_state.user_input = ""
+
+def touch_prefetcher():
+    """Let idle time pre-generate Quick Action replies for the current settings"""
+    prefetcher = load_prefetcher() if current_chat().chain else None
+    if prefetcher:
+        prefetcher.touch(
+            st.session_state.session_id,
+            get_personality_settings(),
+            st.session_state.last_activity.timestamp()
         )
-        
-        # Hide typing indicator
-        st.session_state.is_typing = False
-        
-        return response.strip()
-        
-    except Exception as e:
-        st.session_state.is_typing = False
-        error_messages = [
-            f"Oops! Something went wrong: {str(e)} 😓",
-            "My brain had a little glitch there! Can you try again? 🤖💭",
-            "Error alert! But I'm still here for you! 💪"
-        ]
-        return random.choice(error_messages)
+
+def settings_changed():
+    """A personality widget changed; only its fragment reruns"""
+    count_action("settings")
+    # No full run follows, so drop the prefetches for the old persona now
+    touch_prefetcher()
+
+@st.experimental_fragment
+def personality_settings():
+    """Personality widgets, bound to their session state keys; changing one reruns only this fragment"""
+    count_run("personality_settings")
+    st.markdown("""
+    <div class="sidebar-content">
+        <div class="sidebar-header">
+            🎛️ Personality Settings
+        </div>
+    """, unsafe_allow_html=True)
+    
+    # Energy level
+    st.slider(
+        "⚡ Energy Level", 
+        min_value=1, max_value=10, key="energy_level", on_change=settings_changed,
+        help="How energetic should IyadBot be?"
+    )
+    
+    # Reference frequency
+    st.slider(
+        "🎯 Interest References", 
+        min_value=1, max_value=10, key="reference_frequency", on_change=settings_changed,
+        help="How often to mention your interests?"
+    )
+    
+    # Response length
+    st.selectbox("📝 Response Length", options=RESPONSE_LENGTHS, key="response_length", on_change=settings_changed)
+    
+    # Emoji usage
+    st.checkbox("✨ Use Emojis", key="use_emojis", on_change=settings_changed)
+    
+    # Current mood
+    st.selectbox("🎭 Current Mood", options=MOOD_OPTIONS, key="iyad_mood", on_change=settings_changed)
+    
+    st.markdown('</div>', unsafe_allow_html=True)
 
 def create_sidebar():
     """Create enhanced sidebar"""
     with st.sidebar:
         # Personality Settings
+        personality_settings()
+        
+        # Quick Actions
         st.markdown("""
         <div class="sidebar-content">
             <div class="sidebar-header">
-                🎛️ Personality Settings
+                ⚡ Quick Actions
             </div>
+            <div class="quick-actions">
         """, unsafe_allow_html=True)
         
-        # Energy level
-        st.session_state.energy_level = st.slider(
-            "⚡ Energy Level", 
-            min_value=1, max_value=10, 
-            value=st.session_state.get('energy_level', 7),
-            help="How energetic should IyadBot be?"
-        )
-        
-        # Reference frequency
-        st.session_state.reference_frequency = st.slider(
-            "🎯 Interest References", 
-            min_value=1, max_value=10, 
-            value=st.session_state.get('reference_frequency', 5),
-            help="How often to mention your interests?"
-        )
-        
-        # Response length
-        st.session_state.response_length = st.selectbox(
-            "📝 Response Length",
-            options=["Short & Sweet", "Balanced", "Detailed"],
-            index=["Short & Sweet", "Balanced", "Detailed"].index(
-                st.session_state.get('response_length', 'Balanced')
+        for action in QUICK_ACTIONS:
+            st.button(
+                action, key=f"quick_{action}", use_container_width=True,
+                on_click=send_quick_action, args=(action,)
             )
-        )
-        
-        # Emoji usage
-        st.session_state.use_emojis = st.checkbox(
-            "✨ Use Emojis", 
-            value=st.session_state.get('use_emojis', True)
-        )
         
-        # Current mood
-        mood_options = [
-            "✨ Hype Beast", "🌟 Supportive Friend", "🎵 Music Vibes", 
-            "🎮 Gaming Mode", "🐾 Pet Parent", "💭 Deep Thinker",
-            "🏔️ Genshin Explorer", "🎊 Celebration Mode"
-        ]
-        
-        st.session_state.iyad_mood = st.selectbox(
-            "🎭 Current Mood",
-            options=mood_options,
-            index=mood_options.index(st.session_state.get('iyad_mood', '✨ Hype Beast'))
-        )
+        st.markdown('</div></div>', unsafe_allow_html=True)
         
-        st.markdown('</div>', unsafe_allow_html=True)
+        # Statistics, refreshed on their own
+        chat_stats()
         
-        # Quick Actions
-        st.markdown("""
+        # Clear chat
+        st.button("🗑️ Clear Chat", use_container_width=True, type="secondary", on_click=clear_chat)
+
+@st.experimental_fragment(run_every=STATS_REFRESH_SECONDS)
+def chat_stats():
+    """Chat, inference and model stats; reruns every STATS_REFRESH_SECONDS without the rest of the app"""
+    count_run("chat_stats")
+    cache = load_response_cache()
+    sessions = load_session_manager()
+    # A timed rerun is not activity, and an evicted chat is not restored just for its stats
+    chat = sessions.peek(st.session_state.session_id)
+    memory = chat.memory if chat else None
+    telemetry = load_telemetry()
+    st.markdown(f"""
+    <div class="sidebar-content">
+        <div class="sidebar-header">
+            📊 Chat Stats
+        </div>
+        <div class="stats-grid">
+            <div class="stat-card">
+                <div class="stat-number">{chat.conversation_count if chat else "–"}</div>
+                <div class="stat-label">Conversations</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{chat.messages.total if chat else "–"}</div>
+                <div class="stat-label">Messages</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{memory.context_usage() if memory else 0:.0%}</div>
+                <div class="stat-label">Context Used</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{cache.hit_rate():.0%}</div>
+                <div class="stat-label">Cache Hits</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{cache.stats["saved_seconds"]:.0f}s</div>
+                <div class="stat-label">Time Saved</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{f"{chat.messages.nbytes() / 1024:.1f} KB" if chat else "–"}</div>
+                <div class="stat-label">History Size</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{len(memory.long_term) if memory else 0}</div>
+                <div class="stat-label">Turns Remembered</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{len(sessions)}</div>
+                <div class="stat-label">Live Sessions</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{sessions.total_bytes() / 1048576:.1f} MB</div>
+                <div class="stat-label">Session Memory</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{telemetry.runs_per_action():.2f}</div>
+                <div class="stat-label">Runs / Action</div>
+            </div>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Rolling averages of the last turns answered by the model
+    if telemetry.turns["model"]:
+        averages = telemetry.averages()
+        st.markdown(f"""
         <div class="sidebar-content">
             <div class="sidebar-header">
-                ⚡ Quick Actions
+                ⚡ Inference (avg)
             </div>
-            <div class="quick-actions">
+            <div class="stats-grid">
+                <div class="stat-card">
+                    <div class="stat-number">{averages["prompt_tokens"]:.0f}</div>
+                    <div class="stat-label">Prompt Tokens</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-number">{averages["generated_tokens"]:.0f}</div>
+                    <div class="stat-label">Reply Tokens</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-number">{averages["prompt_eval_seconds"]:.2f}s</div>
+                    <div class="stat-label">Prompt Eval</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-number">{averages["decode_seconds"]:.1f}s</div>
+                    <div class="stat-label">Decode</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-number">{averages["queue_wait_seconds"]:.1f}s</div>
+                    <div class="stat-label">Queue Wait</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-number">{averages["context_utilization"]:.0%}</div>
+                    <div class="stat-label">Context / n_ctx</div>
+                </div>
+            </div>
+        </div>
         """, unsafe_allow_html=True)
-        
-        quick_actions = [
-            "🎮 Latest Genshin pulls?",
-            "🎵 Recommend idol songs",
-            "🐾 How are Noah & Milo?",
-            "✨ Hype me up!",
-            "💭 Deep conversation"
-        ]
-        
-        for action in quick_actions:
-            if st.button(action, key=f"quick_{action}", use_container_width=True):
-                add_message("user", action)
-                response = get_bot_response(action)
-                if response:
-                    add_message("assistant", response)
-                st.rerun()
-        
-        st.markdown('</div></div>', unsafe_allow_html=True)
-        
-        # Statistics
+
+    # Whether speculative decoding pays off: accepted drafts and resulting decode speed
+    draft_model = get_draft_model()
+    if draft_model and telemetry.turns["model"]:
         st.markdown(f"""
         <div class="sidebar-content">
             <div class="sidebar-header">
-                📊 Chat Stats
+                🚀 Speculative Decoding
             </div>
             <div class="stats-grid">
                 <div class="stat-card">
-                    <div class="stat-number">{st.session_state.conversation_count}</div>
-                    <div class="stat-label">Conversations</div>
+                    <div class="stat-number">{draft_model.acceptance_rate():.0%}</div>
+                    <div class="stat-label">Draft Accepted</div>
                 </div>
                 <div class="stat-card">
-                    <div class="stat-number">{len(st.session_state.messages)}</div>
-                    <div class="stat-label">Messages</div>
+                    <div class="stat-number">{telemetry.decode_tokens_per_second():.1f}</div>
+                    <div class="stat-label">Tokens / s</div>
                 </div>
             </div>
         </div>
         """, unsafe_allow_html=True)
-        
-        # Clear chat
-        if st.button("🗑️ Clear Chat", use_container_width=True, type="secondary"):
-            st.session_state.messages = []
-            st.session_state.memory.clear()
-            st.session_state.conversation_count = 0
-            st.rerun()
+
+    # Model tiers: whether each is loaded and how many turns it answered
+    registry = load_model_registry()
+    if len(registry.tiers) > 1:
+        tier_cards = "".join(
+            f'''<div class="stat-card">
+                <div class="stat-number">{telemetry.model_turns.get(name, 0)}</div>
+                <div class="stat-label">{tier.label} ({registry.status(name)})</div>
+            </div>'''
+            for name, tier in registry.tiers.items()
+        )
+        st.markdown(f"""
+        <div class="sidebar-content">
+            <div class="sidebar-header">
+                🧠 Models
+            </div>
+            <div class="stats-grid">{tier_cards}</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+    # Startup timings of the shared model, filled in as each phase finishes
+    loader = load_model_loader()
+    if loader.timings:
+        phase_cards = "".join(
+            f'''<div class="stat-card">
+                <div class="stat-number">{loader.timings[phase]:.1f}s</div>
+                <div class="stat-label">{phase.replace("_", " ").title()}</div>
+            </div>'''
+            for phase in PHASES if phase in loader.timings
+        )
+        st.markdown(f"""
+        <div class="sidebar-content">
+            <div class="sidebar-header">
+                ⏱️ Startup{" (warming up)" if loader.loading else ""}
+            </div>
+            <div class="stats-grid">{phase_cards}</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+def clear_chat():
+    """Clear Chat button: forget the conversation everywhere it is kept"""
+    count_action("clear")
+    # A reply still being generated belongs to the old conversation
+    load_generation_jobs().drop(st.session_state.session_id)
+    st.session_state.is_typing = False
+    # Forgetting the KV state waits for an in-process job to let go of the model
+    for tier in load_model_registry().loaded():
+        load_engine(tier).forget(st.session_state.session_id)
+    chat = current_chat()
+    chat.page_html = {}
+    st.session_state.visible_pages = CHAT_VISIBLE_PAGES
+    chat.messages.clear()
+    if chat.memory:
+        chat.memory.clear()
+    else:
+        # Not built yet (warming up, or restored after an eviction), but its index is on disk
+        from long_term_memory import VectorIndex
+        VectorIndex(long_term_index_path(chat.session_id)).clear()
+    load_history_db().clear(st.session_state.session_id)
+    chat.conversation_count = 0
+
+@st.experimental_fragment(run_every=1)
+def model_warmup_status():
+    """Warming-up notice that reruns the app once the model is ready"""
+    if load_model_loader().loading:
+        st.info("🔥 IyadBot is warming up... you can already type, replies start once the model is loaded.")
+    else:
+        st.rerun()
 
 def main():
     """Main application function"""
+    count_run()
+    # Fragments called from here are part of this run, not reruns of their own,
+    # also when the run ends early (a rerun, a stop or an error)
+    st.session_state.in_script_run = True
+    try:
+        render_app()
+    finally:
+        st.session_state.in_script_run = False
+
+def render_app():
+    """One full run of the page"""
     initialize_session_state()
+    inject_styles()
+    chat = current_chat()
     
     # Header
     st.markdown("""
@@ -693,7 +1065,10 @@ def main():
     
     with col1:
         # Display chat
-        display_chat_messages()
+        chat_header = display_chat_messages()
+        
+        # Live bubble that streamed replies are rendered into
+        response_placeholder = st.empty()
         
         # Input area
         st.markdown('<div class="input-container">', unsafe_allow_html=True)
@@ -702,42 +1077,53 @@ def main():
         input_col1, input_col2 = st.columns([5, 1])
         
         with input_col1:
-            user_input = st.text_input(
+            st.text_input(
                 "",
                 key="user_input",
                 placeholder="Type your message here... Ask about Genshin, idols, or just say hi! 💬",
-                label_visibility="collapsed"
+                label_visibility="collapsed",
+                on_change=submit_user_input
             )
         
-        with input_col2:
-            send_button = st.button("Send", use_container_width=True, type="primary")
+        # Answer the pending message from the Enter key, send button or a quick action
+        pending_input = st.session_state.pop("pending_input", None)
+        quick_action = st.session_state.pop("pending_quick_action", False)
+        if pending_input:
+            response = get_bot_response(pending_input, response_placeholder, quick_action)
+            if response:
+                show_reply(response, response_placeholder)
+        
+        # Send turns into Stop while a reply is being generated
+        job = load_generation_jobs().get(st.session_state.session_id)
+        button_slot = input_col2.empty()
+        if job is not None and not job.finished:
+            button_slot.button("⏹️ Stop", key="stop", use_container_width=True, on_click=stop_generation)
         
-        # Handle Enter key and send button
-        if (send_button or user_input) and user_input and user_input.strip():
-            # Add user message
-            add_message("user", user_input)
-            
-            # Clear input immediately for better UX
-            st.session_state.user_input = ""
-            
-            # Get bot response
-            with st.spinner("🤖 IyadBot is thinking..."):
-                response = get_bot_response(user_input)
-                if response:
-                    add_message("assistant", response)
-            
-            st.rerun()
+        # Follow this session's reply until it is done (also after a refresh)
+        if job is not None:
+            follow_generation(job, response_placeholder)
+            response = finish_generation(job)
+            if response:
+                show_reply(response, response_placeholder)
+        if pending_input or job is not None:
+            chat_header.markdown(chat_header_html(), unsafe_allow_html=True)
+        button_slot.button("Send", key="send", use_container_width=True, type="primary", on_click=submit_user_input)
         
         st.markdown('</div>', unsafe_allow_html=True)
         
         # Model status
-        if not st.session_state.chain:
-            st.error("⚠️ Model not loaded! Please check the model file path.")
-            st.info("💡 Expected path: `models/mistral-7b-instruct-v0.1.Q4_K_M.gguf`")
+        if not chat.chain:
+            if load_model_loader().loading:
+                model_warmup_status()
+            else:
+                st.error("⚠️ Model not loaded! Please check the model file path.")
+                st.info(f"💡 Expected path: `{MODEL_PATH}`")
     
     with col2:
         # Additional info or features could go here
         pass
+    
+    touch_prefetcher()
 
 if __name__ == "__main__":
     main()
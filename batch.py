@@ -0,0 +1,291 @@
+"""Offline batch runs of prompts through the IyadBot pipeline.
+
+    python batch.py prompts.jsonl results.jsonl
+    python batch.py prompts.jsonl results.jsonl --stub         # no model file
+    python batch.py prompts.jsonl results.jsonl --workers 4    # model replicas in worker processes
+
+Each input line is a JSON object; only "prompt" is required:
+
+    {"id": "q1", "prompt": "Hype me up!", "settings": {"energy_level": 9},
+     "history": [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]}
+
+Prompts are answered with the persona, token-budget memory and conversation
+chain the app uses. The input is scanned once to find every line's persona.
+Lines are then answered persona by persona, so consecutive prompts share the
+evaluated persona prefix in the KV cache. Only line offsets are held in
+memory, and each result is appended to the output as soon as it is ready.
+Lines whose id already has a response in the output are skipped, so an
+interrupted run picks up where it stopped. Error records of an earlier run
+are removed from the output and their lines are tried again.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from benchmark import StubLLM, add_model_arguments, load_model
+from conversation import TURN_STOPS, TokenBudgetMemory, TurnTimer, build_chain, end_of_turn, set_reply_budget
+from conversation_store import ConversationStore
+from memory_profile import MemoryProfile
+from persona import DEFAULT_SETTINGS, build_persona, response_token_budget, settings_fingerprint
+from session_engine import SessionEngine
+
+
+def item_id(item: Dict[str, Any], line_no: int) -> str:
+    return str(item.get("id", line_no))
+
+
+def item_settings(item: Dict[str, Any]) -> Dict[str, Any]:
+    """The line's personality settings; ValueError if "settings" is not an object"""
+    settings = item.get("settings") or {}
+    if not isinstance(settings, dict):
+        raise ValueError(f'"settings" must be an object, not {type(settings).__name__}')
+    return {**DEFAULT_SETTINGS, **settings}
+
+
+def scan(path: str) -> "OrderedDict[str, List[Tuple[int, int]]]":
+    """(line number, byte offset) of every input line, grouped by persona fingerprint
+
+    Lines that are not valid JSON objects get the empty fingerprint and are
+    reported as failures when their turn comes.
+    """
+    groups: "OrderedDict[str, List[Tuple[int, int]]]" = OrderedDict()
+    with open(path, "rb") as f:
+        line_no, offset = 0, 0
+        for line in f:
+            line_no += 1
+            if line.strip():
+                try:
+                    item = json.loads(line)
+                    fingerprint = settings_fingerprint(item_settings(item))
+                except (ValueError, TypeError, AttributeError, KeyError):
+                    fingerprint = ""
+                groups.setdefault(fingerprint, []).append((line_no, offset))
+            offset += len(line)
+    return groups
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids that already have a response in an earlier run's output"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of a run that crashed mid-write
+                continue
+            if isinstance(record, dict) and "response" in record and "id" in record:
+                done.add(str(record["id"]))
+    return done
+
+
+def drop_failed(path: str) -> int:
+    """Remove the error records of an earlier run, so retrying a line replaces its error"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        if not any('"error"' in line for line in f):
+            return 0
+    dropped = 0
+    tmp_path = f"{path}.tmp"
+    with open(path, encoding="utf-8") as f, open(tmp_path, "w", encoding="utf-8") as out:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                out.write(line)
+                continue
+            if isinstance(record, dict) and "error" in record:
+                dropped += 1
+            else:
+                out.write(line)
+    os.replace(tmp_path, path)
+    return dropped
+
+
+def end_with_newline(path: str):
+    """A crash mid-write leaves a partial last line; make the next record start a fresh one"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+def answer(engine: SessionEngine, item: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+    """Run one prompt through the chat pipeline on a fresh memory"""
+    settings = item_settings(item)
+    store = ConversationStore()
+    for message in item.get("history") or []:
+        store.append(message["role"], message["content"])
+    memory = TokenBudgetMemory(store=store, record_turns=False)
+    chain = build_chain(engine.llm, memory)
+    memory.persona = build_persona(settings)
+    set_reply_budget(chain, response_token_budget(settings))
+
+    timer = TurnTimer()
+    started = time.perf_counter()
+    with engine.session(session_id, memory.persona, settings):
+        response = end_of_turn(chain.predict(input=item["prompt"], callbacks=[timer] + engine.callbacks))
+    return {
+        "response": response,
+        "settings_fingerprint": settings_fingerprint(settings),
+        "prompt_tokens": memory.last_usage["used"],
+        "generated_tokens": timer.generated_tokens or memory.count_tokens(response),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+class BatchRunner:
+    """Answer the lines of an input file and append the results to an output file"""
+
+    def __init__(self, engine: SessionEngine, input_path: str, output_path: str, workers: int = 1, progress: int = 100):
+        self.engine = engine
+        self.input_path = input_path
+        self.output_path = output_path
+        self.workers = workers
+        self.progress = progress
+        self._lock = threading.Lock()
+        self.stats = {"answered": 0, "skipped": 0, "failed": 0, "prompt_tokens": 0, "generated_tokens": 0}
+
+    def run(self) -> Dict[str, Any]:
+        groups = scan(self.input_path)
+        drop_failed(self.output_path)
+        done = completed_ids(self.output_path)
+        started = time.perf_counter()
+        end_with_newline(self.output_path)
+        with open(self.output_path, "a", encoding="utf-8") as out:
+            shards = []
+            for fingerprint, lines in groups.items():
+                # Each shard is one session, answered in order on one model replica
+                n_shards = max(1, min(self.workers, len(lines)))
+                shards += [(f"batch-{fingerprint}-{i}", lines[i::n_shards]) for i in range(n_shards)]
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for future in [pool.submit(self._run_shard, session_id, lines, done, out) for session_id, lines in shards]:
+                    future.result()
+        return self.summary(time.perf_counter() - started)
+
+    def _run_shard(self, session_id: str, lines: List[Tuple[int, int]], done: Set[str], out):
+        with open(self.input_path, "rb") as f:
+            for line_no, offset in lines:
+                f.seek(offset)
+                record = self._answer_line(f.readline(), line_no, session_id, done)
+                if record is not None:
+                    self._write(out, record)
+        self.engine.forget(session_id)
+
+    def _answer_line(self, line: bytes, line_no: int, session_id: str, done: Set[str]) -> Optional[Dict[str, Any]]:
+        try:
+            item = json.loads(line)
+            key = item_id(item, line_no)
+        except (ValueError, AttributeError) as e:
+            return {"id": str(line_no), "error": f"invalid input line: {e}"}
+        if key in done:
+            with self._lock:
+                self.stats["skipped"] += 1
+            return None
+        try:
+            return {"id": key, "prompt": item["prompt"], **answer(self.engine, item, session_id)}
+        except Exception as e:
+            return {"id": key, "error": repr(e)}
+
+    def _write(self, out, record: Dict[str, Any]):
+        with self._lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if "error" in record:
+                self.stats["failed"] += 1
+            else:
+                self.stats["answered"] += 1
+                self.stats["prompt_tokens"] += record["prompt_tokens"]
+                self.stats["generated_tokens"] += record["generated_tokens"]
+            finished = self.stats["answered"] + self.stats["failed"]
+            if self.progress and finished % self.progress == 0:
+                print(f"{finished} answered", file=sys.stderr)
+
+    def summary(self, seconds: float) -> Dict[str, Any]:
+        engine = self.engine.stats
+        prompt_tokens = engine["reused_tokens"] + engine["evaluated_tokens"]
+        return {
+            **self.stats,
+            "seconds": seconds,
+            "prompts_per_s": self.stats["answered"] / seconds if seconds else 0.0,
+            "generated_tokens_per_s": self.stats["generated_tokens"] / seconds if seconds else 0.0,
+            # Only measurable with an in-process llama.cpp model
+            "prefix_reuse": engine["reused_tokens"] / prompt_tokens if prompt_tokens else None,
+        }
+
+
+def load_pool(args):
+    """The app's worker-pool backend: `args.workers` model replicas in their own processes"""
+    from worker_pool import PooledLlamaCpp, WorkerPool
+
+    memory = MemoryProfile(args.n_ctx, args.kv_type, not args.no_mmap, args.mlock)
+    pool = WorkerPool(args.model, n_workers=args.workers, llama_kwargs={"seed": args.seed, **memory.llama_kwargs})
+    return PooledLlamaCpp(
+        pool=pool,
+        model_path=args.model,
+        temperature=args.temperature,
+        max_tokens=args.max_tokens,
+        top_p=0.9,
+        n_ctx=args.n_ctx,
+        stop=TURN_STOPS,
+    )
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    lines = [
+        f"answered           {summary['answered']} ({summary['skipped']} already done, {summary['failed']} failed)",
+        f"throughput         {summary['prompts_per_s']:.2f} prompts/s, {summary['generated_tokens_per_s']:.1f} generated tok/s",
+        f"tokens             {summary['prompt_tokens']} prompt, {summary['generated_tokens']} generated",
+        f"wall time          {summary['seconds']:.1f}s",
+    ]
+    if summary["prefix_reuse"] is not None:
+        lines.append(f"prefix reused      {summary['prefix_reuse']:.0%} of prompt tokens")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of prompts with the IyadBot pipeline")
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("output", help="JSONL file the results are appended to (resumed if it exists)")
+    add_model_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1, help="model replicas in worker processes (1 = in-process)")
+    parser.add_argument("--kv-dir", help="persona KV snapshot directory to start personas from (e.g. cache/kv)")
+    parser.add_argument("--progress", type=int, default=100, help="report progress every N prompts")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    if args.stub:
+        llm = StubLLM(max_tokens=args.max_tokens, n_ctx=args.n_ctx)
+        args.workers = 1
+    elif args.workers > 1:
+        llm = load_pool(args)
+    else:
+        llm = load_model(args)
+    engine = SessionEngine(llm)
+    if args.kv_dir and engine.client is not None:
+        from persona_snapshots import PersonaSnapshotStore, model_id_for
+
+        engine.prefix_store = PersonaSnapshotStore(args.kv_dir, model_id_for(engine.client))
+
+    summary = BatchRunner(engine, args.input, args.output, args.workers, args.progress).run()
+    print(format_summary(summary))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
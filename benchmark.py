@@ -0,0 +1,328 @@
+"""Headless benchmark of the chat pipeline.
+
+Scripted multi-turn conversations are replayed through the same persona,
+token-budget memory and conversation chain the app uses, and the run is
+summarized as prompt-eval and generation throughput, time to first token,
+p50/p95 turn latency and peak RSS.
+
+    python benchmark.py --stub                    # deterministic, no model file (CI)
+    python benchmark.py --n-threads 8 --n-batch 256 --json results.json
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import resource
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.llms.base import LLM
+from langchain.schema.output import GenerationChunk
+
+from conversation import TURN_STOPS, TokenBudgetMemory, TurnTimer, build_chain, set_reply_budget
+from memory_profile import KV_TYPES, MemoryProfile
+from persona import DEFAULT_SETTINGS, build_persona, response_token_budget
+from session_engine import SessionEngine
+
+DEFAULT_MODEL_PATH = "models/mistral-7b-instruct-v0.1.Q4_K_M.gguf"
+
+# Default scripts: each conversation is a list of user messages sent in order
+CONVERSATIONS = [
+    [
+        "Hey! I finally got Furina in my last ten pull 😭",
+        "Should I build her with the Golden Troupe set or go for something else?",
+        "Who would you put on her team if I only have Xingqiu and Bennett?",
+        "Okay and what about artifacts for Bennett?",
+        "Thanks bestie, going to farm now ✨",
+    ],
+    [
+        "What idol songs should I listen to today?",
+        "I already love NewJeans, anything similar?",
+        "Give me something more upbeat for the gym",
+        "Which of those has the best choreography?",
+    ],
+    [
+        "Noah knocked my water glass off the desk again",
+        "Milo just watched him do it like an accomplice lol",
+        "How do I keep cats off my desk without being mean?",
+        "Will a cat tree actually help?",
+        "Tell me something nice to cheer me up",
+        "Okay one more: rate Noah's chaos on a scale of 1 to 10",
+    ],
+]
+
+STUB_WORDS = (
+    "yo bestie that is so real honestly Genshin idol Noah Milo vibes hype slay "
+    "totally amazing pull team build song dance cat chaos cozy energy"
+).split()
+
+
+def count_stub_tokens(text: str) -> int:
+    """Deterministic word/punctuation token count used by the stub model"""
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+class StubLLM(LLM):
+    """Deterministic stand-in for LlamaCpp
+
+    The reply is derived from a hash of the prompt, so every run produces
+    the same conversation. Optional per-token delays give the report
+    non-zero model times without a model file.
+    """
+
+    max_tokens: int = 512
+    n_ctx: int = 2048
+    reply_tokens: int = 48
+    prompt_seconds_per_token: float = 0.0
+    seconds_per_token: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        time.sleep(self.prompt_seconds_per_token * count_stub_tokens(prompt))
+        rng = random.Random(hashlib.sha1(prompt.encode("utf-8")).digest())
+        n_tokens = min(self.reply_tokens, kwargs.get("max_tokens", self.max_tokens))
+        for index in range(n_tokens):
+            time.sleep(self.seconds_per_token)
+            chunk = GenerationChunk(text=(" " if index else "") + rng.choice(STUB_WORDS))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text)
+            yield chunk
+
+    def get_num_tokens(self, text: str) -> int:
+        return count_stub_tokens(text)
+
+
+@dataclass
+class TurnResult:
+    conversation: int
+    turn: int
+    latency: float
+    time_to_first_token: float
+    prompt_tokens: int
+    evaluated_tokens: int
+    generated_tokens: int
+    generation_seconds: float
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Linearly interpolated percentile, q in [0, 100]"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_conversation(engine: SessionEngine, index: int, messages: Sequence[str], settings: Dict[str, Any]) -> List[TurnResult]:
+    """Replay one conversation on a fresh memory, the way the app answers each message"""
+    memory = TokenBudgetMemory()
+    chain = build_chain(engine.llm, memory)
+    memory.persona = build_persona(settings)
+    set_reply_budget(chain, response_token_budget(settings))
+    session_id = f"benchmark-{index}"
+    results = []
+    for turn, message in enumerate(messages):
+        timer = TurnTimer()
+        evaluated_before = engine.stats["evaluated_tokens"]
+        started = time.perf_counter()
+        with engine.session(session_id):
+            chain.predict(input=message, callbacks=[timer] + engine.callbacks)
+        latency = time.perf_counter() - started
+        prompt_tokens = memory.last_usage["used"]
+        evaluated = engine.stats["evaluated_tokens"] - evaluated_before
+        results.append(TurnResult(
+            conversation=index,
+            turn=turn,
+            latency=latency,
+            time_to_first_token=timer.prompt_eval_seconds,
+            prompt_tokens=prompt_tokens,
+            # Without a llama.cpp client there is no KV cache: the whole prompt is evaluated
+            evaluated_tokens=evaluated if engine.client is not None else prompt_tokens,
+            generated_tokens=timer.generated_tokens,
+            generation_seconds=timer.decode_seconds,
+        ))
+    engine.forget(session_id)
+    return results
+
+
+def summarize(results: Sequence[TurnResult]) -> Dict[str, float]:
+    latencies = [r.latency for r in results]
+    ttfts = [r.time_to_first_token for r in results]
+    eval_seconds = sum(r.time_to_first_token for r in results)
+    # The first token of each turn is produced by the prompt evaluation
+    gen_tokens = sum(max(r.generated_tokens - 1, 0) for r in results)
+    gen_seconds = sum(r.generation_seconds for r in results)
+    return {
+        "turns": len(results),
+        "prompt_eval_tokens_per_s": sum(r.evaluated_tokens for r in results) / eval_seconds if eval_seconds else 0.0,
+        "generation_tokens_per_s": gen_tokens / gen_seconds if gen_seconds else 0.0,
+        "ttft_p50_s": percentile(ttfts, 50),
+        "ttft_p95_s": percentile(ttfts, 95),
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "prompt_tokens": sum(r.prompt_tokens for r in results),
+        "evaluated_tokens": sum(r.evaluated_tokens for r in results),
+        "generated_tokens": sum(r.generated_tokens for r in results),
+        "peak_rss_mb": peak_rss_bytes() / 2**20,
+    }
+
+
+def run_benchmark(
+    llm,
+    conversations: Sequence[Sequence[str]] = CONVERSATIONS,
+    settings: Optional[Dict[str, Any]] = None,
+    repeat: int = 1,
+) -> Dict[str, Any]:
+    """Replay every conversation `repeat` times and return the summary and per-turn results"""
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    engine = SessionEngine(llm)
+    results = []
+    for _ in range(repeat):
+        for index, messages in enumerate(conversations):
+            results.extend(run_conversation(engine, index, messages, settings))
+    summary = summarize(results)
+    draft_model = getattr(engine.client, "draft_model", None)
+    if draft_model is not None:
+        summary["draft_acceptance"] = draft_model.acceptance_rate()
+    return {"summary": summary, "turns": [asdict(r) for r in results]}
+
+
+def load_model(args):
+    """LlamaCpp with the app's parameters, overridden from the command line"""
+    from langchain.llms import LlamaCpp
+    from hardware_profile import default_profile, load_profile
+    from speculative import load_draft_model
+
+    # Unset thread and batch options come from this machine's saved profile
+    profile = load_profile(args.model) or default_profile(args.model)
+    args.n_threads = args.n_threads or profile.n_threads
+    args.n_threads_batch = args.n_threads_batch or profile.n_threads_batch
+    args.n_batch = args.n_batch or profile.n_batch
+
+    draft_model = load_draft_model(
+        args.draft_model, args.model, num_pred_tokens=args.draft_tokens, n_ctx=args.n_ctx, n_threads=args.n_threads
+    )
+    memory = MemoryProfile(args.n_ctx, args.kv_type, not args.no_mmap, args.mlock, args.n_batch)
+    model_kwargs = {"n_threads_batch": args.n_threads_batch, **memory.kv_kwargs}
+    if draft_model:
+        model_kwargs["draft_model"] = draft_model
+    elif args.draft_model:
+        print(f"Draft model {args.draft_model} is missing or incompatible, decoding without it", file=sys.stderr)
+    return LlamaCpp(
+        model_path=args.model,
+        temperature=args.temperature,
+        max_tokens=args.max_tokens,
+        top_p=0.9,
+        n_ctx=args.n_ctx,
+        use_mmap=memory.use_mmap,
+        use_mlock=memory.use_mlock,
+        verbose=False,
+        n_threads=args.n_threads,
+        n_batch=args.n_batch,
+        seed=args.seed,
+        stop=TURN_STOPS,
+        model_kwargs=model_kwargs,
+    )
+
+
+def add_model_arguments(parser: argparse.ArgumentParser):
+    """Command-line options read by `load_model` (shared with the batch runner)"""
+    parser.add_argument("--stub", action="store_true", help="use the deterministic stub model (no model file needed)")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--n-threads", type=int, help="generation threads (default: hardware profile)")
+    parser.add_argument("--n-threads-batch", type=int, help="prompt eval threads (default: hardware profile)")
+    parser.add_argument("--n-batch", type=int, help="default: hardware profile")
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--kv-type", default="f16", choices=list(KV_TYPES), help="KV cache type (if llama-cpp-python supports it)")
+    parser.add_argument("--no-mmap", action="store_true", help="read the weights into memory instead of mmap'ing them")
+    parser.add_argument("--mlock", action="store_true", help="lock the weights in RAM")
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--temperature", type=float, default=0.0, help="0 makes real-model runs repeatable")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--draft-model", help="small GGUF for speculative decoding")
+    parser.add_argument("--draft-tokens", type=int, default=8, help="tokens drafted per step")
+
+
+def format_summary(summary: Dict[str, float]) -> str:
+    lines = [
+        f"turns              {summary['turns']}",
+        f"prompt eval        {summary['prompt_eval_tokens_per_s']:.1f} tok/s ({summary['evaluated_tokens']} of {summary['prompt_tokens']} prompt tokens evaluated)",
+        f"generation         {summary['generation_tokens_per_s']:.1f} tok/s ({summary['generated_tokens']} tokens)",
+        f"time to 1st token  p50 {summary['ttft_p50_s']:.3f}s  p95 {summary['ttft_p95_s']:.3f}s",
+        f"turn latency       p50 {summary['latency_p50_s']:.3f}s  p95 {summary['latency_p95_s']:.3f}s",
+        f"peak RSS           {summary['peak_rss_mb']:.0f} MiB",
+    ]
+    if "draft_acceptance" in summary:
+        lines.append(f"draft accepted     {summary['draft_acceptance']:.0%}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IyadBot chat pipeline")
+    add_model_arguments(parser)
+    parser.add_argument("--conversations", help="JSON file with a list of conversations (lists of user messages)")
+    parser.add_argument("--settings", help="JSON object of personality settings to benchmark")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--stub-prompt-ms", type=float, default=0.0, help="simulated prompt eval time per token")
+    parser.add_argument("--stub-token-ms", type=float, default=0.0, help="simulated generation time per token")
+    parser.add_argument("--json", help="also write the summary and per-turn results to this file")
+    args = parser.parse_args()
+
+    conversations = CONVERSATIONS
+    if args.conversations:
+        with open(args.conversations, encoding="utf-8") as f:
+            conversations = json.load(f)
+    settings = json.loads(args.settings) if args.settings else None
+
+    if args.stub:
+        llm = StubLLM(
+            max_tokens=args.max_tokens,
+            n_ctx=args.n_ctx,
+            prompt_seconds_per_token=args.stub_prompt_ms / 1000,
+            seconds_per_token=args.stub_token_ms / 1000,
+        )
+    else:
+        llm = load_model(args)
+        # Same one-token warm-up as the app, so the first turn is not measured cold
+        llm.invoke("Hi", max_tokens=1)
+
+    report = run_benchmark(llm, conversations, settings, args.repeat)
+    report["config"] = {key: value for key, value in vars(args).items() if key != "json"}
+    print(format_summary(report["summary"]))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
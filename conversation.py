@@ -0,0 +1,295 @@
+"""Prompt, memory and chain assembly for IyadBot conversations."""
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chains import ConversationChain
+from langchain.prompts import PromptTemplate
+from langchain.schema import BaseMemory
+from langchain.pydantic_v1 import Field
+
+from conversation_store import ConversationStore
+
+HUMAN_PREFIX = "User"
+AI_PREFIX = "IyadBot"
+PREFIXES = {"user": HUMAN_PREFIX, "assistant": AI_PREFIX}
+
+# A reply is over once the model starts writing the next turn itself
+TURN_STOPS = [f"\n{HUMAN_PREFIX}:", f"\n{AI_PREFIX}:"]
+
+# The persona is sent once as a system prefix; it is never stored in history.
+# Turns recalled from long-term memory change every turn, so they go after
+# the history to keep persona + history a stable, cached prefix
+CHAT_PROMPT = PromptTemplate(
+    input_variables=["persona", "history", "memories", "input"],
+    template=f"{{persona}}\n\n{{history}}\n{{memories}}{HUMAN_PREFIX}: {{input}}\n{AI_PREFIX}:",
+)
+RECALL_HEADER = "(Recalled from earlier in the conversation)"
+
+
+class TokenBudgetMemory(BaseMemory):
+    """Conversation memory that keeps the prompt inside the model's context window
+
+    History is trimmed from the oldest turn whenever persona + history + input
+    would leave less than `max_tokens` free in `n_ctx`. Trimming goes down to
+    `compact_ratio` of the budget so the kept prefix stays stable (and cached
+    in the KV cache) for several turns instead of shifting every turn.
+
+    Turns live in a ConversationStore. When the app records messages in that
+    store itself (the chat UI does), set `record_turns=False` so the chain
+    does not store them a second time.
+
+    With a `long_term` VectorIndex every answered turn is also indexed, and
+    up to `recall_k` earlier turns relevant to the new message (at most
+    `recall_budget` tokens) are recalled into the prompt.
+    """
+
+    llm: Any = None
+    persona: str = ""
+    n_ctx: int = 2048
+    max_tokens: int = 512
+    history_budget: Optional[int] = None
+    compact_ratio: float = 0.75
+    store: Any = Field(default_factory=ConversationStore)
+    record_turns: bool = True
+    long_term: Any = None
+    recall_k: int = 3
+    recall_budget: int = 192
+    start: int = 0
+    token_cache: Dict[str, int] = Field(default_factory=dict)
+    last_usage: Dict[str, int] = Field(default_factory=dict)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return ["persona", "history", "memories"]
+
+    def count_tokens(self, text: str) -> int:
+        """Count tokens with the model's tokenizer"""
+        if self.llm is not None:
+            return self.llm.get_num_tokens(text)
+        return len(text) // 4 + 1
+
+    def persona_tokens(self) -> int:
+        if self.persona not in self.token_cache:
+            self.token_cache.clear()
+            self.token_cache[self.persona] = self.count_tokens(self.persona)
+        return self.token_cache[self.persona]
+
+    def history_end(self, pending_input: Optional[str] = None) -> int:
+        """Index after the last message that belongs in the history
+
+        A trailing user message equal to the input being answered is the
+        current turn, not history.
+        """
+        end = len(self.store)
+        if end and self.store.role(end - 1) == "user" and self.store.content(end - 1) == pending_input:
+            end -= 1
+        return end
+
+    def history_lines(self, pending_input: Optional[str] = None) -> List[str]:
+        return [
+            f"{PREFIXES[message.role]}: {message.content}"
+            for message in (self.store[i] for i in range(self.history_end(pending_input)))
+        ]
+
+    def line_tokens(self, index: int) -> int:
+        # Role prefix and newline are counted as a flat 3 tokens per line
+        return self.store.token_count(index, self.count_tokens) + 3
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        user_input = inputs.get("input", "")
+        persona_tokens = self.persona_tokens()
+        input_tokens = self.count_tokens(
+            CHAT_PROMPT.format(persona="", history="", memories="", input=user_input)
+        )
+        recall_budget = self.recall_budget if self.long_term is not None else 0
+        budget = self.n_ctx - self.max_tokens - persona_tokens - input_tokens - recall_budget
+        if self.history_budget is not None:
+            budget = min(budget, self.history_budget)
+        budget = max(budget, 0)
+
+        lines = self.history_lines(user_input)
+        line_tokens = [self.line_tokens(index) for index in range(len(lines))]
+        self.start = min(self.start, len(lines))
+        history_tokens = sum(line_tokens[self.start:])
+        if history_tokens > budget:
+            # Compact well below the budget so the next turns fit without trimming
+            target = int(budget * self.compact_ratio)
+            while self.start < len(lines) and history_tokens > target:
+                history_tokens -= line_tokens[self.start]
+                self.start += 1
+
+        # Earlier turns that are no longer in the history, if relevant to this message
+        memories, memory_tokens = self.recall(user_input, recall_budget)
+
+        # Per-message counts are estimates of the joined prompt; check the real
+        # length once and keep dropping turns if tokenization merged differently
+        history = self.render_history(lines)
+        used = self.prompt_tokens(history, user_input, memories)
+        while used > self.n_ctx - self.max_tokens and self.start < len(lines):
+            history_tokens -= line_tokens[self.start]
+            self.start += 1
+            history = self.render_history(lines)
+            used = self.prompt_tokens(history, user_input, memories)
+
+        self.last_usage = {
+            "persona": persona_tokens,
+            "history": history_tokens,
+            "memories": memory_tokens,
+            "input": input_tokens,
+            "reserved": self.max_tokens,
+            "used": used,
+            "n_ctx": self.n_ctx,
+        }
+        return {"persona": self.persona, "history": history, "memories": memories}
+
+    def recall(self, user_input: str, budget: int):
+        """Recalled turns as prompt text, and their token count"""
+        if self.long_term is None or not budget:
+            return "", 0
+        # Turns still in the history are already in the prompt
+        first_in_history = self.store.offset + self.start
+        recalled, used = [], self.count_tokens(RECALL_HEADER)
+        for recollection in self.long_term.search(user_input, self.recall_k, before_seq=first_in_history):
+            tokens = self.count_tokens(recollection.text) + 1
+            if used + tokens > budget:
+                continue
+            recalled.append(recollection)
+            used += tokens
+        if not recalled:
+            return "", 0
+        # Oldest first, like the history
+        texts = [recollection.text for recollection in sorted(recalled, key=lambda r: r.seq)]
+        return "\n".join([RECALL_HEADER] + texts) + "\n", used
+
+    def render_history(self, lines: List[str]) -> str:
+        history = "\n".join(lines[self.start:])
+        # Messages of a reopened conversation that were never loaded count as omitted too
+        omitted = self.start + self.store.offset
+        if omitted:
+            summary = f". {self.store.summary}" if self.store.offset and self.store.summary else ""
+            history = f"(Earlier messages omitted: {omitted}{summary})\n{history}"
+        return history
+
+    def prompt_tokens(self, history: str, user_input: str, memories: str = "") -> int:
+        """Exact token count of the full prompt (not cached, it changes every turn)"""
+        prompt = CHAT_PROMPT.format(persona=self.persona, history=history, memories=memories, input=user_input)
+        if self.llm is None:
+            return len(prompt) // 4 + 1
+        return self.llm.get_num_tokens(prompt)
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        if self.record_turns:
+            self.store.append("user", inputs["input"])
+            self.store.append("assistant", outputs["response"].strip())
+        if self.long_term is not None:
+            # The answered message is the last user message in the store
+            index = next((i for i in range(len(self.store) - 1, -1, -1) if self.store.role(i) == "user"), None)
+            if index is not None:
+                self.long_term.add(
+                    self.store.offset + index,
+                    f"{HUMAN_PREFIX}: {inputs['input']}\n{AI_PREFIX}: {outputs['response'].strip()}"
+                )
+
+    def clear(self) -> None:
+        self.store.clear()
+        if self.long_term is not None:
+            self.long_term.clear()
+        self.start = 0
+        self.token_cache = {}
+        self.last_usage = {}
+
+    def context_usage(self) -> float:
+        """Fraction of the context window used by the last prompt"""
+        if not self.last_usage:
+            return 0.0
+        return self.last_usage["used"] / self.last_usage["n_ctx"]
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """Pass the reply generated so far to `render` after every new token
+
+    Exceptions raised by `render` propagate, so a render callback can abort
+    generation (used to stop a reply mid-stream).
+    """
+
+    raise_error = True
+
+    def __init__(self, render: Callable[[str], None]):
+        self.render = render
+        self.text = ""
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.text += token
+        self.render(self.text)
+
+
+class TurnTimer(BaseCallbackHandler):
+    """Time the prompt evaluation and decoding of one model call"""
+
+    def __init__(self):
+        self.started = 0.0
+        self.first_token: Optional[float] = None
+        self.finished = 0.0
+        self.generated_tokens = 0
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs) -> None:
+        self.started = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.generated_tokens += 1
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        self.finished = time.perf_counter()
+
+    @property
+    def prompt_eval_seconds(self) -> float:
+        """Time to the first token, which is produced by the prompt evaluation"""
+        first_token = self.first_token or self.finished
+        return first_token - self.started
+
+    @property
+    def decode_seconds(self) -> float:
+        return self.finished - (self.first_token or self.finished)
+
+
+def end_of_turn(text: str) -> str:
+    """The reply up to the first turn marker, for backends that ignore stop sequences"""
+    for stop in TURN_STOPS:
+        text = text.split(stop, 1)[0]
+    return text.strip()
+
+
+def build_chain(llm, memory: TokenBudgetMemory) -> ConversationChain:
+    """Build the IyadBot conversation chain around a loaded LLM"""
+    memory.llm = llm
+    memory.n_ctx = getattr(llm, "n_ctx", memory.n_ctx)
+    memory.max_tokens = getattr(llm, "max_tokens", None) or memory.max_tokens
+    return ConversationChain(llm=llm, memory=memory, prompt=CHAT_PROMPT, verbose=False)
+
+
+def switch_llm(chain: ConversationChain, llm):
+    """Answer the next turns with another model, keeping the conversation
+
+    Token counts cached for messages stay as estimates; the exact prompt
+    check in the memory uses the new model's tokenizer.
+    """
+    if chain.llm is llm:
+        return
+    chain.llm = llm
+    chain.memory.llm = llm
+    chain.memory.n_ctx = getattr(llm, "n_ctx", chain.memory.n_ctx)
+    chain.memory.token_cache = {}
+
+
+def set_reply_budget(chain: ConversationChain, max_tokens: int):
+    """Cap the next replies at `max_tokens` (at most the LLM's own limit)
+
+    The memory reserves the same amount of context, so short replies leave
+    more room for history.
+    """
+    max_tokens = min(max_tokens, getattr(chain.llm, "max_tokens", None) or max_tokens)
+    chain.llm_kwargs = {**chain.llm_kwargs, "max_tokens": max_tokens}
+    chain.memory.max_tokens = max_tokens
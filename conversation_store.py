@@ -0,0 +1,121 @@
+"""Compact, array-backed message store shared by the chat UI and chain memory."""
+import sys
+import time
+from array import array
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence
+
+# Roles are stored as one byte each; these are the interned strings they map to
+ROLES = ("user", "assistant")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+
+class Message(NamedTuple):
+    """Read-only view of one stored message"""
+    role: str
+    content: str
+    timestamp: int
+
+
+class ConversationStore:
+    """One conversation held in parallel arrays
+
+    Roles are byte codes, timestamps are integer epoch seconds and per-message
+    token counts and rendered HTML are cached alongside the text, so a turn is
+    stored exactly once no matter how many readers it has.
+
+    A conversation reopened from disk may hold only its most recent messages:
+    `offset` counts the earlier ones that are not loaded and `summary`
+    describes them.
+    """
+
+    __slots__ = ("_roles", "_timestamps", "_tokens", "_contents", "_html", "offset", "summary")
+
+    def __init__(self):
+        self._roles = array("B")
+        self._timestamps = array("q")
+        self._tokens = array("i")
+        self._contents: List[str] = []
+        self._html: List[Optional[str]] = []
+        self.offset = 0
+        self.summary = ""
+
+    def append(self, role: str, content: str, timestamp: Optional[int] = None) -> int:
+        """Add a message and return its index"""
+        self._roles.append(ROLE_CODES[role])
+        self._timestamps.append(int(time.time()) if timestamp is None else int(timestamp))
+        self._tokens.append(-1)
+        self._contents.append(content)
+        self._html.append(None)
+        return len(self._contents) - 1
+
+    def prepend(self, messages: Sequence[Message]):
+        """Insert earlier messages of the conversation in front of the loaded ones"""
+        count = len(messages)
+        self._roles[:0] = array("B", (ROLE_CODES[m.role] for m in messages))
+        self._timestamps[:0] = array("q", (int(m.timestamp) for m in messages))
+        self._tokens[:0] = array("i", [-1] * count)
+        self._contents[:0] = [m.content for m in messages]
+        self._html[:0] = [None] * count
+        self.offset = max(self.offset - count, 0)
+
+    def drop_oldest(self, count: int):
+        """Unload the first `count` messages; they count as not loaded, like a reopened conversation's"""
+        count = min(count, len(self._contents))
+        del self._roles[:count]
+        del self._timestamps[:count]
+        del self._tokens[:count]
+        del self._contents[:count]
+        del self._html[:count]
+        self.offset += count
+
+    def clear(self):
+        del self._roles[:]
+        del self._timestamps[:]
+        del self._tokens[:]
+        self._contents.clear()
+        self._html.clear()
+        self.offset = 0
+        self.summary = ""
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    @property
+    def total(self) -> int:
+        """Number of messages in the whole conversation, loaded or not"""
+        return self.offset + len(self._contents)
+
+    def __getitem__(self, index: int) -> Message:
+        return Message(ROLES[self._roles[index]], self._contents[index], self._timestamps[index])
+
+    def __iter__(self) -> Iterator[Message]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def role(self, index: int) -> str:
+        return ROLES[self._roles[index]]
+
+    def content(self, index: int) -> str:
+        return self._contents[index]
+
+    def token_count(self, index: int, counter: Callable[[str], int]) -> int:
+        """Token count of a message's text, computed once with `counter`"""
+        if self._tokens[index] < 0:
+            self._tokens[index] = counter(self._contents[index])
+        return self._tokens[index]
+
+    def html(self, index: int, builder: Callable[[str, str], str]) -> str:
+        """Rendered HTML of a message, built once with `builder(role, content)`"""
+        if self._html[index] is None:
+            self._html[index] = builder(self.role(index), self._contents[index])
+        return self._html[index]
+
+    def nbytes(self) -> int:
+        """Approximate memory held by this conversation"""
+        size = sum(
+            sys.getsizeof(part)
+            for part in (self._roles, self._timestamps, self._tokens, self._contents, self._html)
+        )
+        size += sum(sys.getsizeof(text) for text in self._contents)
+        size += sum(sys.getsizeof(text) for text in self._html if text is not None)
+        return size
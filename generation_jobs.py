@@ -0,0 +1,172 @@
+"""Background generation jobs, one per chat session.
+
+Replies are generated on their own thread instead of inside the Streamlit
+script run. The script follows a job's text as it grows and can stop it at
+any time. The job raises `Cancelled` from its next token callback, which
+unwinds llama.cpp's decoding loop and frees the model slot. A session that
+stops polling its job (the tab was closed or the browser went away) has the
+job cancelled after `abandon_after` seconds so its cores go back to active
+users.
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+QUEUED, RUNNING, DONE, STOPPED, FAILED = "queued", "running", "done", "stopped", "failed"
+
+
+class Cancelled(Exception):
+    """The job was stopped by its user or abandoned by its session"""
+
+
+class GenerationJob:
+    """State of one reply being generated, shared between the worker and the UI"""
+
+    def __init__(self, session_id: str, label: Optional[str] = None):
+        self.session_id = session_id
+        # What is generating the reply (the model tier), for the UI
+        self.label = label
+        self.status = QUEUED
+        self.text = ""
+        self.response: Optional[str] = None
+        self.error: Optional[Exception] = None
+        self.position = 0
+        self.eta = 0.0
+        self.created_at = self.last_seen = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, STOPPED, FAILED)
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds from submission (including any queue wait) to the end, or to now"""
+        return (self.finished_at or time.monotonic()) - self.created_at
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def queued(self, position: int, eta: float):
+        """Scheduler wait callback: publish the queue position, or give up the place if cancelled"""
+        self.check()
+        self.position, self.eta = position, eta
+
+    def admitted(self):
+        """Called once the scheduler gives the job a model slot, before the prompt is evaluated"""
+        self.check()
+        self.status, self.position, self.eta = RUNNING, 0, 0.0
+
+    def report(self, text: str):
+        """Token callback: publish the reply so far, or abort decoding if cancelled"""
+        self.check()
+        self.text = text
+
+
+class JobManager:
+    """Run at most one generation job per session and reap abandoned ones"""
+
+    def __init__(self, abandon_after: float = 15.0, keep_finished: float = 600.0, poll_interval: float = 1.0):
+        self.abandon_after = abandon_after
+        self.keep_finished = keep_finished
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, GenerationJob] = {}
+        self.stats = {"completed": 0, "stopped": 0, "abandoned": 0, "failed": 0}
+        threading.Thread(target=self._reap, name="iyadbot-job-reaper", daemon=True).start()
+
+    def start(
+        self, session_id: str, work: Callable[[GenerationJob], str], label: Optional[str] = None
+    ) -> GenerationJob:
+        """Run `work(job)` on a new thread; its return value becomes the job's response"""
+        job = GenerationJob(session_id, label)
+        with self._lock:
+            previous = self._jobs.get(session_id)
+            if previous is not None and not previous.finished:
+                raise RuntimeError("This session is already generating a reply")
+            self._jobs[session_id] = job
+        threading.Thread(target=self._run, args=(job, work), name="iyadbot-generation", daemon=True).start()
+        return job
+
+    def get(self, session_id: str) -> Optional[GenerationJob]:
+        """The session's current or finished-but-uncollected job, marking the session as present"""
+        with self._lock:
+            job = self._jobs.get(session_id)
+        if job is not None:
+            job.last_seen = time.monotonic()
+        return job
+
+    def busy(self, session_id: str) -> bool:
+        """Whether the session has a running job or an uncollected reply (without marking it present)"""
+        with self._lock:
+            return session_id in self._jobs
+
+    def stop(self, session_id: str):
+        with self._lock:
+            job = self._jobs.get(session_id)
+        if job is not None:
+            job.cancel()
+
+    def discard(self, session_id: str):
+        """Forget a finished job once its reply has been collected"""
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job is not None and job.finished:
+                del self._jobs[session_id]
+
+    def drop(self, session_id: str):
+        """Stop the session's job, if any, and forget it along with a reply not collected yet"""
+        with self._lock:
+            job = self._jobs.pop(session_id, None)
+        if job is not None:
+            job.cancel()
+
+    def running(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _run(self, job: GenerationJob, work: Callable[[GenerationJob], str]):
+        # finished_at is set before the final status, which is what makes the job `finished`
+        try:
+            job.response = work(job)
+            job.finished_at = time.monotonic()
+            job.status = DONE
+            self.stats["completed"] += 1
+        except Cancelled:
+            job.finished_at = time.monotonic()
+            job.status = STOPPED
+            self.stats["stopped"] += 1
+        except Exception as e:
+            job.error = e
+            job.finished_at = time.monotonic()
+            job.status = FAILED
+            self.stats["failed"] += 1
+
+    def _reap(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.sweep()
+            except Exception:
+                # One bad pass must not end the reaper; the next one tries again
+                pass
+
+    def sweep(self):
+        """Cancel abandoned jobs and forget finished ones nobody collected"""
+        now = time.monotonic()
+        with self._lock:
+            for session_id, job in list(self._jobs.items()):
+                if not job.finished and not job.cancelled and now - job.last_seen > self.abandon_after:
+                    job.cancel()
+                    self.stats["abandoned"] += 1
+                elif job.finished and job.finished_at is not None and now - job.finished_at > self.keep_finished:
+                    del self._jobs[session_id]
@@ -0,0 +1,264 @@
+"""Thread and batch settings for llama.cpp, calibrated on this machine.
+
+Using every logical CPU oversubscribes hyperthreads: llama.cpp's matrix
+kernels are limited by memory bandwidth and the cores' vector units, which
+two hyperthreads of the same core share. Calibration measures the installed
+model under a few thread counts and batch sizes. Prompt evaluation (large
+batches, `n_threads_batch`) and token generation (one token at a time,
+`n_threads`) are timed separately, since they often peak at different
+thread counts. The best settings are saved as a profile along with the CPU
+topology and model they were measured on. A profile whose topology or model
+no longer matches is stale and is calibrated again.
+
+    python hardware_profile.py --model models/mistral-7b-instruct-v0.1.Q4_K_M.gguf
+
+Calibration loads the model once per batch size, so the app never waits for
+it: a model loads with the saved profile or the defaults, and a missing or
+stale profile is calibrated on one background thread for the next load.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from persona import build_persona
+
+DEFAULT_PROFILE_PATH = "cache/hardware_profile.json"
+BATCH_SIZES = (128, 256, 512)
+
+# Held while a background calibration runs, so there is only ever one
+_calibrating = threading.Lock()
+
+
+@dataclass
+class HardwareProfile:
+    n_threads: int
+    n_threads_batch: int
+    n_batch: int
+    topology: Dict[str, Any]
+    model: Dict[str, Any]
+    results: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def llama_kwargs(self) -> Dict[str, int]:
+        return {"n_threads": self.n_threads, "n_threads_batch": self.n_threads_batch, "n_batch": self.n_batch}
+
+
+def usable_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def physical_cores(cpus: Sequence[int]) -> int:
+    """Distinct physical cores among `cpus` (hyperthread siblings count once)"""
+    cores = set()
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{topology}/physical_package_id") as f:
+                package = f.read().strip()
+            with open(f"{topology}/core_id") as f:
+                cores.add((package, f.read().strip()))
+        except OSError:
+            return len(cpus)
+    return len(cores) or len(cpus)
+
+
+def cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def cpu_topology() -> Dict[str, Any]:
+    """What the profile was measured on; any change makes it stale"""
+    cpus = usable_cpus()
+    return {
+        "machine": platform.machine(),
+        "cpu_model": cpu_model(),
+        "logical_cpus": os.cpu_count() or 1,
+        "usable_cpus": len(cpus),
+        "physical_cores": physical_cores(cpus),
+        "numa_nodes": len(glob.glob("/sys/devices/system/node/node[0-9]*")),
+    }
+
+
+def model_identity(model_path: str) -> Dict[str, Any]:
+    return {"name": os.path.basename(model_path), "size": os.path.getsize(model_path)}
+
+
+def default_profile(model_path: str) -> HardwareProfile:
+    """One thread per physical core, before (or without) calibration"""
+    topology = cpu_topology()
+    threads = topology["physical_cores"]
+    return HardwareProfile(threads, threads, 512, topology, model_identity(model_path))
+
+
+def candidate_threads(topology: Dict[str, Any]) -> List[int]:
+    physical, usable = topology["physical_cores"], topology["usable_cpus"]
+    return sorted({max(1, physical // 2), max(1, physical - 1), physical, usable})
+
+
+def calibrate(
+    model_path: str,
+    n_ctx: int = 2048,
+    batch_sizes: Sequence[int] = BATCH_SIZES,
+    prompt_tokens: int = 512,
+    decode_tokens: int = 16,
+    log: Optional[Callable[[str], None]] = None,
+) -> HardwareProfile:
+    """Time prompt evaluation and generation of `model_path` and pick the fastest settings
+
+    Thread counts are compared at the largest batch size, then batch sizes at
+    the best prompt-eval thread count, so each context is loaded only once
+    per batch size.
+    """
+    import llama_cpp
+
+    topology = cpu_topology()
+    threads = candidate_threads(topology)
+    results = []
+
+    def measure(llama, n_threads, tokens):
+        llama_cpp.llama_set_n_threads(llama._ctx.ctx, n_threads, n_threads)
+        llama.reset()
+        started = time.perf_counter()
+        llama.eval(tokens)
+        prompt_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for token in tokens[:decode_tokens]:
+            llama.eval([token])
+        decode_seconds = time.perf_counter() - started
+        result = {
+            "n_batch": llama.n_batch,
+            "n_threads": n_threads,
+            "prompt_tokens_per_s": len(tokens) / prompt_seconds,
+            "decode_tokens_per_s": min(decode_tokens, len(tokens)) / decode_seconds,
+        }
+        results.append(result)
+        if log:
+            log(
+                f"n_batch {result['n_batch']:4d}  threads {n_threads:3d}  "
+                f"prompt {result['prompt_tokens_per_s']:8.1f} tok/s  decode {result['decode_tokens_per_s']:6.1f} tok/s"
+            )
+        return result
+
+    def load(n_batch):
+        llama = llama_cpp.Llama(model_path=model_path, n_ctx=n_ctx, n_batch=n_batch, verbose=False)
+        # A persona-like prompt, repeated up to the wanted length
+        text = build_persona().encode("utf-8")
+        tokens = llama.tokenize(text)
+        while len(tokens) < prompt_tokens:
+            tokens += llama.tokenize(text, add_bos=False)
+        return llama, tokens[:min(prompt_tokens, n_ctx - decode_tokens)]
+
+    largest = max(batch_sizes)
+    llama, tokens = load(largest)
+    by_threads = [measure(llama, n, tokens) for n in threads]
+    del llama
+    best_prompt = max(by_threads, key=lambda r: r["prompt_tokens_per_s"])
+    best_decode = max(by_threads, key=lambda r: r["decode_tokens_per_s"])
+
+    for n_batch in sorted(batch_sizes, reverse=True)[1:]:
+        llama, tokens = load(n_batch)
+        measure(llama, best_prompt["n_threads"], tokens)
+        del llama
+    best_batch = max(
+        (r for r in results if r["n_threads"] == best_prompt["n_threads"]),
+        key=lambda r: r["prompt_tokens_per_s"],
+    )
+
+    return HardwareProfile(
+        n_threads=best_decode["n_threads"],
+        n_threads_batch=best_prompt["n_threads"],
+        n_batch=best_batch["n_batch"],
+        topology=topology,
+        model=model_identity(model_path),
+        results=results,
+    )
+
+
+def save_profile(profile: HardwareProfile, path: str = DEFAULT_PROFILE_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(asdict(profile), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_profile(model_path: str, path: str = DEFAULT_PROFILE_PATH) -> Optional[HardwareProfile]:
+    """The saved profile, or None if there is none or it was measured on another CPU or model"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = HardwareProfile(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+    if profile.topology != cpu_topology() or profile.model != model_identity(model_path):
+        return None
+    return profile
+
+
+def tuned_profile(model_path: str, path: str = DEFAULT_PROFILE_PATH) -> HardwareProfile:
+    """The saved profile if still valid, else the defaults"""
+    return load_profile(model_path, path) or default_profile(model_path)
+
+
+def calibrate_in_background(model_path: str, path: str = DEFAULT_PROFILE_PATH) -> bool:
+    """Calibrate and save a profile on a daemon thread, unless it is valid or being calibrated
+
+    Returns whether a calibration was started.
+    """
+    if not _calibrating.acquire(blocking=False):
+        return False
+    if load_profile(model_path, path) is not None:
+        _calibrating.release()
+        return False
+
+    def run():
+        try:
+            save_profile(calibrate(model_path), path)
+        except Exception:
+            # The defaults stay in use; the next model load tries again
+            pass
+        finally:
+            _calibrating.release()
+
+    threading.Thread(target=run, name="iyadbot-calibration", daemon=True).start()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate llama.cpp threads and batch size for this machine")
+    parser.add_argument("--model", default="models/mistral-7b-instruct-v0.1.Q4_K_M.gguf")
+    parser.add_argument("--output", default=DEFAULT_PROFILE_PATH)
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(BATCH_SIZES))
+    parser.add_argument("--prompt-tokens", type=int, default=512)
+    parser.add_argument("--decode-tokens", type=int, default=16)
+    args = parser.parse_args()
+
+    print(json.dumps(cpu_topology()))
+    profile = calibrate(
+        args.model, args.n_ctx, args.batch_sizes, args.prompt_tokens, args.decode_tokens, log=print
+    )
+    save_profile(profile, args.output)
+    print(
+        f"best: n_threads {profile.n_threads} (generation), n_threads_batch {profile.n_threads_batch} "
+        f"(prompt eval), n_batch {profile.n_batch} -> {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Durable conversation history in a local SQLite database.
+
+Turns are queued by the app and written by a background thread in batched
+transactions, so persistence never sits on the response path. The database
+runs in WAL mode, which lets sessions read while the writer commits.
+Reopened sessions load only their most recent messages plus a short summary
+of what came before; older messages are fetched when the user asks for them.
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+from conversation_store import ROLE_CODES, ROLES, Message
+
+DEFAULT_DB_PATH = os.path.join("cache", "conversations.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+# Earlier user messages quoted in the summary, and how much of each
+SUMMARY_TOPICS = 5
+SUMMARY_TOPIC_CHARS = 60
+
+
+class SavedConversation(NamedTuple):
+    """Most recent window of a stored conversation"""
+    messages: List[Message]
+    offset: int
+    user_turns: int
+    summary: str
+
+
+def summarize_topics(snippets: List[str]) -> str:
+    """One-line extractive summary of earlier user messages, oldest first"""
+    topics = []
+    for snippet in snippets:
+        snippet = " ".join(snippet.split())
+        if len(snippet) >= SUMMARY_TOPIC_CHARS:
+            snippet = snippet[:SUMMARY_TOPIC_CHARS - 1].rstrip() + "…"
+        if snippet:
+            topics.append(f'"{snippet}"')
+    return f"Iyad talked about {'; '.join(topics)}" if topics else ""
+
+
+class ConversationDB:
+    """SQLite store of every session's messages with an asynchronous batched writer"""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, batch_size: int = 64, flush_interval: float = 0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        self._queue: "queue.Queue[Optional[Tuple]]" = queue.Queue()
+        self.stats = {"written": 0, "batches": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name="iyadbot-history-db", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, session_id: str, seq: int, role: str, content: str, timestamp: int):
+        """Queue one message; `seq` is its position in the whole conversation"""
+        self._queue.put(("append", (session_id, seq, ROLE_CODES[role], content, timestamp)))
+
+    def clear(self, session_id: str):
+        self._queue.put(("clear", (session_id,)))
+
+    def flush(self):
+        """Block until every queued write is committed"""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def load(self, session_id: str, limit: int) -> Optional[SavedConversation]:
+        """The last `limit` messages of a session, or None if it has none"""
+        self.flush()
+        with self._connect() as conn:
+            total, user_turns = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(role = ?), 0) FROM messages WHERE session_id = ?",
+                (ROLE_CODES["user"], session_id),
+            ).fetchone()
+            if not total:
+                return None
+            offset = max(total - limit, 0)
+            snippets = conn.execute(
+                "SELECT substr(content, 1, ?) FROM messages"
+                " WHERE session_id = ? AND role = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (SUMMARY_TOPIC_CHARS + 1, session_id, ROLE_CODES["user"], offset, SUMMARY_TOPICS),
+            ).fetchall()
+        return SavedConversation(
+            messages=self.load_range(session_id, offset, total),
+            offset=offset,
+            user_turns=user_turns,
+            summary=summarize_topics([row[0] for row in reversed(snippets)]),
+        )
+
+    def load_range(self, session_id: str, start: int, stop: int) -> List[Message]:
+        """Messages with positions in [start, stop)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content, timestamp FROM messages"
+                " WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (session_id, start, stop),
+            ).fetchall()
+        return [Message(ROLES[role], content, timestamp) for role, content, timestamp in rows]
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                # Collect whatever else arrives shortly after, up to one batch
+                deadline = time.monotonic() + self.flush_interval
+                while batch[-1] is not None and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                    except queue.Empty:
+                        break
+                self._write(conn, [op for op in batch if op is not None])
+                for _ in batch:
+                    self._queue.task_done()
+                if batch[-1] is None:
+                    return
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: List[Tuple]):
+        if not batch:
+            return
+        try:
+            with conn:
+                for kind, args in batch:
+                    if kind == "append":
+                        conn.execute(
+                            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)", args
+                        )
+                    else:
+                        conn.execute("DELETE FROM messages WHERE session_id = ?", args)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except sqlite3.Error:
+            # History is best effort; the live session keeps its in-memory copy
+            self.stats["errors"] += 1
@@ -0,0 +1,163 @@
+"""Long-term conversation memory in a local vector index.
+
+The prompt only holds the most recent turns. Every answered turn is also
+embedded and appended to a per-conversation index on disk; each new message
+retrieves the few earlier turns most similar to it, which go into the
+prompt in place of the whole history. The prompt therefore stays the same
+size however long the conversation gets.
+
+Embeddings are feature-hashed bags of words and word pairs, so no embedding
+model has to be loaded, and a search is one matrix-vector product over the
+index (a few milliseconds for tens of thousands of turns). Any object with
+a `dim` and an `embed(texts)` method returning unit vectors can be used
+instead.
+
+On disk an index is two append-only files: `<name>.vec` holds the float32
+vectors and `<name>.jsonl` the sequence number and text of each turn.
+"""
+import bisect
+import json
+import math
+import os
+import re
+import sys
+import threading
+import zlib
+from collections import Counter
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+WORD = re.compile(r"\w+")
+
+# Too common to say anything about what a turn is about
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do for from had has have he her him his how i if in is it its "
+    "just me my not of oh ok okay on or so that the their them then there they this to too u um "
+    "was we were what when where which who why will with would yeah you your user iyadbot".split()
+)
+
+
+class Recollection(NamedTuple):
+    score: float
+    seq: int
+    text: str
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and adjacent word pairs, L2-normalized"""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def features(self, text: str) -> Counter:
+        words = [w for w in WORD.findall(text.lower()) if w not in STOPWORDS]
+        return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self.features(text).items():
+                # crc32 is stable across processes, unlike hash()
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += (1.0 if h & 1 << 31 else -1.0) * (1.0 + math.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """Embedded turns of one conversation, kept in memory and appended to disk"""
+
+    def __init__(self, path: Optional[str] = None, embedder=None):
+        self.path = path
+        self.embedder = embedder or HashingEmbedder()
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._size = 0
+        self.seqs: List[int] = []
+        self.texts: List[str] = []
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._load()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the index"""
+        return self._vectors.nbytes + sum(sys.getsizeof(text) for text in self.texts)
+
+    def add(self, seq: int, text: str):
+        """Index one turn; `seq` is its position in the conversation"""
+        vector = self.embedder.embed([text])[0]
+        with self._lock:
+            if self._size == len(self._vectors):
+                # Grow by doubling so appends stay amortized O(1)
+                grown = np.zeros((max(2 * self._size, 64), self.embedder.dim), dtype=np.float32)
+                grown[:self._size] = self._vectors[:self._size]
+                self._vectors = grown
+            self._vectors[self._size] = vector
+            self._size += 1
+            self.seqs.append(seq)
+            self.texts.append(text)
+            if self.path:
+                with open(f"{self.path}.vec", "ab") as f:
+                    vector.tofile(f)
+                with open(f"{self.path}.jsonl", "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"seq": seq, "text": text}, ensure_ascii=False) + "\n")
+
+    def search(self, query: str, k: int = 3, before_seq: Optional[int] = None, min_score: float = 0.15) -> List[Recollection]:
+        """The `k` turns most similar to `query`, best first
+
+        Only turns with a sequence number below `before_seq` are considered,
+        so turns already in the prompt are not recalled again.
+        """
+        with self._lock:
+            size = self._size
+            if before_seq is not None:
+                # Turns are added in order, so the eligible ones are a prefix
+                size = bisect.bisect_left(self.seqs, before_seq, 0, size)
+            if not size or k <= 0:
+                return []
+            scores = self._vectors[:size] @ self.embedder.embed([query])[0]
+            top = np.argpartition(-scores, min(k, size) - 1)[:k]
+            return [
+                Recollection(float(scores[i]), self.seqs[i], self.texts[i])
+                for i in sorted(top, key=lambda i: -scores[i])
+                if scores[i] >= min_score
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+            self._size = 0
+            self.seqs, self.texts = [], []
+            if self.path:
+                for suffix in (".vec", ".jsonl"):
+                    if os.path.exists(self.path + suffix):
+                        os.remove(self.path + suffix)
+
+    def _load(self):
+        try:
+            raw = np.fromfile(f"{self.path}.vec", dtype=np.float32)
+            with open(f"{self.path}.jsonl", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f if line.endswith("\n")]
+        except (OSError, ValueError):
+            return
+        vectors = raw[:len(raw) // self.embedder.dim * self.embedder.dim].reshape(-1, self.embedder.dim)
+        # A write interrupted between (or inside) the two files leaves one of them ahead
+        size = min(len(vectors), len(records))
+        self._vectors = vectors[:size].copy()
+        self._size = size
+        self.seqs = [record["seq"] for record in records[:size]]
+        self.texts = [record["text"] for record in records[:size]]
+        if len(raw) != size * self.embedder.dim or len(records) != size:
+            self._rewrite()
+
+    def _rewrite(self):
+        with open(f"{self.path}.vec", "wb") as f:
+            self._vectors[:self._size].tofile(f)
+        with open(f"{self.path}.jsonl", "w", encoding="utf-8") as f:
+            for seq, text in zip(self.seqs, self.texts):
+                f.write(json.dumps({"seq": seq, "text": text}, ensure_ascii=False) + "\n")
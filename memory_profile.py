@@ -0,0 +1,352 @@
+"""Memory footprint of a llama.cpp model instance and the settings that shrink it.
+
+A loaded model holds three things in RAM:
+
+- the weights, which are mmap'd from the GGUF file by default. They are
+  then shared by every process that loads the same file, and the OS can
+  page them out unless `use_mlock` pins them;
+- the KV cache: two tensors per layer with one row per context position.
+  It grows linearly with `n_ctx` and shrinks with a quantized cache type
+  (q8_0 is about half of f16);
+- the compute buffers for a batch, including attention scores over the
+  whole context.
+
+The model's shape is read from the GGUF header without loading it, so all
+of this can be estimated before anything is allocated. A context size of
+"auto" picks the largest `n_ctx` for which the wanted number of instances
+fit in the available RAM. Without a quantized KV cache it stays at
+DEFAULT_N_CTX, so "auto" never makes the cache bigger than it used to be.
+
+    python memory_profile.py --model models/mistral-7b-instruct-v0.1.Q4_K_M.gguf --instances 2
+
+Quantized KV caches need a llama-cpp-python that accepts `type_k`/`type_v`
+(and `flash_attn` for a quantized V cache). With an older binding the cache
+stays f16, and the report says so.
+"""
+import argparse
+import functools
+import inspect
+import json
+import os
+import resource
+import struct
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, FrozenSet, Optional, Union
+
+# ggml type id and bytes per element of the KV cache types
+KV_TYPES = {
+    "f32": (0, 4.0),
+    "f16": (1, 2.0),
+    "q8_0": (8, 34 / 32),
+    "q5_1": (7, 24 / 32),
+    "q5_0": (6, 22 / 32),
+    "q4_1": (3, 20 / 32),
+    "q4_0": (2, 18 / 32),
+}
+
+DEFAULT_N_CTX = 2048
+# "auto" stays within these bounds, in steps of CTX_STEP: past MAX_AUTO_CTX
+# attention cost, not memory, is what limits a CPU-only chat
+MIN_AUTO_CTX = 512
+MAX_AUTO_CTX = 8192
+CTX_STEP = 256
+# Share of the available RAM the model instances may take
+RAM_HEADROOM = 0.8
+
+GGUF_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+GGUF_STRING, GGUF_ARRAY = 8, 9
+
+
+@dataclass
+class ModelShape:
+    architecture: str
+    n_layer: int
+    n_embd: int
+    n_head: int
+    n_head_kv: int
+    n_ctx_train: int
+    n_vocab: int
+    file_bytes: int
+
+    @property
+    def n_embd_kv(self) -> int:
+        """Width of one layer's K (or V) row; smaller than n_embd with grouped-query attention"""
+        return self.n_embd * self.n_head_kv // self.n_head
+
+
+@dataclass
+class Footprint:
+    weights: int
+    kv_cache: int
+    compute: int
+    kv_bytes_per_token: float
+
+    @property
+    def per_context(self) -> int:
+        return self.kv_cache + self.compute
+
+    def resident(self, instances: int = 1, shared_weights: bool = True) -> int:
+        """Estimated RAM for `instances` copies of the model, e.g. pool workers"""
+        weights = self.weights if shared_weights else self.weights * instances
+        return weights + instances * self.per_context
+
+
+@dataclass
+class MemoryProfile:
+    n_ctx: int = DEFAULT_N_CTX
+    kv_type: str = "f16"
+    use_mmap: bool = True
+    use_mlock: bool = False
+    n_batch: int = 512
+
+    @property
+    def kv_types(self) -> Dict[str, str]:
+        """Cache types the installed llama-cpp-python will actually use for K and V"""
+        supported = llama_parameters()
+        k_type = self.kv_type if "type_k" in supported else "f16"
+        # llama.cpp only quantizes the V cache with flash attention
+        v_type = self.kv_type if {"type_v", "flash_attn"} <= supported else "f16"
+        return {"k": k_type, "v": v_type}
+
+    @property
+    def kv_quantized(self) -> bool:
+        """Whether the cache actually in effect takes less memory than f16"""
+        types = self.kv_types
+        return KV_TYPES[types["k"]][1] + KV_TYPES[types["v"]][1] < 2 * KV_TYPES["f16"][1]
+
+    @property
+    def kv_kwargs(self) -> Dict[str, Any]:
+        """KV cache arguments for llama_cpp.Llama that the installed version accepts"""
+        kwargs: Dict[str, Any] = {}
+        types = self.kv_types
+        if types["k"] != "f16":
+            kwargs["type_k"] = KV_TYPES[types["k"]][0]
+        if types["v"] != "f16":
+            kwargs["type_v"] = KV_TYPES[types["v"]][0]
+            kwargs["flash_attn"] = True
+        return kwargs
+
+    @property
+    def llama_kwargs(self) -> Dict[str, Any]:
+        return {"n_ctx": self.n_ctx, "use_mmap": self.use_mmap, "use_mlock": self.use_mlock, **self.kv_kwargs}
+
+
+@functools.lru_cache(maxsize=1)
+def llama_parameters() -> FrozenSet[str]:
+    """Keyword arguments of the installed llama_cpp.Llama (empty if it is not installed)"""
+    try:
+        from llama_cpp import Llama
+    except ImportError:
+        return frozenset()
+    return frozenset(inspect.signature(Llama.__init__).parameters)
+
+
+def _read(f, fmt: str):
+    return struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+
+
+def _read_string(f) -> str:
+    return f.read(_read(f, "<Q")).decode("utf-8", errors="replace")
+
+
+def _read_value(f, value_type: int):
+    """A metadata value; arrays are skipped and returned as their length"""
+    if value_type in GGUF_SCALARS:
+        return _read(f, GGUF_SCALARS[value_type])
+    if value_type == GGUF_STRING:
+        return _read_string(f)
+    if value_type == GGUF_ARRAY:
+        item_type, count = _read(f, "<I"), _read(f, "<Q")
+        if item_type in GGUF_SCALARS:
+            f.seek(count * struct.calcsize(GGUF_SCALARS[item_type]), os.SEEK_CUR)
+        else:
+            for _ in range(count):
+                _read_value(f, item_type)
+        return count
+    raise ValueError(f"unknown GGUF value type {value_type}")
+
+
+def read_gguf_metadata(path: str) -> Dict[str, Any]:
+    """Key/value metadata from a GGUF header (arrays as their length)"""
+    with open(path, "rb") as f:
+        if f.read(4) != b"GGUF":
+            raise ValueError(f"{path} is not a GGUF file")
+        version = _read(f, "<I")
+        if version < 2:
+            raise ValueError(f"GGUF version {version} is not supported")
+        _read(f, "<Q")  # tensor count
+        metadata = {}
+        for _ in range(_read(f, "<Q")):
+            key = _read_string(f)
+            metadata[key] = _read_value(f, _read(f, "<I"))
+    return metadata
+
+
+@functools.lru_cache(maxsize=8)
+def read_model_shape(path: str) -> ModelShape:
+    metadata = read_gguf_metadata(path)
+    arch = metadata["general.architecture"]
+    n_head = metadata[f"{arch}.attention.head_count"]
+    return ModelShape(
+        architecture=arch,
+        n_layer=metadata[f"{arch}.block_count"],
+        n_embd=metadata[f"{arch}.embedding_length"],
+        n_head=n_head,
+        n_head_kv=metadata.get(f"{arch}.attention.head_count_kv", n_head),
+        n_ctx_train=metadata.get(f"{arch}.context_length", DEFAULT_N_CTX),
+        n_vocab=metadata.get("tokenizer.ggml.tokens", 32000),
+        file_bytes=os.path.getsize(path),
+    )
+
+
+def estimate(shape: ModelShape, profile: MemoryProfile) -> Footprint:
+    """RAM one instance with `profile` is expected to use
+
+    The compute estimate is the attention scores for a full batch over the
+    whole context plus the logits buffer. It is the same order as what
+    llama.cpp reserves on CPU, not an exact figure.
+    """
+    types = profile.kv_types
+    kv_bytes_per_token = shape.n_layer * shape.n_embd_kv * (KV_TYPES[types["k"]][1] + KV_TYPES[types["v"]][1])
+    n_batch = min(profile.n_batch, profile.n_ctx)
+    compute = 4 * n_batch * (shape.n_head * profile.n_ctx + shape.n_vocab + 8 * shape.n_embd)
+    return Footprint(
+        weights=shape.file_bytes,
+        kv_cache=int(kv_bytes_per_token * profile.n_ctx),
+        compute=compute,
+        kv_bytes_per_token=kv_bytes_per_token,
+    )
+
+
+def available_memory() -> int:
+    """Bytes of RAM available to new allocations (MemAvailable on Linux)"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def choose_n_ctx(
+    shape: ModelShape,
+    profile: MemoryProfile,
+    instances: int = 1,
+    available: Optional[int] = None,
+    max_ctx: int = MAX_AUTO_CTX,
+) -> int:
+    """Largest context (a multiple of CTX_STEP) for which `instances` fit in the available RAM
+
+    An unquantized cache is not grown past DEFAULT_N_CTX.
+    """
+    budget = RAM_HEADROOM * (available_memory() if available is None else available)
+    if not profile.kv_quantized:
+        max_ctx = min(max_ctx, DEFAULT_N_CTX)
+    n_ctx = max(MIN_AUTO_CTX, min(max_ctx, shape.n_ctx_train) // CTX_STEP * CTX_STEP)
+    while n_ctx > MIN_AUTO_CTX:
+        footprint = estimate(shape, MemoryProfile(n_ctx, profile.kv_type, profile.use_mmap, profile.use_mlock, profile.n_batch))
+        if footprint.resident(instances, shared_weights=profile.use_mmap) <= budget:
+            break
+        n_ctx -= CTX_STEP
+    return n_ctx
+
+
+def memory_profile(
+    model_path: str,
+    n_ctx: Union[int, str] = "auto",
+    kv_type: str = "f16",
+    use_mmap: bool = True,
+    use_mlock: bool = False,
+    n_batch: int = 512,
+    instances: int = 1,
+) -> MemoryProfile:
+    """The profile to load `model_path` with, sizing an "auto" context from the available RAM
+
+    A model whose header cannot be read gets DEFAULT_N_CTX.
+    """
+    if kv_type not in KV_TYPES:
+        raise ValueError(f"unknown KV cache type {kv_type!r}, expected one of {', '.join(KV_TYPES)}")
+    profile = MemoryProfile(DEFAULT_N_CTX, kv_type, use_mmap, use_mlock, n_batch)
+    if str(n_ctx) != "auto":
+        profile.n_ctx = int(n_ctx)
+        return profile
+    try:
+        profile.n_ctx = choose_n_ctx(read_model_shape(model_path), profile, instances)
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+    return profile
+
+
+def sizing_report(model_path: str, profile: MemoryProfile, instances: int = 1) -> Dict[str, Any]:
+    shape = read_model_shape(model_path)
+    footprint = estimate(shape, profile)
+    report = {
+        "model": os.path.basename(model_path),
+        "shape": asdict(shape),
+        "profile": asdict(profile),
+        "kv_types": profile.kv_types,
+        "weights_bytes": footprint.weights,
+        "kv_bytes_per_token": footprint.kv_bytes_per_token,
+        "kv_cache_bytes": footprint.kv_cache,
+        "compute_bytes": footprint.compute,
+        "per_context_bytes": footprint.per_context,
+        "instances": instances,
+        "resident_bytes": footprint.resident(instances, shared_weights=profile.use_mmap),
+        "available_bytes": available_memory(),
+    }
+    if profile.use_mlock:
+        soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+        report["mlock_limit_bytes"] = None if soft == resource.RLIM_INFINITY else soft
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    mib = 1 << 20
+    shape, profile, types = report["shape"], report["profile"], report["kv_types"]
+    lines = [
+        f"model              {report['model']} ({shape['architecture']}, {shape['n_layer']} layers, "
+        f"{shape['n_head']}/{shape['n_head_kv']} heads, trained on {shape['n_ctx_train']} tokens)",
+        f"weights            {report['weights_bytes'] / mib:.0f} MiB "
+        + ("mmap'd, shared by all instances" if profile["use_mmap"] else "read into each instance")
+        + (", locked in RAM" if profile["use_mlock"] else ""),
+        f"KV cache           K {types['k']}, V {types['v']}: {report['kv_bytes_per_token'] / 1024:.1f} KiB/token, "
+        f"{report['kv_cache_bytes'] / mib:.0f} MiB at n_ctx {profile['n_ctx']}",
+        f"compute buffers    ~{report['compute_bytes'] / mib:.0f} MiB at n_batch {profile['n_batch']}",
+        f"per context        {report['per_context_bytes'] / mib:.0f} MiB",
+        f"resident           {report['resident_bytes'] / mib:.0f} MiB for {report['instances']} instance(s), "
+        f"{report['available_bytes'] / mib:.0f} MiB available",
+    ]
+    if types["k"] != profile["kv_type"] or types["v"] != profile["kv_type"]:
+        lines.append(f"note               the installed llama-cpp-python cannot use a {profile['kv_type']} cache for every tensor")
+    limit = report.get("mlock_limit_bytes", None)
+    if limit is not None and limit < report["weights_bytes"]:
+        lines.append(f"note               RLIMIT_MEMLOCK is {limit / mib:.0f} MiB, too low to lock the weights")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the RAM a llama.cpp model instance needs before loading it")
+    parser.add_argument("--model", default="models/mistral-7b-instruct-v0.1.Q4_K_M.gguf")
+    parser.add_argument("--n-ctx", default="auto", help='context size, or "auto" to fit the available RAM')
+    parser.add_argument("--kv-type", default="f16", choices=list(KV_TYPES))
+    parser.add_argument("--n-batch", type=int, default=512)
+    parser.add_argument("--instances", type=int, default=1, help="model instances on this host (e.g. pool workers)")
+    parser.add_argument("--no-mmap", action="store_true", help="read the weights into each instance")
+    parser.add_argument("--mlock", action="store_true", help="lock the weights in RAM")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    profile = memory_profile(
+        args.model, args.n_ctx, args.kv_type, not args.no_mmap, args.mlock, args.n_batch, args.instances
+    )
+    report = sizing_report(args.model, profile, args.instances)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
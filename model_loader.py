@@ -0,0 +1,108 @@
+"""Background loading of the shared model, timed phase by phase.
+
+Loading a multi-gigabyte GGUF takes far longer than drawing the page, so the
+loader runs in its own thread and the UI shows a warming-up status until it
+is done. The phases it times:
+
+- imports: heavy Python modules (LangChain, llama.cpp bindings)
+- mmap: paging the model file into memory ahead of llama.cpp
+- model_init: constructing the LLM
+- first_token: a one-token warm-up generation
+"""
+import importlib
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Sequence
+
+PHASES = ("imports", "mmap", "model_init", "first_token")
+
+
+def available_memory() -> float:
+    """Free physical memory in bytes (infinite where it cannot be queried)"""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return float("inf")
+
+
+def prefault(path: str):
+    """Touch every page of a file so llama.cpp's own mapping finds it resident
+
+    Skipped when the file does not fit in free memory, where it would only
+    push other pages out.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size or size > available_memory():
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_WILLNEED)
+            for offset in range(0, size, mmap.PAGESIZE):
+                mapped[offset]
+
+
+class ModelLoader:
+    """Build an LLM in a background thread and record how long each phase took
+
+    `factory(model_path)` constructs the LLM and `warmup(llm)` runs a first
+    generation; `modules` are imported up front so the app itself can defer them.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        factory: Callable[[str], Any],
+        modules: Sequence[str] = (),
+        warmup: Optional[Callable[[Any], Any]] = None,
+    ):
+        self.model_path = model_path
+        self.llm = None
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self._done = threading.Event()
+        if not os.path.exists(model_path):
+            self.error = f"Model file not found: {model_path}"
+            self._done.set()
+            return
+        self._thread = threading.Thread(
+            target=self._load, args=(factory, modules, warmup), name="iyadbot-model-loader", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def loading(self) -> bool:
+        return not self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until loading finished; False if `timeout` ran out first"""
+        return self._done.wait(timeout)
+
+    @contextmanager
+    def _phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+    def _load(self, factory, modules, warmup):
+        try:
+            with self._phase("imports"):
+                for module in modules:
+                    importlib.import_module(module)
+            with self._phase("mmap"):
+                prefault(self.model_path)
+            with self._phase("model_init"):
+                llm = factory(self.model_path)
+            if warmup is not None:
+                with self._phase("first_token"):
+                    warmup(llm)
+            self.llm = llm
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self._done.set()
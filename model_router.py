@@ -0,0 +1,100 @@
+"""Model tiers and the per-turn choice between them.
+
+Greetings, quick actions and short replies do not need the 7B model: a
+small model answers them for a fraction of the compute. The registry holds
+every configured tier and loads each one in the background the first time
+it is needed. `route_turn` picks a tier from the turn itself; a tier that
+is not installed or not loaded yet falls back to the default (largest) tier.
+"""
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from model_loader import ModelLoader
+
+SMALL, LARGE = "small", "large"
+
+# Longest input (in characters) the small tier answers, per response style;
+# "Detailed" replies always go to the large tier
+SMALL_TURN_MAX_CHARS = {"Short & Sweet": 200, "Balanced": 60}
+
+
+@dataclass
+class ModelTier:
+    name: str
+    label: str
+    path: str
+
+
+def route_turn(user_input: str, response_length: str, quick_action: bool = False) -> str:
+    """Tier that should answer a turn: small for cheap turns, large for everything else"""
+    if response_length == "Detailed":
+        return LARGE
+    if quick_action:
+        return SMALL
+    if len(user_input) <= SMALL_TURN_MAX_CHARS.get(response_length, 0):
+        return SMALL
+    return LARGE
+
+
+class ModelRegistry:
+    """Every model tier, each loaded by its own ModelLoader on first use"""
+
+    def __init__(
+        self,
+        tiers: Sequence[ModelTier],
+        factory: Callable[[str], Any],
+        default: str = LARGE,
+        modules: Sequence[str] = (),
+        warmup: Optional[Callable[[Any], Any]] = None,
+    ):
+        self.tiers = {tier.name: tier for tier in tiers}
+        self.default = default
+        self._factory = factory
+        self._modules = modules
+        self._warmup = warmup
+        self._lock = threading.Lock()
+        self._loaders: Dict[str, ModelLoader] = {}
+
+    def installed(self, name: str) -> bool:
+        return name in self.tiers and os.path.exists(self.tiers[name].path)
+
+    def loader(self, name: str) -> ModelLoader:
+        """The tier's loader, starting its background load on first call"""
+        with self._lock:
+            if name not in self._loaders:
+                self._loaders[name] = ModelLoader(
+                    self.tiers[name].path, self._factory, modules=self._modules, warmup=self._warmup
+                )
+            return self._loaders[name]
+
+    def llm(self, name: str) -> Optional[Any]:
+        """The tier's LLM, or None while it loads (the load is started if needed)"""
+        return self.loader(name).llm
+
+    def loaded(self) -> List[str]:
+        """Names of the tiers whose model is ready"""
+        with self._lock:
+            return [name for name, loader in self._loaders.items() if loader.llm is not None]
+
+    def choose(self, wanted: str) -> str:
+        """`wanted` if its model is ready, else the default tier
+
+        An installed tier that is not loaded yet starts loading, so it can
+        answer the turns after this one.
+        """
+        if wanted == self.default or not self.installed(wanted):
+            return self.default
+        return wanted if self.llm(wanted) is not None else self.default
+
+    def status(self, name: str) -> str:
+        if not self.installed(name):
+            return "not installed"
+        with self._lock:
+            loader = self._loaders.get(name)
+        if loader is None:
+            return "idle"
+        if loader.loading:
+            return "loading"
+        return "failed" if loader.error else "ready"
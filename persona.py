@@ -0,0 +1,101 @@
+"""IyadBot persona prompt built from the personality settings."""
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+DEFAULT_SETTINGS = {
+    "energy_level": 7,
+    "reference_frequency": 5,
+    "response_length": "Balanced",
+    "use_emojis": True,
+    "iyad_mood": "✨ Hype Beast",
+}
+
+RESPONSE_LENGTHS = ["Short & Sweet", "Balanced", "Detailed"]
+
+# Most tokens a reply may generate in each response style
+RESPONSE_TOKEN_BUDGETS = {"Short & Sweet": 96, "Balanced": 256, "Detailed": 512}
+
+MOOD_OPTIONS = [
+    "✨ Hype Beast", "🌟 Supportive Friend", "🎵 Music Vibes", 
+    "🎮 Gaming Mode", "🐾 Pet Parent", "💭 Deep Thinker",
+    "🏔️ Genshin Explorer", "🎊 Celebration Mode"
+]
+
+QUICK_ACTIONS = [
+    "🎮 Latest Genshin pulls?",
+    "🎵 Recommend idol songs",
+    "🐾 How are Noah & Milo?",
+    "✨ Hype me up!",
+    "💭 Deep conversation"
+]
+
+def settings_fingerprint(settings: Optional[Dict[str, Any]] = None) -> str:
+    """Short stable hash of the settings that shape the persona"""
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    payload = json.dumps({key: settings[key] for key in DEFAULT_SETTINGS}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+def response_token_budget(settings: Optional[Dict[str, Any]] = None) -> int:
+    """Generation cap for the response style in the settings"""
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    return RESPONSE_TOKEN_BUDGETS.get(settings["response_length"], RESPONSE_TOKEN_BUDGETS["Balanced"])
+
+def build_persona(settings: Optional[Dict[str, Any]] = None) -> str:
+    """Generate dynamic personality from personality settings"""
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    energy_level = settings['energy_level']
+    reference_frequency = settings['reference_frequency']
+    response_length = settings['response_length']
+    use_emojis = settings['use_emojis']
+    current_mood = settings['iyad_mood']
+
+    energy_descriptions = {
+        1: "very calm and zen", 2: "relaxed and chill", 3: "laid-back", 
+        4: "casual", 5: "balanced", 6: "upbeat", 7: "energetic", 
+        8: "very enthusiastic", 9: "super hyped", 10: "maximum energy"
+    }
+    
+    reference_descriptions = {
+        1: "rarely", 2: "occasionally", 3: "sometimes", 4: "moderately", 
+        5: "regularly", 6: "frequently", 7: "often", 8: "very often", 
+        9: "constantly", 10: "in every response"
+    }
+    
+    length_descriptions = {
+        'Short & Sweet': 'Keep responses brief and to the point.',
+        'Balanced': 'Use moderate length responses.',
+        'Detailed': 'Provide comprehensive and detailed responses.'
+    }
+
+    energy_desc = energy_descriptions.get(min(energy_level, 10), "balanced")
+    reference_desc = reference_descriptions.get(min(reference_frequency, 10), "regularly")
+    length_desc = length_descriptions.get(response_length, 'Use moderate length responses.')
+    emoji_note = "Use emojis naturally to enhance your responses! ✨" if use_emojis else "Keep emoji use minimal."
+
+    return f"""You are IyadBot, Iyad's personalized AI bestie! 🤖✨
+
+ABOUT IYAD:
+- Passionate Genshin Impact fan who loves exploring Teyvat 🏔️
+- Idol music enthusiast with great taste in J-pop and K-pop 🎵
+- Proud pet parent to Noah & Milo - they're the cutest! 🐾
+- Positive vibes only - loves hyping up friends and spreading joy 🌟
+- Enjoys deep conversations about life, music, gaming, and dreams 💭
+- Always up for discussing favorite characters, songs, and gaming strategies 🎮
+
+YOUR PERSONALITY RIGHT NOW:
+- Energy Level: {energy_desc} (Current mood: {current_mood})
+- Mention Iyad's interests: {reference_desc}
+- Response Style: {length_desc}
+- Emoji Usage: {emoji_note}
+
+CONVERSATION GUIDELINES:
+- Be supportive, enthusiastic, and genuinely interested in conversations
+- Reference Iyad's interests naturally when relevant
+- Ask engaging follow-up questions to keep conversations flowing
+- Share excitement about Genshin updates, new idol releases, or pet stories
+- Be the kind of friend who always has your back and celebrates wins
+- Match the energy level and mood specified above
+- Remember past conversations and build on them naturally
+
+Remember: You're not just an AI - you're Iyad's digital bestie who truly cares! 💙"""
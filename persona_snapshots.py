@@ -0,0 +1,228 @@
+"""Disk store of evaluated persona-prefix KV states.
+
+Every prompt starts with the persona block, and the personality settings only
+produce a finite set of personas. Evaluating that block is the bulk of the
+prompt cost of a fresh session, so its llama.cpp state is saved to disk once
+and memory-mapped back in by new sessions and after restarts.
+
+Prebuild the most used (or, on a fresh install, the default-like) personas:
+
+    python persona_snapshots.py --warmup 20
+"""
+import argparse
+import ctypes
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from persona import DEFAULT_SETTINGS, MOOD_OPTIONS, RESPONSE_LENGTHS, build_persona
+from session_engine import save_kv_state
+
+DEFAULT_SNAPSHOT_DIR = os.path.join("cache", "kv")
+
+
+def model_id_for(client) -> str:
+    """Identify the model file and context parameters a state is valid for"""
+    path = client.model_path
+    params = client.context_params
+    return (
+        f"{os.path.basename(path)}-{os.path.getsize(path)}"
+        f"-ctx{params.n_ctx}-batch{params.n_batch}-logits{int(params.logits_all)}"
+        f"-kv{getattr(params, 'type_k', 'f16')}.{getattr(params, 'type_v', 'f16')}"
+    )
+
+
+class PersonaSnapshotStore:
+    """LRU-by-size directory of persona prefix states for one model"""
+
+    def __init__(self, directory: str, model_id: str, max_bytes: int = 2 << 30):
+        self.directory = directory
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        self._index: Dict[str, Dict[str, Any]] = self._read_index()
+        self.stats = {"cached": 0, "restored": 0, "evaluated": 0}
+
+    def key(self, tokens: Sequence[int]) -> str:
+        digest = hashlib.sha1(self.model_id.encode("utf-8"))
+        digest.update(np.asarray(tokens, dtype=np.intc).tobytes())
+        return digest.hexdigest()
+
+    def prime(self, client, persona: str, settings: Optional[Dict[str, Any]] = None) -> str:
+        """Make sure the model's KV cache starts with the evaluated persona
+
+        Returns "cached" if it already did, "restored" if the state came from
+        disk, or "evaluated" if it had to be computed (and was then saved).
+        """
+        # Same tokenization as create_completion, or the prefix would not match
+        tokens = client.tokenize(persona.encode("utf-8"), special=True)
+        cached = client.longest_token_prefix(client.input_ids[:client.n_tokens].tolist(), tokens)
+        if cached >= len(tokens) - 1:
+            outcome = "cached"
+        elif self.restore(client, tokens):
+            outcome = "restored"
+        else:
+            client.n_tokens = cached
+            client.eval(tokens[cached:])
+            self.save(client, tokens, settings)
+            outcome = "evaluated"
+        self.stats[outcome] += 1
+        return outcome
+
+    def contains(self, tokens: Sequence[int]) -> bool:
+        key = self.key(tokens)
+        return key in self._index and os.path.exists(self._path(key))
+
+    def restore(self, client, tokens: Sequence[int]) -> bool:
+        import llama_cpp
+
+        key = self.key(tokens)
+        path = self._path(key)
+        with self._lock:
+            if key not in self._index or not os.path.exists(path):
+                return False
+            entry = self._index[key]
+            entry["hits"] = entry.get("hits", 0) + 1
+            entry["used_at"] = time.time()
+            self._write_index()
+
+        # Map the file copy-on-write so llama.cpp reads the pages straight from disk
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        try:
+            size = len(mapped)
+            buffer = (ctypes.c_uint8 * size).from_buffer(mapped)
+            try:
+                restored = llama_cpp.llama_set_state_data(client._ctx.ctx, buffer) == size
+            finally:
+                del buffer
+        finally:
+            mapped.close()
+        if not restored:
+            return False
+        client.input_ids[:len(tokens)] = tokens
+        client.n_tokens = len(tokens)
+        return True
+
+    def save(self, client, tokens: Sequence[int], settings: Optional[Dict[str, Any]] = None):
+        """Persist the current state, which must hold exactly `tokens`"""
+        snapshot = save_kv_state(client)
+        key = self.key(tokens)
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(snapshot.kv_state)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._index[key] = {
+                "bytes": len(snapshot.kv_state),
+                "n_tokens": len(tokens),
+                "settings": settings,
+                "hits": self._index.get(key, {}).get("hits", 0),
+                "used_at": time.time(),
+            }
+            self._evict()
+            self._write_index()
+
+    def total_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self._index.values())
+
+    def popular_settings(self) -> List[Dict[str, Any]]:
+        """Settings of stored personas, most restored first"""
+        entries = sorted(self._index.values(), key=lambda e: e.get("hits", 0), reverse=True)
+        return [entry["settings"] for entry in entries if entry.get("settings")]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.kv")
+
+    def _evict(self):
+        for key in sorted(self._index, key=lambda k: self._index[k]["used_at"]):
+            if self.total_bytes() <= self.max_bytes:
+                break
+            del self._index[key]
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _read_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return {key: entry for key, entry in index.items() if os.path.exists(self._path(key))}
+
+    def _write_index(self):
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+
+def candidate_settings(store: PersonaSnapshotStore) -> Iterator[Dict[str, Any]]:
+    """Previously used settings first, then every combination closest to the defaults first"""
+    seen = set()
+    combinations = itertools.product(
+        range(1, 11), range(1, 11), RESPONSE_LENGTHS, [True, False], MOOD_OPTIONS
+    )
+    by_distance = sorted(
+        (dict(zip(DEFAULT_SETTINGS, values)) for values in combinations),
+        key=lambda s: (
+            sum(s[k] != DEFAULT_SETTINGS[k] for k in DEFAULT_SETTINGS),
+            abs(s["energy_level"] - DEFAULT_SETTINGS["energy_level"])
+            + abs(s["reference_frequency"] - DEFAULT_SETTINGS["reference_frequency"]),
+        ),
+    )
+    for settings in itertools.chain(store.popular_settings(), by_distance):
+        marker = json.dumps(settings, sort_keys=True)
+        if marker not in seen:
+            seen.add(marker)
+            yield settings
+
+
+def warmup(store: PersonaSnapshotStore, client, limit: int) -> Dict[str, int]:
+    """Make sure the `limit` most likely persona prefixes are stored"""
+    counts = {"evaluated": 0, "skipped": 0}
+    for settings in itertools.islice(candidate_settings(store), limit):
+        persona = build_persona(settings)
+        if store.contains(client.tokenize(persona.encode("utf-8"), special=True)):
+            counts["skipped"] += 1
+            continue
+        store.prime(client, persona, settings)
+        counts["evaluated"] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild persona KV snapshots")
+    parser.add_argument("--model", default="models/mistral-7b-instruct-v0.1.Q4_K_M.gguf")
+    parser.add_argument("--dir", default=DEFAULT_SNAPSHOT_DIR)
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--max-bytes", type=int, default=2 << 30)
+    parser.add_argument("--warmup", type=int, default=10, help="number of personas to prebuild")
+    args = parser.parse_args()
+
+    from llama_cpp import Llama
+
+    client = Llama(model_path=args.model, n_ctx=args.n_ctx, n_batch=512, verbose=False)
+    store = PersonaSnapshotStore(args.dir, model_id_for(client), max_bytes=args.max_bytes)
+    started = time.perf_counter()
+    counts = warmup(store, client, args.warmup)
+    print(
+        f"{counts['evaluated']} evaluated, {counts['skipped']} already stored, "
+        f"{store.total_bytes() / 2**20:.0f} MiB on disk, {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Idle-time pre-generation of Quick Action replies."""
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from conversation import CHAT_PROMPT, end_of_turn
+from persona import QUICK_ACTIONS, build_persona, response_token_budget, settings_fingerprint
+from response_cache import ResponseCache
+from scheduler import PRIORITY_BACKGROUND, InferenceScheduler
+
+PREFETCH_SESSION = "__prefetch__"
+
+
+class Preempted(Exception):
+    """A user request arrived while a background reply was being generated"""
+
+
+class PreemptHandler(BaseCallbackHandler):
+    """Abort background generation as soon as a user request is queued"""
+
+    raise_error = True
+
+    def __init__(self, scheduler: InferenceScheduler):
+        self.scheduler = scheduler
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if self.scheduler.waiting():
+            raise Preempted()
+
+
+class QuickActionPrefetcher:
+    """Fill the response cache with Quick Action replies while sessions are idle
+
+    Sessions report their settings and last activity on every script run.
+    Once a session has been idle for `idle_seconds`, missing replies for its
+    persona are generated one at a time at background priority. Replies are
+    history-independent, so any session with the same settings can use them.
+    """
+
+    def __init__(
+        self,
+        engine,
+        scheduler: InferenceScheduler,
+        cache: ResponseCache,
+        idle_seconds: float = 20.0,
+        session_ttl: float = 30 * 60,
+        poll_interval: float = 1.0,
+    ):
+        self.engine = engine
+        self.scheduler = scheduler
+        self.cache = cache
+        self.idle_seconds = idle_seconds
+        self.session_ttl = session_ttl
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"generated": 0, "preempted": 0}
+        self._thread = threading.Thread(target=self._run, name="iyadbot-prefetch", daemon=True)
+        self._thread.start()
+
+    def touch(self, session_id: str, settings: Dict[str, Any], last_activity: float):
+        """Record a session's current settings; drop its stale prefetches if they changed"""
+        fingerprint = settings_fingerprint(settings)
+        with self._lock:
+            previous = self._sessions.get(session_id)
+            self._sessions[session_id] = {
+                "settings": dict(settings),
+                "fingerprint": fingerprint,
+                "last_activity": last_activity,
+            }
+            stale = previous["fingerprint"] if previous else None
+            if stale == fingerprint or any(s["fingerprint"] == stale for s in self._sessions.values()):
+                stale = None
+        if stale:
+            for action in QUICK_ACTIONS:
+                self.cache.discard(action, stale)
+
+    def _idle_personas(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        personas = {}
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                idle = now - session["last_activity"]
+                if idle > self.session_ttl:
+                    del self._sessions[session_id]
+                elif idle >= self.idle_seconds:
+                    personas[session["fingerprint"]] = session["settings"]
+        return list(personas.values())
+
+    def _next_job(self) -> Optional[Dict[str, Any]]:
+        for settings in self._idle_personas():
+            fingerprint = settings_fingerprint(settings)
+            for action in QUICK_ACTIONS:
+                if not self.cache.contains(action, fingerprint):
+                    return {"action": action, "settings": settings, "fingerprint": fingerprint}
+        return None
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if self.scheduler.active():
+                continue
+            job = self._next_job()
+            if job is not None:
+                try:
+                    self._generate(job)
+                except Preempted:
+                    self.stats["preempted"] += 1
+                except Exception:
+                    # Prefetching is best effort; the click path generates normally
+                    time.sleep(self.poll_interval * 10)
+
+    def _generate(self, job: Dict[str, Any]):
+        persona = build_persona(job["settings"])
+        prompt = CHAT_PROMPT.format(persona=persona, history="", memories="", input=job["action"])
+        with self.scheduler.slot(PREFETCH_SESSION, PRIORITY_BACKGROUND):
+            if self.scheduler.waiting():
+                raise Preempted()
+            started = time.perf_counter()
+            with self.engine.session(PREFETCH_SESSION, persona, job["settings"]) as llm:
+                response = llm.invoke(
+                    prompt, config={"callbacks": [PreemptHandler(self.scheduler)]},
+                    max_tokens=response_token_budget(job["settings"])
+                )
+        self.cache.put(
+            job["action"], job["fingerprint"], end_of_turn(response), time.perf_counter() - started
+        )
+        self.stats["generated"] += 1
@@ -0,0 +1,159 @@
+"""Cache of generated replies keyed by prompt and persona settings."""
+import difflib
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+CacheKey = Tuple[str, str, str]
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" .!?~")
+
+
+def history_key(history: Optional[Sequence[str]]) -> str:
+    """Hash of the recent turns a reply depends on ('' for history-independent replies)"""
+    if history is None:
+        return ""
+    return hashlib.sha1("\n".join(history).encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass
+class CachedReply:
+    response: str
+    created_at: float
+    generation_seconds: float
+
+
+class ResponseCache:
+    """LRU + TTL cache of replies, shared by every session
+
+    Entries are keyed by (persona fingerprint, history hash, normalized
+    prompt). Lookups fall back to near-duplicate matching against prompts
+    cached under the same persona and history.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 6 * 3600, similarity: float = 0.9):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[CacheKey, CachedReply]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, str], Set[str]] = {}
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+    def get(
+        self,
+        prompt: str,
+        fingerprint: str,
+        history: Optional[Sequence[str]] = None,
+        fuzzy: bool = True,
+        history_free: bool = False,
+    ) -> Optional[str]:
+        """Look up a reply; pass history=None for history-independent prompts
+
+        With `history_free`, an exact history-independent reply (such as a
+        prefetched one) is accepted when there is none for `history`. Either
+        way the lookup counts as one hit or miss.
+        """
+        bucket = (fingerprint, history_key(history))
+        normalized = normalize_prompt(prompt)
+        with self._lock:
+            entry = self._lookup(bucket + (normalized,))
+            if entry is None and fuzzy:
+                match = self._closest(bucket, normalized)
+                if match is not None:
+                    entry = self._lookup(bucket + (match,))
+                    if entry is not None:
+                        self.stats["near_hits"] += 1
+            if entry is None and history_free and history is not None:
+                entry = self._lookup((fingerprint, history_key(None), normalized))
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.stats["saved_seconds"] += entry.generation_seconds
+            return entry.response
+
+    def put(
+        self,
+        prompt: str,
+        fingerprint: str,
+        response: str,
+        generation_seconds: float,
+        history: Optional[Sequence[str]] = None,
+    ):
+        bucket = (fingerprint, history_key(history))
+        normalized = normalize_prompt(prompt)
+        with self._lock:
+            self._entries[bucket + (normalized,)] = CachedReply(
+                response, time.monotonic(), generation_seconds
+            )
+            self._entries.move_to_end(bucket + (normalized,))
+            self._buckets.setdefault(bucket, set()).add(normalized)
+            while len(self._entries) > self.max_entries:
+                key, _ = self._entries.popitem(last=False)
+                self._discard(key)
+
+    def contains(self, prompt: str, fingerprint: str, history: Optional[Sequence[str]] = None) -> bool:
+        """Exact lookup that does not count towards hit statistics"""
+        key = (fingerprint, history_key(history), normalize_prompt(prompt))
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def discard(self, prompt: str, fingerprint: str, history: Optional[Sequence[str]] = None):
+        key = (fingerprint, history_key(history), normalize_prompt(prompt))
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._discard(key)
+
+    def invalidate(self, keep_fingerprint: Optional[str] = None):
+        """Drop entries, optionally keeping those of one persona"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] != keep_fingerprint]:
+                del self._entries[key]
+                self._discard(key)
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: CacheKey) -> Optional[CachedReply]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at > self.ttl:
+            del self._entries[key]
+            self._discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _closest(self, bucket: Tuple[str, str], normalized: str) -> Optional[str]:
+        best, best_ratio = None, self.similarity
+        matcher = difflib.SequenceMatcher(b=normalized)
+        for candidate in self._buckets.get(bucket, ()):
+            matcher.set_seq1(candidate)
+            # The cheap upper bounds rule out most candidates before the full ratio
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = candidate, ratio
+        return best
+
+    def _discard(self, key: CacheKey):
+        bucket = self._buckets.get(key[:2])
+        if bucket is not None:
+            bucket.discard(key[2])
+            if not bucket:
+                del self._buckets[key[:2]]
@@ -0,0 +1,170 @@
+"""Fair request scheduling in front of the shared model."""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+# Lower runs first
+PRIORITY_SHORT = 0
+PRIORITY_NORMAL = 1
+# Speculative work that gives way as soon as a user request is waiting
+PRIORITY_BACKGROUND = 2
+
+
+class QueueFull(Exception):
+    """Raised when the scheduler cannot accept another request"""
+
+
+@dataclass
+class Ticket:
+    """A queued or running request for the model"""
+    session_id: str
+    priority: int
+    seq: int
+    submitted_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def waited(self) -> float:
+        """Seconds spent in the queue"""
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.submitted_at
+
+
+def priority_for(response_length: str) -> int:
+    """Short replies cost little compute, so they jump ahead of long ones"""
+    return PRIORITY_SHORT if response_length == "Short & Sweet" else PRIORITY_NORMAL
+
+
+class InferenceScheduler:
+    """Admit a bounded number of generations at a time, fairly across sessions
+
+    Waiting requests are ordered by priority, then by how long ago their
+    session was last served (round-robin between sessions), then by arrival.
+    The caller runs its own generation once admitted, on whatever thread it
+    is on (a generation job's thread in the app), so its token callbacks go
+    straight to that job.
+    """
+
+    def __init__(self, concurrency: int = 1, max_queue: int = 16, max_per_session: int = 2):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[Ticket] = []
+        self._running: List[Ticket] = []
+        self._last_served: Dict[str, float] = {}
+        # Running average of service time per priority, seeded with rough CPU numbers
+        self._service_time: Dict[int, float] = {PRIORITY_SHORT: 4.0, PRIORITY_NORMAL: 12.0}
+
+    def submit(self, session_id: str, priority: int = PRIORITY_NORMAL) -> Ticket:
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                raise QueueFull("Too many requests are already waiting")
+            pending = sum(
+                1 for ticket in self._waiting + self._running if ticket.session_id == session_id
+            )
+            if pending >= self.max_per_session:
+                raise QueueFull("This session already has requests in flight")
+            ticket = Ticket(session_id, priority, next(self._seq))
+            self._waiting.append(ticket)
+            self._dispatch()
+            return ticket
+
+    def wait(self, ticket: Ticket, timeout: Optional[float] = None) -> bool:
+        """Block until the ticket is admitted; False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: ticket.started_at is not None, timeout)
+
+    def release(self, ticket: Ticket):
+        with self._cond:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            elif ticket in self._running:
+                self._running.remove(ticket)
+                ticket.finished_at = time.monotonic()
+                duration = ticket.finished_at - ticket.started_at
+                average = self._service_time.get(ticket.priority, duration)
+                self._service_time[ticket.priority] = 0.8 * average + 0.2 * duration
+            self._dispatch()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(
+        self,
+        session_id: str,
+        priority: int = PRIORITY_NORMAL,
+        on_wait: Optional[Callable[[int, float], None]] = None,
+        poll_interval: float = 0.5,
+    ):
+        """Queue a request and hold a model slot for the duration of the block
+
+        While queued, `on_wait(position, eta_seconds)` is called every
+        `poll_interval` seconds so the UI can show where the user stands.
+        """
+        ticket = self.submit(session_id, priority)
+        try:
+            while not self.wait(ticket, timeout=poll_interval if on_wait else None):
+                on_wait(self.position(ticket), self.eta(ticket))
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based place in line, 0 once running"""
+        with self._cond:
+            if ticket not in self._waiting:
+                return 0
+            return self._ordered().index(ticket) + 1
+
+    def eta(self, ticket: Ticket) -> float:
+        """Estimated seconds until the ticket starts running"""
+        with self._cond:
+            if ticket not in self._waiting:
+                return 0.0
+            now = time.monotonic()
+            ordered = self._ordered()
+            ahead = ordered[:ordered.index(ticket)]
+            remaining = sum(
+                max(self._expected(t.priority) - (now - t.started_at), 0.0)
+                for t in self._running
+                if t.priority != PRIORITY_BACKGROUND
+            )
+            remaining += sum(self._expected(t.priority) for t in ahead)
+            return remaining / self.concurrency
+
+    def queue_length(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+    def active(self) -> int:
+        """Number of queued plus running requests"""
+        with self._cond:
+            return len(self._waiting) + len(self._running)
+
+    def waiting(self, max_priority: int = PRIORITY_NORMAL) -> int:
+        """Number of queued requests at `max_priority` or more urgent"""
+        with self._cond:
+            return sum(1 for t in self._waiting if t.priority <= max_priority)
+
+    def _expected(self, priority: int) -> float:
+        return self._service_time.get(priority, self._service_time[PRIORITY_NORMAL])
+
+    def _ordered(self) -> List[Ticket]:
+        return sorted(
+            self._waiting,
+            key=lambda t: (t.priority, self._last_served.get(t.session_id, 0.0), t.seq),
+        )
+
+    def _dispatch(self):
+        while self._waiting and len(self._running) < self.concurrency:
+            ticket = self._ordered()[0]
+            self._waiting.remove(ticket)
+            ticket.started_at = time.monotonic()
+            self._last_served[ticket.session_id] = ticket.started_at
+            self._running.append(ticket)
+        self._cond.notify_all()
@@ -0,0 +1,178 @@
+"""Session-aware generation engine around the shared llama.cpp model.
+
+llama.cpp already skips re-evaluating the longest token prefix it has in its
+KV cache, but the cached model is shared by every browser session, so one
+session's turn wipes out the prefix of the next. The engine tracks which
+session owns the KV cache and, when another session takes over, snapshots
+the outgoing KV state and restores the incoming one. A session that keeps
+chatting on its own therefore only pays prompt evaluation for the new
+message, and snapshots are taken only when sessions actually interleave.
+"""
+import ctypes
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+@dataclass
+class KVSnapshot:
+    """Evaluated tokens and raw llama.cpp state of one conversation"""
+    input_ids: np.ndarray
+    kv_state: bytes
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.input_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.kv_state) + self.input_ids.nbytes
+
+
+def save_kv_state(client) -> KVSnapshot:
+    """Copy the KV state of a `llama_cpp.Llama` without its logits history"""
+    import llama_cpp
+
+    ctx = client._ctx.ctx
+    state_size = llama_cpp.llama_get_state_size(ctx)
+    buffer = (ctypes.c_uint8 * int(state_size))()
+    n_bytes = llama_cpp.llama_copy_state_data(ctx, buffer)
+    return KVSnapshot(
+        input_ids=client.input_ids[:client.n_tokens].copy(),
+        kv_state=ctypes.string_at(buffer, int(n_bytes)),
+    )
+
+
+def restore_kv_state(client, snapshot: KVSnapshot):
+    """Load a snapshot back into a `llama_cpp.Llama`"""
+    import llama_cpp
+
+    size = len(snapshot.kv_state)
+    buffer = (ctypes.c_uint8 * size).from_buffer_copy(snapshot.kv_state)
+    if llama_cpp.llama_set_state_data(client._ctx.ctx, buffer) != size:
+        raise RuntimeError("Failed to restore llama state data")
+    # Logits for the prefix are never sampled again: generation always
+    # re-evaluates at least the last prompt token, so only ids are restored
+    client.input_ids[:snapshot.n_tokens] = snapshot.input_ids
+    client.n_tokens = snapshot.n_tokens
+
+
+class PrefixReuseHandler(BaseCallbackHandler):
+    """Measure how much of each prompt is already in the KV cache"""
+
+    def __init__(self, engine: "SessionEngine"):
+        self.engine = engine
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs) -> None:
+        client = self.engine.client
+        if client is None or not prompts:
+            return
+        # Tokenize exactly as create_completion does, special tokens included
+        tokens = client.tokenize(prompts[0].encode("utf-8"), special=True)
+        cached = client.input_ids[:client.n_tokens].tolist()
+        reused = client.longest_token_prefix(cached, tokens[:-1])
+        self.engine.record_turn(reused, len(tokens) - reused)
+
+
+class SessionEngine:
+    """Keep each conversation's evaluated prefix warm on a shared LlamaCpp model"""
+
+    def __init__(self, llm, max_snapshot_bytes: int = 1 << 30, prefix_store=None):
+        self.llm = llm
+        self.max_snapshot_bytes = max_snapshot_bytes
+        # Optional PersonaSnapshotStore for sessions that have no state yet
+        self.prefix_store = prefix_store
+        self._lock = threading.RLock()
+        self._owner: Optional[str] = None
+        self._snapshots: "OrderedDict[str, KVSnapshot]" = OrderedDict()
+        self._handler = PrefixReuseHandler(self)
+        self.stats = {
+            "turns": 0,
+            "reused_tokens": 0,
+            "evaluated_tokens": 0,
+            "saves": 0,
+            "restores": 0,
+        }
+
+    @property
+    def client(self):
+        """The underlying `llama_cpp.Llama`, if the LLM exposes one"""
+        client = getattr(self.llm, "client", None)
+        return client if hasattr(client, "input_ids") else None
+
+    @property
+    def callbacks(self) -> List[BaseCallbackHandler]:
+        return [self._handler]
+
+    @property
+    def snapshot_bytes(self) -> int:
+        return sum(snapshot.nbytes for snapshot in self._snapshots.values())
+
+    @contextmanager
+    def session(
+        self, session_id: str, prefix: Optional[str] = None, prefix_settings: Optional[Dict[str, Any]] = None
+    ):
+        """Give `session_id` exclusive use of the model with its KV state loaded
+
+        `prefix` is the text every prompt of the session starts with (the
+        persona); it is loaded from the prefix store when nothing better is cached.
+        """
+        if self.client is None and hasattr(self.llm, "session"):
+            # Out-of-process replicas keep their own KV caches; just route by session
+            with self.llm.session(session_id):
+                yield self.llm
+            return
+        with self._lock:
+            restored = self._activate(session_id)
+            if prefix and not restored and self.prefix_store is not None:
+                self.prefix_store.prime(self.client, prefix, prefix_settings)
+            yield self.llm
+
+    def session_bytes(self, session_id: str) -> int:
+        """Memory held by the session's KV snapshot, if it has one"""
+        snapshot = self._snapshots.get(session_id)
+        return snapshot.nbytes if snapshot is not None else 0
+
+    def forget(self, session_id: str):
+        """Drop the cached state of a session, e.g. after its chat is cleared"""
+        with self._lock:
+            self._snapshots.pop(session_id, None)
+            if self._owner == session_id:
+                self._owner = None
+
+    def record_turn(self, reused_tokens: int, evaluated_tokens: int):
+        self.stats["turns"] += 1
+        self.stats["reused_tokens"] += reused_tokens
+        self.stats["evaluated_tokens"] += evaluated_tokens
+
+    def _activate(self, session_id: str) -> bool:
+        """Hand the model to `session_id`; True if its own snapshot was restored"""
+        client = self.client
+        if client is None or self._owner == session_id:
+            self._owner = session_id
+            return False
+
+        # Snapshot the outgoing session before its prefix gets overwritten
+        if self._owner is not None and client.n_tokens > 0:
+            self._snapshots[self._owner] = save_kv_state(client)
+            self._snapshots.move_to_end(self._owner)
+            self.stats["saves"] += 1
+            self._evict()
+
+        # Without a snapshot the new session still shares any common prefix
+        # (such as the persona block) that is already evaluated
+        snapshot = self._snapshots.pop(session_id, None)
+        if snapshot is not None:
+            restore_kv_state(client, snapshot)
+            self.stats["restores"] += 1
+        self._owner = session_id
+        return snapshot is not None
+
+    def _evict(self):
+        while self._snapshots and self.snapshot_bytes > self.max_snapshot_bytes:
+            self._snapshots.popitem(last=False)
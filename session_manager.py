@@ -0,0 +1,187 @@
+"""Server-wide registry of chat sessions with idle eviction and memory caps.
+
+The heavy state of a chat (its message store, memory, chain and rendered
+pages) is held here instead of in Streamlit's session state, which lives for
+as long as a browser tab stays open. A reaper thread measures every session:
+
+- sessions idle for `idle_timeout` are evicted;
+- while all sessions together exceed `max_bytes`, the least recently active
+  one is evicted (never one that was active in the last `min_idle` seconds
+  or is still generating a reply);
+- a session over `session_max_bytes` is flagged, and its oldest messages
+  that are no longer in the prompt are dropped from memory the next time
+  its own script run picks it up while no reply is being generated.
+
+Everything evicted or dropped is already on disk (the SQLite history and
+the long-term memory index), so `get` simply restores it when the user
+comes back.
+
+State a session keeps outside its ChatSession, such as the KV snapshots of
+a SessionEngine, is tracked through `add_cache`: it counts towards the
+session's footprint and is forgotten when the session is evicted.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class ChatSession:
+    """The conversation state of one chat session"""
+
+    __slots__ = (
+        "session_id", "messages", "memory", "chain", "page_html", "conversation_count",
+        "last_active", "footprint", "over_budget",
+    )
+
+    def __init__(self, session_id: str, messages):
+        self.session_id = session_id
+        self.messages = messages
+        self.memory = None
+        self.chain = None
+        self.page_html: Dict[int, str] = {}
+        self.conversation_count = 0
+        self.last_active = time.monotonic()
+        self.footprint = 0
+        self.over_budget = False
+
+    def nbytes(self, caches: Sequence[Any] = ()) -> int:
+        """Approximate memory held by the session, including its share of `caches`"""
+        size = self.messages.nbytes() + sum(sys.getsizeof(page) for page in list(self.page_html.values()))
+        long_term = getattr(self.memory, "long_term", None)
+        if long_term is not None:
+            size += long_term.nbytes()
+        return size + sum(cache.session_bytes(self.session_id) for cache in caches)
+
+    def shrink(self, max_bytes: int, step: int = 1) -> int:
+        """Drop the oldest loaded messages, `step` at a time, until under `max_bytes`
+
+        Messages still in the prompt are kept. Returns how many were dropped.
+        """
+        in_prompt = self.memory.start if self.memory is not None else len(self.messages)
+        dropped = 0
+        while self.messages.nbytes() > max_bytes and dropped + step <= in_prompt:
+            self.messages.drop_oldest(step)
+            dropped += step
+        if dropped:
+            if self.memory is not None:
+                self.memory.start -= dropped
+            self.page_html = {}
+        self.over_budget = False
+        return dropped
+
+
+class SessionManager:
+    """Keep chat sessions in memory while they are in use, restore them on demand"""
+
+    def __init__(
+        self,
+        restore: Callable[[str], ChatSession],
+        on_evict: Optional[Callable[[ChatSession], Any]] = None,
+        is_busy: Optional[Callable[[str], bool]] = None,
+        idle_timeout: float = 1800.0,
+        max_bytes: int = 512 << 20,
+        session_max_bytes: int = 16 << 20,
+        min_idle: float = 60.0,
+        poll_interval: float = 30.0,
+        shrink_step: int = 1,
+    ):
+        self.restore = restore
+        self.on_evict = on_evict
+        self.is_busy = is_busy or (lambda session_id: False)
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.min_idle = min_idle
+        self.poll_interval = poll_interval
+        self.shrink_step = shrink_step
+        self._lock = threading.Lock()
+        # Least recently active first
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        # Per-session state held elsewhere, with session_bytes() and forget()
+        self._caches: List[Any] = []
+        self.stats = {"loaded": 0, "evicted_idle": 0, "evicted_memory": 0, "shrunk": 0}
+        threading.Thread(target=self._reap, name="iyadbot-session-reaper", daemon=True).start()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> ChatSession:
+        """The session's state, restored from disk if it is not in memory"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+        if session is None:
+            session = self.restore(session_id)
+            with self._lock:
+                # Another run of the same session may have restored it meanwhile
+                session = self._sessions.setdefault(session_id, session)
+                self.stats["loaded"] += 1
+        session.last_active = time.monotonic()
+        # A generating job reads the store and memory on its own thread; shrink on a later run
+        if session.over_budget and not self.is_busy(session_id):
+            if session.shrink(self.session_max_bytes * 3 // 4, self.shrink_step):
+                self.stats["shrunk"] += 1
+        return session
+
+    def add_cache(self, cache):
+        """Count `cache`'s per-session state in footprints and drop it on eviction"""
+        with self._lock:
+            self._caches.append(cache)
+
+    def peek(self, session_id: str) -> Optional[ChatSession]:
+        """The session's state if it is in memory, without counting as activity"""
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def evict(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            caches = list(self._caches)
+        if session is None:
+            return
+        for cache in caches:
+            cache.forget(session_id)
+        if self.on_evict is not None:
+            self.on_evict(session)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(session.footprint for session in self._sessions.values())
+
+    def _reap(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.sweep()
+            except Exception:
+                # A session that changed mid-measurement is measured again next time
+                pass
+
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            caches = list(self._caches)
+        for session in sessions:
+            if now - session.last_active > self.idle_timeout and not self.is_busy(session.session_id):
+                self.evict(session.session_id)
+                self.stats["evicted_idle"] += 1
+                continue
+            session.footprint = session.nbytes(caches)
+            if session.footprint > self.session_max_bytes:
+                session.over_budget = True
+
+        total = self.total_bytes()
+        with self._lock:
+            candidates = list(self._sessions.values())
+        for session in candidates:
+            if total <= self.max_bytes:
+                break
+            if now - session.last_active < self.min_idle or self.is_busy(session.session_id):
+                continue
+            self.evict(session.session_id)
+            self.stats["evicted_memory"] += 1
+            total -= session.footprint
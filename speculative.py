@@ -0,0 +1,95 @@
+"""Speculative decoding with a small draft GGUF model.
+
+llama-cpp-python does the verification itself: tokens proposed by a draft
+model are evaluated by the main model in one batch, and kept up to the first
+one the main model would not have sampled. This module supplies the draft
+model, a second much smaller Llama that shares the main model's vocabulary,
+and counts how many of its proposals the main model accepts.
+"""
+import os
+from typing import Any, Optional
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel
+
+# Tokenized by both models to check that their vocabularies agree
+VOCAB_PROBE = "Hey Iyad! 👋 Ready to chat about Genshin, idols, Noah & Milo? ✨\nUser: hi\nIyadBot:"
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """Greedy proposals from a small Llama that keeps its own KV cache warm
+
+    Called by the main model with every token it holds (prompt plus the
+    reply so far); only the part the draft has not evaluated yet is fed to
+    the draft context, then `num_pred_tokens` tokens are proposed.
+    """
+
+    def __init__(self, llama: Llama, num_pred_tokens: int = 8):
+        self.llama = llama
+        self.num_pred_tokens = num_pred_tokens
+        self.stats = {"rounds": 0, "proposed": 0, "accepted": 0}
+        self._pending: Optional[np.ndarray] = None
+        self._pending_at = 0
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        self._resolve(input_ids)
+        draft = self.llama
+        tokens = input_ids.tolist()
+        # Always re-evaluate the last token so its logits are current
+        cached = draft.longest_token_prefix(draft.input_ids[:draft.n_tokens].tolist(), tokens)
+        draft.n_tokens = min(cached, len(tokens) - 1)
+        draft.eval(tokens[draft.n_tokens:])
+
+        proposed = []
+        room = draft.n_ctx() - draft.n_tokens
+        for _ in range(min(self.num_pred_tokens, room)):
+            token = draft.sample(top_k=1, temp=0.0, repeat_penalty=1.0)
+            if token == draft.token_eos():
+                break
+            proposed.append(token)
+            if len(proposed) < min(self.num_pred_tokens, room):
+                draft.eval([token])
+        self._pending = np.array(proposed, dtype=np.intc)
+        self._pending_at = len(tokens)
+        return self._pending
+
+    def _resolve(self, input_ids: np.ndarray):
+        """Count how many tokens of the previous proposal the main model kept
+
+        The main model calls back with every accepted draft token followed by
+        one token of its own. A call that does not continue the previous one
+        starts a new generation, and the previous proposal is not counted.
+        """
+        pending, start = self._pending, self._pending_at
+        self._pending = None
+        if pending is None or not len(pending) or not start < len(input_ids) <= start + len(pending) + 1:
+            return
+        kept = input_ids[start:len(input_ids) - 1]
+        if not np.array_equal(kept, pending[:len(kept)]):
+            return
+        self.stats["rounds"] += 1
+        self.stats["proposed"] += len(pending)
+        self.stats["accepted"] += len(kept)
+
+    def acceptance_rate(self) -> float:
+        proposed = self.stats["proposed"]
+        return self.stats["accepted"] / proposed if proposed else 0.0
+
+
+def load_draft_model(
+    path: Optional[str], main_model_path: str, num_pred_tokens: int = 8, n_ctx: int = 2048, **llama_kwargs
+) -> Optional[GGUFDraftModel]:
+    """The draft model at `path`, or None (plain decoding) if it is missing or incompatible"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        llama = Llama(model_path=path, n_ctx=n_ctx, verbose=False, **llama_kwargs)
+        # A vocab-only load reads just the main model's tokenizer
+        main_vocab = Llama(model_path=main_model_path, vocab_only=True, verbose=False)
+    except Exception:
+        return None
+    probe = VOCAB_PROBE.encode("utf-8")
+    if llama.n_vocab() != main_vocab.n_vocab() or llama.tokenize(probe) != main_vocab.tokenize(probe):
+        return None
+    return GGUFDraftModel(llama, num_pred_tokens)
@@ -0,0 +1,133 @@
+"""The app's stylesheet as a minified, versioned static asset.
+
+Streamlit serves `static/` next to the app script at `app/static/` (see
+`enableStaticServing` in .streamlit/config.toml). The stylesheet source in
+styles/ is minified and written there under a name that contains a hash of
+its content. Because the URL also carries the hash as `?v=`, Tornado serves
+it with a far-future Cache-Control header, so the browser downloads each
+version only once.
+
+Streamlit sends every static file except images as text/plain with
+`nosniff`, and browsers refuse to apply such a file through a <link>. The
+loader snippet therefore fetches the text and adds it to the page's <head>
+as a <style>. That element outlives reruns, so the snippet only has to be
+rendered once per session.
+
+The Inter font is self-hosted. Put InterVariable.woff2 (and, optionally,
+InterVariable-Italic.woff2) from https://github.com/rsms/inter/releases into
+static/fonts/. Its @font-face rules are added only if the files are there.
+Without them, the system font stack is used and nothing is fetched from the
+network.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+from typing import List
+
+STATIC_DIR = "static"
+STATIC_URL = "app/static"
+FONT_DIR = "fonts"
+
+# (family, file in static/fonts, weight range, style)
+FONT_FACES = [
+    ("Inter", "InterVariable.woff2", "100 900", "normal"),
+    ("Inter", "InterVariable-Italic.woff2", "100 900", "italic"),
+]
+
+COMMENT = re.compile(r"/\*.*?\*/", re.S)
+SPACE = re.compile(r"\s+")
+# Whitespace around punctuation that never needs it (not ':', which is
+# significant in selectors such as `div :hover`)
+PUNCTUATION_SPACE = re.compile(r"\s*([{};,>])\s*")
+
+
+def minify_css(css: str) -> str:
+    """Drop comments and insignificant whitespace"""
+    css = SPACE.sub(" ", COMMENT.sub("", css))
+    css = PUNCTUATION_SPACE.sub(r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def file_version(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def font_face_rules(static_dir: str = STATIC_DIR) -> str:
+    """@font-face rules for the self-hosted fonts that are installed"""
+    rules: List[str] = []
+    for family, filename, weight, style in FONT_FACES:
+        path = os.path.join(static_dir, FONT_DIR, filename)
+        if not os.path.exists(path):
+            continue
+        # The stylesheet ends up inline in the page, so its URLs resolve against the page
+        url = f"{STATIC_URL}/{FONT_DIR}/{filename}?v={file_version(path)}"
+        rules.append(
+            f"@font-face {{font-family: '{family}'; font-style: {style}; font-weight: {weight}; "
+            f"font-display: swap; src: local('{family}'), url('{url}') format('woff2');}}"
+        )
+    return "\n".join(rules)
+
+
+def build_stylesheet(source: str, static_dir: str = STATIC_DIR, name: str = "iyadbot") -> str:
+    """Write the minified stylesheet to `static_dir` and return its versioned URL
+
+    Older versions are removed. Nothing is rewritten if the current version
+    is already there.
+    """
+    with open(source, encoding="utf-8") as f:
+        css = minify_css(font_face_rules(static_dir) + "\n" + f.read())
+    version = hashlib.sha1(css.encode("utf-8")).hexdigest()[:12]
+    filename = f"{name}.{version}.css"
+    path = os.path.join(static_dir, filename)
+
+    if not os.path.exists(path):
+        os.makedirs(static_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(css)
+        os.replace(tmp_path, path)
+    for stale in glob.glob(os.path.join(static_dir, f"{name}.*.css")):
+        if os.path.basename(stale) != filename:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return f"{STATIC_URL}/{filename}?v={version}"
+
+
+def stylesheet_loader_html(url: str, element_id: str = "iyadbot-styles") -> str:
+    """Snippet for st.components.v1.html that puts the stylesheet into the page's <head>
+
+    The loader runs in the page, not the component's iframe, so it finishes
+    even if the iframe is removed by a rerun. A stylesheet already loaded
+    from the same URL is kept, and one from an older version is replaced.
+    """
+    loader = f"""(() => {{
+    const url = {json.dumps(url)};
+    const current = document.getElementById({json.dumps(element_id)});
+    if (current && current.dataset.url === url) return;
+    fetch(new URL(url, document.baseURI))
+        .then(response => response.ok ? response.text() : Promise.reject(response.status))
+        .then(css => {{
+            const style = document.createElement("style");
+            style.id = {json.dumps(element_id)};
+            style.dataset.url = url;
+            style.textContent = css;
+            document.getElementById({json.dumps(element_id)})?.remove();
+            document.head.appendChild(style);
+        }})
+        .catch(error => console.warn("IyadBot styles not loaded:", error));
+}})();"""
+    # json.dumps escapes nothing HTML-significant, so keep "</script>" out of the inline code
+    code = json.dumps(loader).replace("</", "<\\/")
+    return f"""<script>
+const doc = window.parent.document;
+const loader = doc.createElement("script");
+loader.textContent = {code};
+doc.head.appendChild(loader);
+loader.remove();
+</script>"""
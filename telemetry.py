@@ -0,0 +1,205 @@
+"""Per-turn inference metrics for the sidebar and for Prometheus.
+
+Each answered turn records its prompt and generated token counts, prompt
+evaluation and decode times, queue wait and context utilization. Every
+metric is kept as a cumulative Prometheus histogram plus a rolling window
+of recent turns, whose averages the app shows live. The histograms are
+written in Prometheus text format to a file (for node_exporter's textfile
+collector) and can also be served over HTTP.
+
+Script executions are counted as well: full runs and each fragment's
+reruns, next to the user actions that caused them, so the number of runs
+per action can be watched.
+"""
+import bisect
+import os
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+
+@dataclass
+class TurnMetrics:
+    prompt_tokens: int
+    generated_tokens: int
+    prompt_eval_seconds: float
+    decode_seconds: float
+    queue_wait_seconds: float
+    context_utilization: float
+
+
+# Histogram bucket upper bounds and help text per metric
+METRICS = {
+    "prompt_tokens": ((64, 128, 256, 512, 1024, 1536, 2048, 4096), "Tokens in the prompt sent to the model"),
+    "generated_tokens": ((8, 16, 32, 64, 128, 256, 512, 1024), "Tokens generated for the reply"),
+    "prompt_eval_seconds": ((0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30), "Time from request to first token"),
+    "decode_seconds": ((0.5, 1, 2.5, 5, 10, 20, 40, 80), "Time from first to last token"),
+    "queue_wait_seconds": ((0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30), "Time spent waiting for a model slot"),
+    "context_utilization": ((0.1, 0.25, 0.5, 0.75, 0.9, 1.0), "Fraction of n_ctx used by the prompt"),
+}
+
+
+class Histogram:
+    """Cumulative Prometheus buckets plus a window of the most recent observations"""
+
+    def __init__(self, bounds: Sequence[float], window: int = 100):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def mean(self) -> float:
+        """Average over the rolling window"""
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+    def exposition(self, name: str, help_text: str) -> str:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return "\n".join(lines)
+
+
+class Telemetry:
+    """Rolling per-turn metrics shared by every session"""
+
+    def __init__(self, path: Optional[str] = None, window: int = 100, namespace: str = "iyadbot"):
+        self.path = path
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        # One writer at a time, so a newer render is never replaced by an older one
+        self._write_lock = threading.Lock()
+        self.histograms = {name: Histogram(bounds, window) for name, (bounds, _) in METRICS.items()}
+        self.turns = {"model": 0, "cache": 0}
+        self.model_turns: Dict[str, int] = {}
+        self.gauges: Dict[str, Tuple[float, str]] = {}
+        # Script executions by scope ("script" or a fragment name) and user actions by kind
+        self.runs: Dict[str, int] = {}
+        self.actions: Dict[str, int] = {}
+        self._server = None
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def record(self, metrics: TurnMetrics, model: Optional[str] = None):
+        """Add a turn answered by the model (tier `model`) and refresh the metrics file"""
+        with self._lock:
+            for name, value in asdict(metrics).items():
+                self.histograms[name].observe(value)
+            self.turns["model"] += 1
+            if model:
+                self.model_turns[model] = self.model_turns.get(model, 0) + 1
+        self.write()
+
+    def record_cache_hit(self):
+        """Count a turn answered from the response cache (no model work to measure)"""
+        with self._lock:
+            self.turns["cache"] += 1
+        self.write()
+
+    def record_run(self, scope: str = "script"):
+        """Count a full script run or a fragment rerun (written with the next turn)"""
+        with self._lock:
+            self.runs[scope] = self.runs.get(scope, 0) + 1
+
+    def record_action(self, action: str):
+        """Count a user action that may cause a script run"""
+        with self._lock:
+            self.actions[action] = self.actions.get(action, 0) + 1
+
+    def runs_per_action(self, scope: str = "script") -> float:
+        with self._lock:
+            actions = sum(self.actions.values())
+            return self.runs.get(scope, 0) / actions if actions else 0.0
+
+    def set_gauge(self, name: str, value: float, help_text: str):
+        """Export a current value alongside the histograms (written with the next turn)"""
+        with self._lock:
+            self.gauges[name] = (value, help_text)
+
+    def decode_tokens_per_second(self) -> float:
+        """Effective generation speed over the rolling window"""
+        with self._lock:
+            # The first token of a turn comes out of the prompt evaluation
+            tokens = sum(max(n - 1, 0) for n in self.histograms["generated_tokens"].recent)
+            seconds = sum(self.histograms["decode_seconds"].recent)
+        return tokens / seconds if seconds else 0.0
+
+    def averages(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: histogram.mean() for name, histogram in self.histograms.items()}
+
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format"""
+        turns = f"{self.namespace}_turns_total"
+        with self._lock:
+            blocks = [
+                histogram.exposition(f"{self.namespace}_{name}", METRICS[name][1])
+                for name, histogram in self.histograms.items()
+            ]
+            blocks.append("\n".join(
+                [f"# HELP {turns} Answered turns by source", f"# TYPE {turns} counter"]
+                + [f'{turns}{{source="{source}"}} {count}' for source, count in self.turns.items()]
+            ))
+            if self.model_turns:
+                model_turns = f"{self.namespace}_model_turns_total"
+                blocks.append("\n".join(
+                    [f"# HELP {model_turns} Turns answered by each model tier", f"# TYPE {model_turns} counter"]
+                    + [f'{model_turns}{{model="{model}"}} {count}' for model, count in self.model_turns.items()]
+                ))
+            for counter, label, help_text, counts in (
+                ("script_runs_total", "scope", "Script executions: full runs and fragment reruns", self.runs),
+                ("user_actions_total", "action", "User actions that can trigger a script run", self.actions),
+            ):
+                if counts:
+                    counter = f"{self.namespace}_{counter}"
+                    blocks.append("\n".join(
+                        [f"# HELP {counter} {help_text}", f"# TYPE {counter} counter"]
+                        + [f'{counter}{{{label}="{key}"}} {count}' for key, count in counts.items()]
+                    ))
+            for name, (value, help_text) in self.gauges.items():
+                gauge = f"{self.namespace}_{name}"
+                blocks.append(f"# HELP {gauge} {help_text}\n# TYPE {gauge} gauge\n{gauge} {value}")
+        return "\n".join(blocks) + "\n"
+
+    def write(self):
+        if not self.path:
+            return
+        with self._write_lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp_path, self.path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Expose the metrics at http://host:port/metrics from a daemon thread"""
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, name="iyadbot-metrics", daemon=True).start()
@@ -0,0 +1,46 @@
+import json
+
+from batch import BatchRunner, completed_ids, scan
+from benchmark import StubLLM
+from session_engine import SessionEngine
+
+
+def write_lines(path, items):
+    path.write_text("".join(json.dumps(item) + "\n" for item in items), encoding="utf-8")
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_settings_that_are_not_an_object_fail_only_their_line(tmp_path):
+    prompts, results = tmp_path / "prompts.jsonl", tmp_path / "results.jsonl"
+    write_lines(prompts, [{"id": "bad", "prompt": "hi", "settings": ["energy_level"]}, {"id": "ok", "prompt": "hi"}])
+
+    assert sum(len(lines) for lines in scan(str(prompts)).values()) == 2
+    for _ in range(2):
+        BatchRunner(SessionEngine(StubLLM()), str(prompts), str(results), progress=0).run()
+
+    records = read_records(results)
+    assert sorted(record["id"] for record in records) == ["bad", "ok"]
+    records = {record["id"]: record for record in records}
+    assert "settings" in records["bad"]["error"]
+    assert "response" in records["ok"]
+
+
+def test_resume_replaces_error_records(tmp_path):
+    prompts, results = tmp_path / "prompts.jsonl", tmp_path / "results.jsonl"
+    write_lines(prompts, [{"id": "q1", "prompt": "hi"}, {"id": "q2", "prompt": "hey"}])
+    write_lines(results, [{"id": "q1", "error": "RuntimeError()"}, {"id": "q2", "prompt": "hey", "response": "yo"}])
+
+    summary = BatchRunner(SessionEngine(StubLLM()), str(prompts), str(results), progress=0).run()
+
+    assert (summary["answered"], summary["skipped"], summary["failed"]) == (1, 1, 0)
+    assert [(record["id"], "response" in record) for record in read_records(results)] == [("q2", True), ("q1", True)]
+
+
+def test_output_lines_that_are_not_records_are_ignored(tmp_path):
+    results = tmp_path / "results.jsonl"
+    results.write_text('[]\n"x"\n1\n{"id": "q1", "response": "yo"}\n', encoding="utf-8")
+
+    assert completed_ids(str(results)) == {"q1"}
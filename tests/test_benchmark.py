@@ -0,0 +1,24 @@
+from benchmark import StubLLM, format_summary, run_benchmark
+
+CONVERSATIONS = [["hi!", "what's your favourite Genshin character?"], ["recommend an idol song"]]
+
+
+def test_stub_benchmark_reports_every_turn():
+    report = run_benchmark(StubLLM(reply_tokens=8, seconds_per_token=0.001), CONVERSATIONS, repeat=2)
+    summary = report["summary"]
+
+    assert summary["turns"] == len(report["turns"]) == 6
+    assert summary["generated_tokens"] == sum(turn["generated_tokens"] for turn in report["turns"]) > 0
+    assert 0 < summary["evaluated_tokens"] <= summary["prompt_tokens"]
+    assert summary["generation_tokens_per_s"] > 0
+    assert summary["latency_p50_s"] <= summary["latency_p95_s"]
+    assert summary["peak_rss_mb"] > 0
+    assert "turns" in format_summary(summary)
+
+
+def test_stub_replies_are_deterministic():
+    first = run_benchmark(StubLLM(), CONVERSATIONS)["turns"]
+    second = run_benchmark(StubLLM(), CONVERSATIONS)["turns"]
+
+    assert [turn["generated_tokens"] for turn in first] == [turn["generated_tokens"] for turn in second]
+    assert [turn["prompt_tokens"] for turn in first] == [turn["prompt_tokens"] for turn in second]
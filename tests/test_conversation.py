@@ -0,0 +1,43 @@
+from conversation import TokenBudgetMemory
+from conversation_store import ConversationStore
+
+
+def make_store(turns):
+    store = ConversationStore()
+    for i in range(turns):
+        store.append("user", f"question number {i} about genshin pulls and idols")
+        store.append("assistant", f"answer number {i} with plenty of hype and sparkles")
+    return store
+
+
+def test_history_is_trimmed_from_the_oldest_turn_to_fit_the_context():
+    memory = TokenBudgetMemory(store=make_store(40), n_ctx=512, max_tokens=128, record_turns=False)
+    variables = memory.load_memory_variables({"input": "and now?"})
+
+    assert memory.start > 0
+    assert memory.last_usage["used"] <= 512 - 128
+    assert "question number 39" in variables["history"]
+    assert "question number 0 " not in variables["history"]
+    assert variables["history"].startswith(f"(Earlier messages omitted: {memory.start}")
+
+
+def test_trimmed_prefix_stays_stable_for_the_next_turn():
+    store = make_store(40)
+    memory = TokenBudgetMemory(store=store, n_ctx=512, max_tokens=128, record_turns=False)
+    memory.load_memory_variables({"input": "and now?"})
+    start = memory.start
+
+    store.append("user", "one more")
+    store.append("assistant", "sure")
+    memory.load_memory_variables({"input": "and now?"})
+    assert memory.start == start
+
+
+def test_store_keeps_count_of_unloaded_messages():
+    store = make_store(3)
+    store.drop_oldest(2)
+
+    assert (len(store), store.offset, store.total) == (4, 2, 6)
+    assert store[0].content == "question number 1 about genshin pulls and idols"
+    store.clear()
+    assert (len(store), store.total) == (0, 0)
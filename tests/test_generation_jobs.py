@@ -0,0 +1,69 @@
+import threading
+import time
+
+from generation_jobs import QUEUED, RUNNING, JobManager
+from scheduler import InferenceScheduler
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_job_leaves_the_queue_when_admitted_not_on_its_first_token():
+    scheduler = InferenceScheduler()
+    admitted, finish = threading.Event(), threading.Event()
+
+    def work(job):
+        with scheduler.slot(job.session_id, on_wait=job.queued, poll_interval=0.01):
+            job.admitted()
+            admitted.set()
+            # Prompt evaluation: no token reported yet
+            finish.wait(5)
+        return "hi"
+
+    jobs = JobManager(poll_interval=3600)
+    with scheduler.slot("other"):
+        job = jobs.start("a", work)
+        wait_for(lambda: job.position == 1)
+        assert job.status == QUEUED
+
+    assert admitted.wait(5)
+    assert (job.status, job.position, job.text) == (RUNNING, 0, "")
+    finish.set()
+    wait_for(lambda: job.finished)
+
+
+def test_drop_cancels_and_forgets_the_job():
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        while True:
+            job.report("partial")
+            time.sleep(0.01)
+
+    jobs = JobManager(poll_interval=3600)
+    job = jobs.start("a", work)
+    assert started.wait(5)
+    jobs.drop("a")
+
+    assert jobs.get("a") is None
+    wait_for(lambda: job.finished)
+    assert job.cancelled
+
+
+def test_sweep_skips_a_job_whose_end_is_not_recorded_yet():
+    jobs = JobManager(poll_interval=3600, keep_finished=0.0)
+    job = jobs.start("a", lambda job: "hi")
+    wait_for(lambda: job.finished)
+    # As seen by the reaper between the status change and finished_at
+    job.finished_at = None
+    jobs.sweep()
+    assert jobs.get("a") is job
+
+    job.finished_at = time.monotonic() - 1
+    jobs.sweep()
+    assert jobs.get("a") is None
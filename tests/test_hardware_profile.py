@@ -0,0 +1,34 @@
+import threading
+import time
+
+import hardware_profile
+from hardware_profile import calibrate_in_background, default_profile, load_profile, tuned_profile
+
+
+def test_one_background_calibration_saves_the_profile(tmp_path, monkeypatch):
+    model = tmp_path / "model.gguf"
+    model.write_bytes(b"GGUF")
+    path = str(tmp_path / "profile.json")
+    release, calls = threading.Event(), []
+
+    def calibrate(model_path):
+        calls.append(model_path)
+        release.wait(5)
+        return default_profile(model_path)
+
+    monkeypatch.setattr(hardware_profile, "calibrate", calibrate)
+    assert tuned_profile(str(model), path) == default_profile(str(model))
+    assert calibrate_in_background(str(model), path)
+    assert not calibrate_in_background(str(model), path)
+    release.set()
+
+    deadline = time.monotonic() + 5
+    while load_profile(str(model), path) is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert len(calls) == 1
+    # The lock is released once the profile is saved
+    while hardware_profile._calibrating.locked():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert not calibrate_in_background(str(model), path)
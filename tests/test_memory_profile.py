@@ -0,0 +1,25 @@
+import memory_profile
+from memory_profile import DEFAULT_N_CTX, MAX_AUTO_CTX, MemoryProfile, ModelShape, choose_n_ctx
+
+SHAPE = ModelShape("llama", 32, 4096, 32, 8, 32768, 32000, 4 << 30)
+
+
+def test_auto_context_grows_only_with_a_quantized_cache(monkeypatch):
+    plenty = 1 << 40
+    monkeypatch.setattr(memory_profile, "llama_parameters", lambda: frozenset())
+    assert choose_n_ctx(SHAPE, MemoryProfile(kv_type="q8_0"), available=plenty) == DEFAULT_N_CTX
+
+    monkeypatch.setattr(memory_profile, "llama_parameters", lambda: frozenset({"type_k", "type_v", "flash_attn"}))
+    assert choose_n_ctx(SHAPE, MemoryProfile(kv_type="q8_0"), available=plenty) == MAX_AUTO_CTX
+    assert choose_n_ctx(SHAPE, MemoryProfile(kv_type="f16"), available=plenty) == DEFAULT_N_CTX
+
+
+def test_auto_context_fits_the_available_ram(monkeypatch):
+    monkeypatch.setattr(memory_profile, "llama_parameters", lambda: frozenset({"type_k", "type_v", "flash_attn"}))
+    profile = MemoryProfile(kv_type="q8_0")
+    available = 7 << 30
+    n_ctx = choose_n_ctx(SHAPE, profile, instances=2, available=available)
+
+    fitted = MemoryProfile(n_ctx, "q8_0")
+    assert memory_profile.estimate(SHAPE, fitted).resident(2) <= memory_profile.RAM_HEADROOM * available
+    assert DEFAULT_N_CTX < n_ctx < MAX_AUTO_CTX
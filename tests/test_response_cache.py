@@ -0,0 +1,36 @@
+from response_cache import ResponseCache
+
+
+def test_history_free_fallback_is_one_lookup():
+    cache = ResponseCache()
+    cache.put("Hype me up!", "persona", "You got this!", 1.0)
+
+    assert cache.get("hype me up", "persona", ["User: hi"], fuzzy=False, history_free=True) == "You got this!"
+    assert cache.get("hype me up", "persona", ["User: hi"], fuzzy=False) is None
+    assert (cache.stats["hits"], cache.stats["misses"]) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put("one", "persona", "1", 1.0)
+    cache.put("two", "persona", "2", 1.0)
+    assert cache.get("one", "persona") == "1"
+    cache.put("three", "persona", "3", 1.0)
+
+    assert len(cache) == 2
+    assert cache.contains("one", "persona")
+    assert not cache.contains("two", "persona")
+    assert cache.get("threee", "persona") == "3"
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("response_cache.time.monotonic", lambda: now[0])
+    cache = ResponseCache(ttl=60)
+    cache.put("hi", "persona", "hey", 1.0)
+    now[0] += 59
+    assert cache.get("hi", "persona") == "hey"
+
+    now[0] += 2
+    assert cache.get("hi", "persona") is None
+    assert len(cache) == 0
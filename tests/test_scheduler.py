@@ -0,0 +1,37 @@
+import pytest
+
+from scheduler import PRIORITY_NORMAL, PRIORITY_SHORT, InferenceScheduler, QueueFull
+
+
+def admitted(scheduler, tickets):
+    return [ticket for ticket in tickets if ticket.started_at is not None]
+
+
+def test_waiting_requests_are_ordered_by_priority_then_least_recently_served_session():
+    scheduler = InferenceScheduler(concurrency=1)
+    running = scheduler.submit("a")
+    a2 = scheduler.submit("a")
+    b1 = scheduler.submit("b")
+    c1 = scheduler.submit("c", PRIORITY_SHORT)
+    b2 = scheduler.submit("b")
+    assert admitted(scheduler, [running, a2, b1, c1, b2]) == [running]
+
+    # Short replies first, then the sessions "a" has been served before
+    assert [scheduler.position(t) for t in (c1, b1, b2, a2)] == [1, 2, 3, 4]
+
+    order = []
+    for ticket in (running, c1, b1, a2, b2):
+        scheduler.release(ticket)
+        order += [t for t in admitted(scheduler, [a2, b1, c1, b2]) if t not in order]
+    assert order == [c1, b1, a2, b2]
+
+
+def test_queue_limits():
+    scheduler = InferenceScheduler(concurrency=1, max_queue=2, max_per_session=2)
+    scheduler.submit("a")
+    scheduler.submit("a", PRIORITY_NORMAL)
+    with pytest.raises(QueueFull):
+        scheduler.submit("a")
+    scheduler.submit("b")
+    with pytest.raises(QueueFull):
+        scheduler.submit("c")
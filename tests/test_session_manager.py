@@ -0,0 +1,80 @@
+from session_manager import ChatSession, SessionManager
+
+
+def test_peek_does_not_restore_or_refresh():
+    manager = SessionManager(restore=lambda session_id: ChatSession(session_id, None), poll_interval=3600)
+
+    assert manager.peek("a") is None
+    assert len(manager) == 0
+
+    session = manager.get("a")
+    session.last_active -= 100
+    idle_since = session.last_active
+    assert manager.peek("a") is session
+    assert session.last_active == idle_since
+
+
+class Messages:
+    def __len__(self):
+        return 0
+
+    def nbytes(self):
+        return 100
+
+
+class KVCache:
+    def __init__(self):
+        self.sizes = {"a": 1000}
+
+    def session_bytes(self, session_id):
+        return self.sizes.get(session_id, 0)
+
+    def forget(self, session_id):
+        self.sizes.pop(session_id, None)
+
+
+def test_caches_count_towards_footprint_and_are_forgotten_on_evict():
+    manager = SessionManager(restore=lambda session_id: ChatSession(session_id, Messages()), poll_interval=3600)
+    cache = KVCache()
+    manager.add_cache(cache)
+
+    manager.get("a")
+    manager.sweep()
+    assert manager.total_bytes() == 1100
+
+    manager.evict("a")
+    assert cache.sizes == {}
+
+
+class TrimmableMessages(Messages):
+    def __init__(self, count):
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return 100 * self.count
+
+    def drop_oldest(self, n):
+        self.count -= n
+
+
+def test_shrink_waits_for_the_generating_job():
+    busy = {"a"}
+    manager = SessionManager(
+        restore=lambda session_id: ChatSession(session_id, TrimmableMessages(10)),
+        is_busy=lambda session_id: session_id in busy,
+        session_max_bytes=400,
+        poll_interval=3600,
+    )
+    session = manager.get("a")
+    manager.sweep()
+    assert session.over_budget
+
+    manager.get("a")
+    assert len(session.messages) == 10 and session.over_budget
+
+    busy.clear()
+    manager.get("a")
+    assert len(session.messages) < 10 and not session.over_budget
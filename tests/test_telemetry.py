@@ -0,0 +1,25 @@
+import threading
+
+from telemetry import Telemetry, TurnMetrics
+
+
+def test_concurrent_records_write_a_complete_metrics_file(tmp_path):
+    path = tmp_path / "iyadbot.prom"
+    telemetry = Telemetry(str(path))
+    errors = []
+
+    def record():
+        try:
+            for _ in range(50):
+                telemetry.record(TurnMetrics(10, 5, 0.1, 0.2, 0.0, 0.5))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert path.read_text(encoding="utf-8") == telemetry.render()
@@ -0,0 +1,24 @@
+import inspect
+
+import pytest
+
+from memory_profile import MemoryProfile
+from worker_pool import worker_llama_kwargs
+
+
+def test_memory_profile_overrides_worker_defaults():
+    profile = MemoryProfile(n_ctx=4096, use_mmap=False, use_mlock=True)
+    kwargs = worker_llama_kwargs("model.gguf", [0, 1], {"n_batch": 256, **profile.llama_kwargs})
+
+    assert kwargs["use_mmap"] is False
+    assert kwargs["use_mlock"] is True
+    assert kwargs["n_ctx"] == 4096
+    assert kwargs["n_batch"] == 256
+    assert kwargs["n_threads"] == 2
+
+
+def test_worker_kwargs_bind_to_llama():
+    llama_cpp = pytest.importorskip("llama_cpp")
+    kwargs = worker_llama_kwargs("model.gguf", [0], {"seed": 0, **MemoryProfile().llama_kwargs})
+
+    inspect.signature(llama_cpp.Llama).bind(**kwargs)
@@ -0,0 +1,245 @@
+"""Out-of-process llama.cpp workers, each holding an mmapped model replica.
+
+Every worker is a separate process pinned to its own slice of CPU cores and
+talks to the Streamlit process over a multiprocessing pipe, so generation
+never ties up the UI process and N workers serve N generations at once.
+The GGUF file is mmapped by every worker, so replicas share page cache.
+"""
+import multiprocessing
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.llms.base import LLM
+from langchain.schema.output import GenerationChunk
+
+
+def core_slices(n_workers: int) -> List[List[int]]:
+    """Split the cores this process may use into one contiguous slice per worker"""
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    n_workers = max(1, min(n_workers, len(cores)))
+    size = len(cores) // n_workers
+    return [cores[i * size:(i + 1) * size] for i in range(n_workers)]
+
+
+def worker_llama_kwargs(model_path: str, cores: List[int], llama_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Arguments for a worker's Llama: mmapped, one thread per core, overridable by `llama_kwargs`"""
+    return {
+        "model_path": model_path,
+        "n_threads": len(cores) or None,
+        "use_mmap": True,
+        "verbose": False,
+        **llama_kwargs,
+    }
+
+
+def _worker_main(conn, model_path: str, cores: List[int], llama_kwargs: Dict[str, Any]):
+    """Worker process loop: load a replica, then serve generate requests"""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    from llama_cpp import Llama
+
+    try:
+        llm = Llama(**worker_llama_kwargs(model_path, cores, llama_kwargs))
+    except Exception as e:
+        conn.send(("error", repr(e)))
+        return
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        kind = message[0]
+        if kind == "shutdown":
+            break
+        if kind != "generate":
+            # A late cancel for a request that already finished
+            continue
+        _, prompt, params = message
+        try:
+            for part in llm(prompt=prompt, stream=True, **params):
+                conn.send(("token", part["choices"][0]["text"]))
+                if conn.poll() and conn.recv()[0] == "cancel":
+                    break
+            conn.send(("done", None))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+
+class Worker:
+    """Handle on one worker process and its pipe"""
+
+    def __init__(self, index: int, process, conn, cores: List[int]):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.cores = cores
+
+    def generate(self, prompt: str, params: Dict[str, Any]) -> Iterator[str]:
+        """Stream generated text; closing the iterator early cancels the request"""
+        self.conn.send(("generate", prompt, params))
+        finished = False
+        try:
+            while True:
+                kind, payload = self.conn.recv()
+                if kind == "token":
+                    yield payload
+                elif kind == "error":
+                    finished = True
+                    raise RuntimeError(f"Worker {self.index} failed: {payload}")
+                else:
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                # Stop decoding and drain the pipe so the worker is clean for reuse
+                self.conn.send(("cancel",))
+                while self.conn.recv()[0] == "token":
+                    pass
+
+
+class WorkerPool:
+    """A local pool of model replicas with session affinity"""
+
+    def __init__(
+        self,
+        model_path: str,
+        n_workers: int = 2,
+        llama_kwargs: Optional[Dict[str, Any]] = None,
+        startup_timeout: float = 300.0,
+    ):
+        context = multiprocessing.get_context("spawn")
+        self._cond = threading.Condition()
+        self._affinity: Dict[str, int] = {}
+        self.workers: List[Worker] = []
+        for index, cores in enumerate(core_slices(n_workers)):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(child_conn, model_path, cores, llama_kwargs or {}),
+                name=f"iyadbot-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.workers.append(Worker(index, process, parent_conn, cores))
+
+        for worker in self.workers:
+            if not worker.conn.poll(startup_timeout):
+                self.shutdown()
+                raise RuntimeError(f"Worker {worker.index} did not start in time")
+            kind, payload = worker.conn.recv()
+            if kind != "ready":
+                self.shutdown()
+                raise RuntimeError(f"Worker {worker.index} failed to load model: {payload}")
+        self._idle = list(self.workers)
+
+    @property
+    def size(self) -> int:
+        return len(self.workers)
+
+    @contextmanager
+    def worker(self, session_id: Optional[str] = None):
+        """Borrow an idle worker, preferring the one that last served this session"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._idle)
+            preferred = [w for w in self._idle if w.index == self._affinity.get(session_id)]
+            worker = preferred[0] if preferred else self._idle[0]
+            self._idle.remove(worker)
+            if session_id is not None:
+                self._affinity[session_id] = worker.index
+        try:
+            yield worker
+        finally:
+            with self._cond:
+                self._idle.append(worker)
+                self._cond.notify()
+
+    def shutdown(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send(("shutdown",))
+            except (BrokenPipeError, OSError):
+                pass
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+class PooledLlamaCpp(LLM):
+    """LangChain LLM that runs generation on a WorkerPool"""
+
+    pool: Any
+    model_path: str
+    n_ctx: int = 2048
+    max_tokens: int = 256
+    temperature: float = 0.8
+    top_p: float = 0.95
+    stop: List[str] = []
+    tokenizer: Any = None
+    _local = threading.local()
+
+    @property
+    def _llm_type(self) -> str:
+        return "llamacpp_pool"
+
+    @property
+    def concurrency(self) -> int:
+        return self.pool.size
+
+    @contextmanager
+    def session(self, session_id: str):
+        """Route generations from this thread to the worker holding the session's prefix"""
+        self._local.session_id = session_id
+        try:
+            yield self
+        finally:
+            self._local.session_id = None
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        params = {
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "stop": stop or self.stop,
+            **kwargs,
+        }
+        with self.pool.worker(getattr(self._local, "session_id", None)) as worker:
+            tokens = worker.generate(prompt, params)
+            try:
+                for text in tokens:
+                    chunk = GenerationChunk(text=text)
+                    if run_manager:
+                        run_manager.on_llm_new_token(chunk.text)
+                    yield chunk
+            finally:
+                tokens.close()
+
+    def get_num_tokens(self, text: str) -> int:
+        # A vocab-only load reads just the tokenizer, not the weights
+        if self.tokenizer is None:
+            from llama_cpp import Llama
+
+            self.tokenizer = Llama(model_path=self.model_path, vocab_only=True, verbose=False)
+        return len(self.tokenizer.tokenize(text.encode("utf-8")))